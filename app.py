@@ -7,34 +7,36 @@ import click
 import uuid
 import logging
 from logging.handlers import RotatingFileHandler
-import time
 
 from flask import Flask
 from flask.cli import with_appcontext
 from flask_cors import CORS
-from flask_socketio import SocketIO, emit
+from flask_socketio import SocketIO, emit, join_room, leave_room, rooms
 from flask_login import LoginManager, current_user
 from flask_bcrypt import Bcrypt
-from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
 
 import config
 from database import db, init_db, Hub, User
 from routes import init_routes
-from tasks import init_tasks
+import services
+from log_stream import LogBufferHandler, push_log_lines
+from metrics import init_metrics
+from tasks import init_tasks, hub_room, DASHBOARD_ROOM, ADMIN_ROOM
 
 # --- Logging Setup ---
 log_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
 os.makedirs(log_dir, exist_ok=True)
 log_file = os.path.join(log_dir, "app.log")
 
-# Configure root logger to write to a rotating file and the console
+# Configure root logger to write to a rotating file, the console and the admin log viewer's buffer
+log_buffer = LogBufferHandler(config.LOG_BUFFER_LINES)
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s',
     handlers=[
         RotatingFileHandler(log_file, maxBytes=1024*1024, backupCount=5),
-        logging.StreamHandler()
+        logging.StreamHandler(),
+        log_buffer
     ]
 )
 
@@ -58,6 +60,8 @@ login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login' # The name of the login route
 socketio = SocketIO(app, cors_allowed_origins="*")
+# Request, commit and Socket.IO instrumentation for /metrics
+init_metrics(app, socketio)
 
 @login_manager.user_loader
 def load_user(user_id):
@@ -144,53 +148,41 @@ create_or_update_admin(app)
 # Register all the routes from routes.py
 init_routes(app, bcrypt)
 
-# --- Live Log Streaming with Watchdog ---
-class LogChangeHandler(FileSystemEventHandler):
-    def __init__(self, socketio_instance, file_path):
-        self.socketio = socketio_instance
-        self.file_path = file_path
-        try:
-            self.last_pos = os.path.getsize(file_path)
-        except OSError:
-            self.last_pos = 0
-
-    def on_modified(self, event):
-        if event.src_path == self.file_path:
-            try:
-                with open(self.file_path, 'r') as f:
-                    f.seek(self.last_pos)
-                    new_lines = f.readlines()
-                    self.last_pos = f.tell()
-                    if new_lines:
-                        self.socketio.emit('new_log_line', {'lines': new_lines}, namespace='/logs')
-            except Exception as e:
-                logging.error(f"Error reading log file for streaming: {e}")
-
-def start_log_watcher(socketio_instance):
-    if not os.path.exists(log_file):
-        with open(log_file, 'w'): pass
-
-    event_handler = LogChangeHandler(socketio_instance, log_file)
-    observer = Observer()
-    observer.schedule(event_handler, path=log_dir, recursive=False)
-    observer.start()
-    logging.info("Log file watcher started.")
-    try:
-        while True:
-            time.sleep(1)
-    except KeyboardInterrupt:
-        observer.stop()
-    observer.join()
-
 # --- Socket.IO Event Handlers ---
+@socketio.on('connect')
+def handle_connect():
+    if current_user.is_authenticated:
+        join_room(ADMIN_ROOM)
+
+@socketio.on('subscribe_hubs')
+def handle_subscribe_hubs(data):
+    """
+    Puts a dashboard client in the rooms of the hubs it displays, leaving any
+    it no longer shows. Returns the current versions of those hubs so the
+    client can refetch anything it missed while disconnected.
+    """
+    iatas = set()
+    for iata in (data or {}).get('iatas') or []:
+        iata = str(iata).strip().upper()
+        if iata.isalnum() and len(iata) <= 4:
+            iatas.add(iata)
+    wanted_rooms = {hub_room(iata) for iata in iatas}
+    for room in rooms():
+        if room.startswith(hub_room('')) and room not in wanted_rooms:
+            leave_room(room)
+    for room in wanted_rooms:
+        join_room(room)
+    join_room(DASHBOARD_ROOM)
+    return services.get_hub_versions(sorted(iatas))
+
 @socketio.on('hub_order_change')
 def handle_hub_order_change(data):
     """
     Receives a new hub order from a client,
-    and broadcasts it to all clients.
+    and sends it to all open dashboards.
     """
-    logging.info(f"Hub order change received, broadcasting to clients: {data}")
-    emit('hub_order_update', data, broadcast=True)
+    logging.info(f"Hub order change received, sending to dashboards: {data}")
+    emit('hub_order_update', data, to=DASHBOARD_ROOM)
 
 @socketio.on('connect', namespace='/logs')
 def handle_log_connect():
@@ -199,21 +191,15 @@ def handle_log_connect():
         return False # Reject connection
     
     logging.info("Log viewer client connected.")
-    try:
-        with open(log_file, 'r') as f:
-            lines = f.readlines()
-            last_100_lines = lines[-100:]
-            emit('initial_logs', {'lines': last_100_lines})
-    except Exception as e:
-        logging.error(f"Could not send initial logs: {e}")
+    emit('initial_logs', {'lines': log_buffer.tail(config.LOG_TAIL_LINES)})
 
 # --- Background Tasks ---
 # Start background threads for data fetching
 init_tasks(app, socketio)
 
-# Start the log watcher in a background thread
-log_watcher_thread = threading.Thread(target=start_log_watcher, args=(socketio,), daemon=True)
-log_watcher_thread.start()
+# Stream new log lines to the admin log viewer in a background thread
+log_push_thread = threading.Thread(target=push_log_lines, args=(log_buffer, socketio), daemon=True)
+log_push_thread.start()
 
 # --- Main Execution ---
 if __name__ == "__main__":
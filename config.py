@@ -13,12 +13,62 @@ DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
 os.makedirs(DATA_DIR, exist_ok=True)
 LOG_FILE = os.path.join(DATA_DIR, "daily.log.json")
 
+# --- Admin Log Stream ---
+# Recent log lines are kept in memory for /admin/logs (see log_stream.py); app.log is only written.
+LOG_BUFFER_LINES = 2000 # Lines kept, and the most queued for the viewer between pushes
+LOG_TAIL_LINES = 100 # Lines sent to a viewer when it connects
+LOG_PUSH_INTERVAL = 0.5 # Minimum seconds between batches pushed to viewers
+
+# --- Metrics ---
+# /metrics serves Prometheus text format. If a token is set, scrapers must send "Authorization: Bearer <token>".
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
 # --- Database Configuration ---
 SQLALCHEMY_DATABASE_URI = f'sqlite:///{os.path.join(DATA_DIR, "weatherlog.db")}'
 SQLALCHEMY_BINDS = {
     'airports': f'sqlite:///{os.path.join(DATA_DIR, "airports.db")}'
 }
 SQLALCHEMY_TRACK_MODIFICATIONS = False
+# SQLite settings applied to every connection of both binds (see database.apply_sqlite_pragmas).
+# WAL lets the dashboard read while the refresh job or an import writes; with
+# synchronous=NORMAL a power loss can drop the last commits but never corrupts the file.
+SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 15000)) # Wait this long for a lock instead of failing
+SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)) # Bytes of the file read through mmap, 0 disables
+SQLITE_CACHE_SIZE_KB = int(os.environ.get('SQLITE_CACHE_SIZE_KB', 32 * 1024)) # Page cache per connection
+# Store snapshot/weather JSON and forecast discussions zlib-compressed (see database.CompressedText).
+# Existing rows are recompressed in the background once this is turned on.
+COMPRESS_JSON_COLUMNS = os.environ.get('COMPRESS_JSON_COLUMNS', 'false').lower() in ('1', 'true', 'yes')
+JSON_COMPRESSION_LEVEL = 6
+
+# --- Background Refresh ---
+# Number of hubs fetched in parallel by the data refresh job.
+# Database writes always happen on the refresh thread itself.
+REFRESH_MAX_WORKERS = int(os.environ.get('REFRESH_MAX_WORKERS', 8))
+
+# --- Snapshot Retention ---
+# Snapshots of days older than this are rolled up into one SnapshotArchive row per hub and day,
+# keeping each hour's forecast period and FAA data plus the day's last full snapshot. The hourly
+# snapshots are deleted, so this is opt-in: 0 (the default) keeps everything.
+SNAPSHOT_RETENTION_DAYS = int(os.environ.get('SNAPSHOT_RETENTION_DAYS', 0))
+SNAPSHOT_ROLLUP_BATCH_DAYS = 24 # Hub-days rolled up per refresh cycle
+SNAPSHOT_VACUUM_PAGES = 2048 # Free database pages returned to the filesystem per refresh cycle
+DAY_SUMMARY_BATCH_DAYS = 48 # Calendar day summaries (re)computed per refresh cycle
+
+# --- API Response Cache ---
+# Rendered /api/weather responses kept in memory, keyed by (iata, date).
+# Entries are dropped when the refresh job writes new data for the hub.
+WEATHER_RESPONSE_CACHE_SIZE = int(os.environ.get('WEATHER_RESPONSE_CACHE_SIZE', 1024))
+
+# --- Outbound HTTP ---
+# api.weather.gov asks every client to identify itself with a User-Agent containing contact info.
+HTTP_USER_AGENT = os.environ.get('HTTP_USER_AGENT') or '(iropapp, https://github.com/ShawnMarkOh/iropapp)'
+HTTP_RETRIES = int(os.environ.get('HTTP_RETRIES', 3))
+HTTP_BACKOFF_FACTOR = float(os.environ.get('HTTP_BACKOFF_FACTOR', 0.5)) # Sleeps 0.5s, 1s, 2s... between retries
+HTTP_BACKOFF_JITTER = float(os.environ.get('HTTP_BACKOFF_JITTER', 0.5)) # Up to this many random seconds added to each sleep
+HTTP_POOL_HOSTS = 10 # Number of hosts with a kept-alive connection pool
+HTTP_POOL_MAXSIZE = max(REFRESH_MAX_WORKERS, 10) # Keep-alive connections per host
 
 # --- Airport Hubs Data ---
 # NOTE: The lists below are now only used to seed the database on the first run.
@@ -212,9 +262,13 @@ INACTIVE_HUBS = [
 ]
 
 # --- Caching ---
-FAA_EVENTS_CACHE = {}
+# Parsed ops plan events indexed by base UTC date, then IATA. Rebuilt when the ops plan document or the UTC hour changes.
+FAA_EVENTS_CACHE = {"json": None, "hour": None, "by_day": {}}
 FAA_EVENTS_CACHE_TIME = {}
-FAA_OPS_PLAN_URL_CACHE = {"json": None, "time": None}
+# Last good ops plan document. "time" is when it was fetched; failed attempts never clear "json".
+FAA_OPS_PLAN_URL_CACHE = {"json": None, "time": None, "last_attempt": None, "last_error": None, "refreshing": False}
 GROUND_STOPS_CACHE = {"json": None, "time": None}
 GROUND_DELAYS_CACHE = {"json": None, "time": None}
+# Parsed FAA airport status feed plus the validators for conditional GETs.
+FAA_AIRPORT_STATUS_CACHE = {"json": None, "time": None, "etag": None, "last_modified": None}
 # --- END OF FILE config.py ---
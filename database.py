@@ -1,12 +1,71 @@
 # --- START OF FILE database.py ---
 
 import json
+import zlib
+import hashlib
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
+from sqlalchemy import text, event, select, func, cast, tuple_, LargeBinary
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.types import TypeDecorator
+
+import config
 
 db = SQLAlchemy()
 
+# --- Compressed Text Columns ---
+# Values are written as zlib streams primed with a preset dictionary of the
+# strings that repeat in every NWS forecast period, which lets even a single
+# short period compress well. Rows stay plain text unless COMPRESS_JSON_COLUMNS
+# is on, and both forms can be mixed in a table since SQLite stores a BLOB in
+# a TEXT column as-is. The prefix identifies the dictionary, so ZDICT_V1 must
+# never change; a new dictionary needs a new prefix.
+COMPRESSED_PREFIX = b"\x00zj1"
+ZDICT_V1 = (
+    b'"unitCode": "wmoUnit:degC", "value": "unitCode": "wmoUnit:percent", "value": '
+    b'"probabilityOfPrecipitation": {"dewpoint": {"relativeHumidity": {"temperatureTrend": null, '
+    b'"icon": "https://api.weather.gov/icons/land/day/"icon": "https://api.weather.gov/icons/land/night/'
+    b'"windDirection": "NNW", "windSpeed": " mph", "windGust": null, "temperatureUnit": "F", '
+    b'"isDaytime": false, "isDaytime": true, "temperature": "endTime": "-04:00", "startTime": "-05:00", '
+    b'"number": "name": "", "shortForecast": "Mostly Sunny", "Partly Cloudy", "Mostly Cloudy", '
+    b'"Chance Showers And Thunderstorms", "Slight Chance Rain Showers", "detailedForecast": "'
+    b'A chance of showers and thunderstorms. Mostly sunny, with a high near . Partly cloudy, with a low around . '
+    b'Chance of precipitation is %. New rainfall amounts between a tenth and quarter of an inch possible. '
+    b'wind  to  mph, with gusts as high as  mph. Southwest wind Northwest wind Northeast wind Southeast wind'
+)
+
+def compress_text(value):
+    compressor = zlib.compressobj(config.JSON_COMPRESSION_LEVEL, zdict=ZDICT_V1)
+    return COMPRESSED_PREFIX + compressor.compress(value.encode("utf-8")) + compressor.flush()
+
+def decompress_text(value):
+    """Returns stored text, decompressing it if it was written compressed."""
+    if isinstance(value, (bytes, memoryview)):
+        value = bytes(value)
+        if value.startswith(COMPRESSED_PREFIX):
+            decompressor = zlib.decompressobj(zdict=ZDICT_V1)
+            value = decompressor.decompress(value[len(COMPRESSED_PREFIX):]) + decompressor.flush()
+        return value.decode("utf-8")
+    return value
+
+class CompressedText(TypeDecorator):
+    """Text column compressed on write when COMPRESS_JSON_COLUMNS is on. Reads handle both forms."""
+    impl = db.Text
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is not None and config.COMPRESS_JSON_COLUMNS:
+            return compress_text(value)
+        return value
+
+    def process_result_value(self, value, dialect):
+        return decompress_text(value)
+
 class User(db.Model, UserMixin):
     __bind_key__ = 'airports' # Store users in the same DB as hubs
     id = db.Column(db.Integer, primary_key=True)
@@ -48,11 +107,37 @@ class Hub(db.Model):
             "runways": runways
         }
 
+class NwsGridPoint(db.Model):
+    """The api.weather.gov /points lookup for a hub, valid for as long as the hub's lat/lon don't change."""
+    __bind_key__ = 'airports'
+    id = db.Column(db.Integer, primary_key=True)
+    iata = db.Column(db.String(4), unique=True, nullable=False, index=True)
+    lat = db.Column(db.Float, nullable=False)
+    lon = db.Column(db.Float, nullable=False)
+    forecast_url = db.Column(db.Text, nullable=False)
+    forecast_hourly_url = db.Column(db.Text, nullable=False)
+    timezone = db.Column(db.String(50), nullable=False)
+    forecast_zone = db.Column(db.Text)
+    cwa = db.Column(db.String(10))
+    last_updated = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def as_dict(self):
+        return {
+            "forecast": self.forecast_url,
+            "forecastHourly": self.forecast_hourly_url,
+            "timezone": self.timezone,
+            "forecastZone": self.forecast_zone,
+            "cwa": self.cwa
+        }
+
 class HourlyWeather(db.Model):
+    __table_args__ = (
+        db.Index('ux_hourly_weather_iata_start_time', 'iata', 'start_time', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
     iata = db.Column(db.String(4), index=True, nullable=False)
     start_time = db.Column(db.String(40), index=True, nullable=False)
-    data_json = db.Column(db.Text, nullable=False)
+    data_json = db.Column(CompressedText, nullable=False)
     date = db.Column(db.String(10), index=True, nullable=False)
 
     def as_dict(self):
@@ -63,29 +148,387 @@ class HourlyWeather(db.Model):
         }
 
 class HourlySnapshot(db.Model):
+    __table_args__ = (
+        db.Index('ux_hourly_snapshot_iata_date_hour', 'iata', 'date', 'hour', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
     iata = db.Column(db.String(4), index=True, nullable=False)
     date = db.Column(db.String(10), index=True, nullable=False)
     hour = db.Column(db.Integer, index=True, nullable=False)
-    snapshot_json = db.Column(db.Text, nullable=False)
+    snapshot_json = db.Column(CompressedText, nullable=False)
+
+    def content(self):
+        """The decoded snapshot with any deduplicated sections reassembled."""
+        return unpack_snapshot(json.loads(self.snapshot_json))
+
     def as_dict(self):
         return {
             "iata": self.iata,
             "date": self.date,
             "hour": self.hour,
-            **json.loads(self.snapshot_json)
+            **self.content()
+        }
+
+class SnapshotBlob(db.Model):
+    """A snapshot section stored once and referenced by its SHA-256 from any number of snapshots."""
+    id = db.Column(db.Integer, primary_key=True)
+    hash = db.Column(db.String(64), unique=True, nullable=False, index=True)
+    content = db.Column(CompressedText, nullable=False)
+
+# --- Snapshot Section Deduplication ---
+# The large parts of snapshot["weather"] repeat between consecutive hours and
+# between hubs sharing a forecast office, so they are stored as SnapshotBlob rows
+# and replaced in snapshot_json by {"$blob": "<sha256>"}.
+BLOB_SECTIONS = ("hourly", "daily", "alerts", "aviation_forecast")
+BLOB_REF_KEY = "$blob"
+BLOB_MIN_BYTES = 256 # Smaller sections stay inline
+BLOB_CACHE_SIZE = 1024
+
+_blob_cache = OrderedDict() # hash -> decoded section. Blobs are immutable, so entries never go stale.
+_blob_cache_lock = threading.Lock()
+
+def pack_snapshot(snapshot):
+    """
+    Splits the large weather sections out of a snapshot.
+    Returns (snapshot_json, blobs) where blobs maps hash -> serialized section.
+    """
+    weather = snapshot.get("weather")
+    if not isinstance(weather, dict):
+        return json.dumps(snapshot), {}
+    blobs = {}
+    packed_weather = dict(weather)
+    for key in BLOB_SECTIONS:
+        if packed_weather.get(key) is None:
+            continue
+        content = json.dumps(packed_weather[key], sort_keys=True)
+        if len(content) < BLOB_MIN_BYTES:
+            continue
+        blob_hash = hashlib.sha256(content.encode("utf-8")).hexdigest()
+        blobs[blob_hash] = content
+        packed_weather[key] = {BLOB_REF_KEY: blob_hash}
+    return json.dumps({**snapshot, "weather": packed_weather}), blobs
+
+def _is_blob_ref(value):
+    return isinstance(value, dict) and len(value) == 1 and BLOB_REF_KEY in value
+
+def load_blobs(hashes):
+    """Returns {hash: decoded section}, reading only the hashes not already cached."""
+    found = {}
+    missing = []
+    with _blob_cache_lock:
+        for blob_hash in hashes:
+            if blob_hash in _blob_cache:
+                _blob_cache.move_to_end(blob_hash)
+                found[blob_hash] = _blob_cache[blob_hash]
+            else:
+                missing.append(blob_hash)
+    if missing:
+        rows = db.session.query(SnapshotBlob.hash, SnapshotBlob.content).filter(SnapshotBlob.hash.in_(missing)).all()
+        with _blob_cache_lock:
+            for blob_hash, content in rows:
+                found[blob_hash] = _blob_cache[blob_hash] = json.loads(content)
+            while len(_blob_cache) > BLOB_CACHE_SIZE:
+                _blob_cache.popitem(last=False)
+    return found
+
+def _blob_refs(snapshot):
+    weather = snapshot.get("weather")
+    if not isinstance(weather, dict):
+        return {}
+    return {key: value[BLOB_REF_KEY] for key, value in weather.items() if _is_blob_ref(value)}
+
+def snapshot_blob_hashes(snapshot_json):
+    """Returns the hashes of the blobs a stored snapshot_json value (plain or compressed) references."""
+    try:
+        return set(_blob_refs(json.loads(decompress_text(snapshot_json))).values())
+    except (json.JSONDecodeError, AttributeError, TypeError):
+        return set()
+
+def unpack_snapshots(snapshots):
+    """
+    Replaces blob references in a list of decoded snapshots with their sections,
+    reading the blobs of all of them at once.
+    Sections come from a shared cache and must not be mutated.
+    """
+    refs = [_blob_refs(snapshot) for snapshot in snapshots]
+    blobs = load_blobs({blob_hash for snapshot_refs in refs for blob_hash in snapshot_refs.values()})
+    unpacked = []
+    for snapshot, snapshot_refs in zip(snapshots, refs):
+        if not snapshot_refs:
+            unpacked.append(snapshot)
+            continue
+        unpacked_weather = dict(snapshot["weather"])
+        for key, blob_hash in snapshot_refs.items():
+            if blob_hash in blobs:
+                unpacked_weather[key] = blobs[blob_hash]
+            else:
+                logging.error(f"Snapshot references missing blob {blob_hash} for section '{key}'.")
+                unpacked_weather[key] = None
+        unpacked.append({**snapshot, "weather": unpacked_weather})
+    return unpacked
+
+def unpack_snapshot(snapshot):
+    """Replaces blob references in a decoded snapshot with their sections."""
+    return unpack_snapshots([snapshot])[0]
+
+class SnapshotArchive(db.Model):
+    """The snapshots of a hub-day past the retention period, rolled up by services.roll_up_snapshots."""
+    __table_args__ = (
+        db.Index('ux_snapshot_archive_iata_date', 'iata', 'date', unique=True),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    iata = db.Column(db.String(4), index=True, nullable=False)
+    date = db.Column(db.String(10), index=True, nullable=False)
+    # {"hours": [{"hour", "period", "ground_stop", "ground_delay", "faa_events"}, ...],
+    #  "final_hour": int, "final": the packed snapshot of final_hour}
+    archive_json = db.Column(CompressedText, nullable=False)
+
+    def as_snapshots(self):
+        """
+        Expands the archive into /api/hourly-snapshots entries. Hours other than
+        the last only carry their own forecast period and FAA data.
+        """
+        archive = json.loads(self.archive_json)
+        final = unpack_snapshot(archive["final"])
+        timezone = (final.get("weather") or {}).get("timezone")
+        snapshots = []
+        for entry in archive["hours"]:
+            if entry["hour"] == archive["final_hour"]:
+                snapshots.append({"iata": self.iata, "date": self.date, "hour": entry["hour"], **final})
+                continue
+            snapshots.append({
+                "iata": self.iata,
+                "date": self.date,
+                "hour": entry["hour"],
+                "weather": {"hourly": [entry["period"]] if entry["period"] else [], "timezone": timezone},
+                "faa_events": entry["faa_events"],
+                "ground_stop": entry["ground_stop"],
+                "ground_delay": entry["ground_delay"]
+            })
+        return snapshots
+
+def archive_blob_hashes(archive_json):
+    """Returns the hashes of the blobs a stored archive_json value (plain or compressed) references."""
+    try:
+        return set(_blob_refs(json.loads(decompress_text(archive_json))["final"]).values())
+    except (json.JSONDecodeError, AttributeError, TypeError, KeyError):
+        return set()
+
+class DayCoverage(db.Model):
+    """
+    What is stored for a hub and day, so date listings and /db_status don't scan
+    the data tables. Kept current by update_day_coverage from every write path.
+    """
+    __table_args__ = (
+        db.Index('ux_day_coverage_iata_date', 'iata', 'date', unique=True),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    iata = db.Column(db.String(4), index=True, nullable=False)
+    date = db.Column(db.String(10), index=True, nullable=False)
+    weather_hours = db.Column(db.Integer, default=0, nullable=False) # HourlyWeather rows
+    snapshot_hours = db.Column(db.Integer, default=0, nullable=False) # Hours with a snapshot, live or archived
+    first_hour = db.Column(db.Integer)
+    last_hour = db.Column(db.Integer)
+    archived = db.Column(db.Boolean, default=False, nullable=False)
+    stored_bytes = db.Column(db.Integer, default=0, nullable=False) # Excluding shared SnapshotBlob rows
+
+    def as_dict(self):
+        return {
+            "iata": self.iata,
+            "date": self.date,
+            "weather_hours": self.weather_hours,
+            "snapshot_hours": self.snapshot_hours,
+            "first_hour": self.first_hour,
+            "last_hour": self.last_hour,
+            "archived": self.archived,
+            "stored_bytes": self.stored_bytes
         }
 
+class DaySummary(db.Model):
+    """
+    A hub's day as the calendar shows it, scored from its snapshots. Rows are
+    removed by update_day_coverage when the day's data changes and recomputed
+    by services.refresh_day_summaries.
+    """
+    __table_args__ = (
+        db.Index('ux_day_summary_iata_date', 'iata', 'date', unique=True),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    iata = db.Column(db.String(4), index=True, nullable=False)
+    date = db.Column(db.String(10), index=True, nullable=False)
+    risk_class = db.Column(db.String(20), nullable=False) # Daily assessment class, e.g. "risk-high"
+    risk_summary = db.Column(db.String(40), nullable=False)
+    percent_high = db.Column(db.Integer, default=0, nullable=False)
+    percent_partial = db.Column(db.Integer, default=0, nullable=False)
+    high_hours = db.Column(db.Integer, default=0, nullable=False)
+    ground_stop_hours = db.Column(db.Integer, default=0, nullable=False)
+    ground_delay_hours = db.Column(db.Integer, default=0, nullable=False)
+    snapshot_hours = db.Column(db.Integer, default=0, nullable=False)
+    hub_hash = db.Column(db.String(16), nullable=False) # Hub settings scored with; edits rescore the day
+
+    def as_dict(self):
+        return {
+            "risk_class": self.risk_class,
+            "risk_summary": self.risk_summary,
+            "percent_high": self.percent_high,
+            "percent_partial": self.percent_partial,
+            "high_hours": self.high_hours,
+            "ground_stop_hours": self.ground_stop_hours,
+            "ground_delay_hours": self.ground_delay_hours,
+            "snapshot_hours": self.snapshot_hours
+        }
+
+COVERAGE_CHUNK_KEYS = 200
+
+def update_day_coverage(keys):
+    """
+    Recomputes the DayCoverage rows of the given (iata, date) pairs from the
+    data tables, deleting rows for days with nothing stored, and drops their
+    now outdated DaySummary rows. The caller is responsible for committing.
+    """
+    keys = sorted(set(keys))
+    weather = HourlyWeather.__table__
+    snapshot = HourlySnapshot.__table__
+    archive = SnapshotArchive.__table__
+    coverage = DayCoverage.__table__
+    summary = DaySummary.__table__
+    for i in range(0, len(keys), COVERAGE_CHUNK_KEYS):
+        chunk = keys[i:i + COVERAGE_CHUNK_KEYS]
+        iatas = {iata for iata, date in chunk}
+        dates = {date for iata, date in chunk}
+        stats = {key: {"weather_hours": 0, "hours": set(), "archived": False, "stored_bytes": 0} for key in chunk}
+
+        for iata, date, count, size in db.session.execute(
+            select(weather.c.iata, weather.c.date, func.count(), func.sum(func.length(cast(weather.c.data_json, LargeBinary))))
+            .where(weather.c.iata.in_(iatas), weather.c.date.in_(dates))
+            .group_by(weather.c.iata, weather.c.date)
+        ):
+            if (iata, date) in stats:
+                stats[(iata, date)]["weather_hours"] = count
+                stats[(iata, date)]["stored_bytes"] += size or 0
+
+        for iata, date, hour, size in db.session.execute(
+            select(snapshot.c.iata, snapshot.c.date, snapshot.c.hour, func.length(cast(snapshot.c.snapshot_json, LargeBinary)))
+            .where(snapshot.c.iata.in_(iatas), snapshot.c.date.in_(dates))
+        ):
+            if (iata, date) in stats:
+                stats[(iata, date)]["hours"].add(hour)
+                stats[(iata, date)]["stored_bytes"] += size or 0
+
+        for iata, date, archive_json, size in db.session.execute(
+            select(archive.c.iata, archive.c.date, archive.c.archive_json, func.length(cast(archive.c.archive_json, LargeBinary)))
+            .where(archive.c.iata.in_(iatas), archive.c.date.in_(dates))
+        ):
+            if (iata, date) in stats:
+                stats[(iata, date)]["archived"] = True
+                stats[(iata, date)]["hours"].update(entry["hour"] for entry in json.loads(archive_json)["hours"])
+                stats[(iata, date)]["stored_bytes"] += size or 0
+
+        rows, empty = [], []
+        for (iata, date), day in stats.items():
+            if not day["weather_hours"] and not day["hours"]:
+                empty.append((iata, date))
+                continue
+            rows.append({
+                "iata": iata,
+                "date": date,
+                "weather_hours": day["weather_hours"],
+                "snapshot_hours": len(day["hours"]),
+                "first_hour": min(day["hours"], default=None),
+                "last_hour": max(day["hours"], default=None),
+                "archived": day["archived"],
+                "stored_bytes": day["stored_bytes"]
+            })
+        if rows:
+            stmt = insert(coverage)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["iata", "date"],
+                set_={key: stmt.excluded[key] for key in rows[0] if key not in ("iata", "date")}
+            )
+            db.session.execute(stmt, rows)
+        if empty:
+            db.session.execute(coverage.delete().where(tuple_(coverage.c.iata, coverage.c.date).in_(empty)))
+        db.session.execute(summary.delete().where(tuple_(summary.c.iata, summary.c.date).in_(chunk)))
+
+def rebuild_day_coverage():
+    """Recomputes DayCoverage for every stored day. The caller is responsible for committing."""
+    keys = db.session.execute(text(
+        "SELECT iata, date FROM hourly_weather UNION SELECT iata, date FROM hourly_snapshot "
+        "UNION SELECT iata, date FROM snapshot_archive"
+    )).fetchall()
+    db.session.execute(DayCoverage.__table__.delete())
+    update_day_coverage((iata, date) for iata, date in keys)
+    return len(keys)
+
 class AviationForecastDiscussion(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     cwa = db.Column(db.String(10), unique=True, nullable=False, index=True)
-    discussion_text = db.Column(db.Text, nullable=False)
+    discussion_text = db.Column(CompressedText, nullable=False)
     last_updated = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     def __repr__(self):
         return f'<AviationForecastDiscussion {self.cwa}>'
 
+# Natural keys enforced with unique indexes: (table, index name, columns, which duplicate to keep).
+# HourlyWeather keeps the first logged row, HourlySnapshot the most recently written one.
+UNIQUE_KEYS = [
+    ('hourly_weather', 'ux_hourly_weather_iata_start_time', ('iata', 'start_time'), 'MIN'),
+    ('hourly_snapshot', 'ux_hourly_snapshot_iata_date_hour', ('iata', 'date', 'hour'), 'MAX'),
+]
+
+def migrate_unique_keys():
+    """
+    Adds the composite unique indexes to databases created before they existed,
+    first deleting any rows that would violate them.
+    """
+    with db.engine.begin() as conn:
+        for table, index_name, columns, keep in UNIQUE_KEYS:
+            exists = conn.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = :name"),
+                {"name": index_name}
+            ).first()
+            if exists:
+                continue
+            cols = ", ".join(columns)
+            removed = conn.execute(text(
+                f"DELETE FROM {table} WHERE id NOT IN (SELECT {keep}(id) FROM {table} GROUP BY {cols})"
+            )).rowcount
+            conn.execute(text(f"CREATE UNIQUE INDEX {index_name} ON {table} ({cols})"))
+            logging.info(f"Created unique index {index_name} on {table} ({removed} duplicate rows removed).")
+
+def migrate_day_coverage():
+    """Fills DayCoverage for databases created before it existed."""
+    if DayCoverage.query.first() or not (HourlyWeather.query.first() or HourlySnapshot.query.first() or SnapshotArchive.query.first()):
+        return
+    days = rebuild_day_coverage()
+    db.session.commit()
+    logging.info(f"Built day coverage for {days} hub-days.")
+
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    """Configures each new SQLite connection from the SQLite settings in config.py."""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    try:
+        # busy_timeout first, so switching the journal mode waits for other connections too.
+        cursor.execute(f"PRAGMA busy_timeout = {int(config.SQLITE_BUSY_TIMEOUT_MS)}")
+        # Before journal_mode, which writes the header of a new database. On an existing
+        # database it only takes effect after a VACUUM (see services.vacuum_database).
+        cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        cursor.execute(f"PRAGMA journal_mode = {config.SQLITE_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA synchronous = {config.SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA mmap_size = {int(config.SQLITE_MMAP_SIZE)}")
+        cursor.execute(f"PRAGMA cache_size = -{int(config.SQLITE_CACHE_SIZE_KB)}")
+    finally:
+        cursor.close()
+
 def init_db(app):
     with app.app_context():
+        for engine in db.engines.values():
+            if engine.dialect.name == "sqlite":
+                event.listen(engine, "connect", apply_sqlite_pragmas)
+                engine.dispose() # Connections opened before the listener are reopened with the pragmas
         db.create_all()
+        migrate_unique_keys()
+        migrate_day_coverage()
 # --- END OF FILE database.py ---
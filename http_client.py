@@ -0,0 +1,151 @@
+# --- START OF FILE http_client.py ---
+
+import re
+import time
+import threading
+from email.utils import parsedate_to_datetime
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import config
+import metrics
+
+_session = None
+_session_lock = threading.Lock()
+
+# Parsed JSON responses keyed by URL, with the validators needed to revalidate them.
+RESPONSE_CACHE = {}
+RESPONSE_CACHE_STATS = {"fresh": 0, "revalidated": 0, "downloaded": 0}
+_cache_lock = threading.Lock()
+
+def _build_session():
+    retry = Retry(
+        total=config.HTTP_RETRIES,
+        backoff_factor=config.HTTP_BACKOFF_FACTOR,
+        backoff_jitter=config.HTTP_BACKOFF_JITTER,
+        backoff_max=30,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(["GET", "HEAD"]),
+        respect_retry_after_header=True,
+        raise_on_status=False, # Callers use raise_for_status() on the final response
+    )
+    # One urllib3 pool per host, each keeping up to HTTP_POOL_MAXSIZE keep-alive
+    # connections so every refresh worker can hold its own socket to api.weather.gov.
+    adapter = HTTPAdapter(
+        pool_connections=config.HTTP_POOL_HOSTS,
+        pool_maxsize=config.HTTP_POOL_MAXSIZE,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.headers.update({"User-Agent": config.HTTP_USER_AGENT})
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def get_session():
+    """Returns the process-wide session. urllib3's connection pools are thread-safe."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+def get(url, timeout=15, upstream="other", **kwargs):
+    """
+    Drop-in replacement for requests.get that reuses pooled keep-alive connections.
+    Latency and failures are recorded in metrics under the given upstream name.
+    """
+    started = time.perf_counter()
+    try:
+        resp = get_session().get(url, timeout=timeout, **kwargs)
+    except requests.RequestException as e:
+        metrics.observe_upstream(upstream, started, error=e)
+        raise
+    metrics.observe_upstream(upstream, started, response=resp)
+    return resp
+
+def _fresh_until(headers, now):
+    """Computes when a response stops being fresh from Cache-Control max-age, Age and Expires."""
+    cache_control = headers.get("Cache-Control", "").lower()
+    if "no-store" in cache_control or "no-cache" in cache_control:
+        return now
+    match = re.search(r"max-age=(\d+)", cache_control)
+    if match:
+        try:
+            age = int(headers.get("Age", 0))
+        except ValueError:
+            age = 0
+        return now + max(0, int(match.group(1)) - age)
+    if headers.get("Expires"):
+        try:
+            return parsedate_to_datetime(headers["Expires"]).timestamp()
+        except (TypeError, ValueError):
+            pass
+    return now
+
+def get_cached_json(url, timeout=15, upstream="other", **kwargs):
+    """
+    Returns the parsed JSON body of a GET, served from RESPONSE_CACHE while the
+    response is fresh per Cache-Control. Once stale, the request is revalidated
+    with If-None-Match / If-Modified-Since and a 304 returns the cached object
+    without downloading or parsing the document again.
+    The returned object is shared between callers and must not be mutated.
+    Raises requests.RequestException like requests.get + raise_for_status().
+    """
+    now = time.time()
+    with _cache_lock:
+        entry = RESPONSE_CACHE.get(url)
+        if entry and now < entry["fresh_until"]:
+            RESPONSE_CACHE_STATS["fresh"] += 1
+            return entry["data"]
+
+    headers = dict(kwargs.pop("headers", None) or {})
+    if entry:
+        if entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+    resp = get(url, timeout=timeout, upstream=upstream, headers=headers, **kwargs)
+    now = time.time()
+    if resp.status_code == 304 and entry:
+        with _cache_lock:
+            entry["fresh_until"] = _fresh_until(resp.headers, now)
+            entry["etag"] = resp.headers.get("ETag", entry["etag"])
+            RESPONSE_CACHE_STATS["revalidated"] += 1
+        return entry["data"]
+
+    resp.raise_for_status()
+    data = resp.json()
+    with _cache_lock:
+        RESPONSE_CACHE[url] = {
+            "data": data,
+            "etag": resp.headers.get("ETag"),
+            "last_modified": resp.headers.get("Last-Modified"),
+            "fresh_until": _fresh_until(resp.headers, now),
+        }
+        RESPONSE_CACHE_STATS["downloaded"] += 1
+    return data
+
+def get_stats():
+    """
+    Returns per-host request and connection counts from the live pools.
+    'reused' is the number of requests that did not need a new TCP+TLS handshake.
+    """
+    stats = {}
+    if _session is None:
+        return stats
+    for adapter in set(_session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host_stats = stats.setdefault(pool.host, {"requests": 0, "connections": 0, "reused": 0})
+            host_stats["requests"] += pool.num_requests
+            host_stats["connections"] += pool.num_connections
+            host_stats["reused"] = max(0, host_stats["requests"] - host_stats["connections"])
+    return stats
+# --- END OF FILE http_client.py ---
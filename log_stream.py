@@ -0,0 +1,62 @@
+# --- START OF FILE log_stream.py ---
+
+import time
+import logging
+import threading
+from collections import deque
+
+import config
+
+class LogBufferHandler(logging.Handler):
+    """
+    Keeps the most recent formatted log lines in memory for the admin log viewer
+    and queues new ones for push_log_lines, so streaming them costs no file I/O.
+    """
+    def __init__(self, capacity):
+        super().__init__()
+        self.lines = deque(maxlen=capacity)
+        self.pending = deque(maxlen=capacity)
+        self.dropped = 0 # Lines that left the queue before they were pushed
+        self.has_pending = threading.Event()
+
+    def emit(self, record):
+        try:
+            line = self.format(record) + "\n"
+        except Exception:
+            self.handleError(record)
+            return
+        # Handler.handle() holds self.lock while emit runs.
+        self.lines.append(line)
+        if len(self.pending) == self.pending.maxlen:
+            self.dropped += 1
+        self.pending.append(line)
+        self.has_pending.set()
+
+    def tail(self, count):
+        with self.lock:
+            return list(self.lines)[-count:]
+
+    def take_pending(self):
+        """Returns the queued lines and how many were dropped since the last call, emptying the queue."""
+        with self.lock:
+            lines = list(self.pending)
+            dropped = self.dropped
+            self.pending.clear()
+            self.dropped = 0
+            self.has_pending.clear()
+        return lines, dropped
+
+def push_log_lines(handler, socketio_instance):
+    """Sends queued log lines to the /logs namespace, at most one batch every LOG_PUSH_INTERVAL seconds."""
+    while True:
+        handler.has_pending.wait()
+        lines, dropped = handler.take_pending()
+        if dropped:
+            lines.insert(0, f"--- {dropped} log lines skipped ---\n")
+        if lines:
+            try:
+                socketio_instance.emit('new_log_line', {'lines': lines}, namespace='/logs')
+            except Exception as e:
+                logging.error(f"Error streaming log lines: {e}")
+        time.sleep(config.LOG_PUSH_INTERVAL)
+# --- END OF FILE log_stream.py ---
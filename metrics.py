@@ -0,0 +1,148 @@
+# --- START OF FILE metrics.py ---
+
+import time
+import threading
+from bisect import bisect_left
+
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+# Upper bounds in seconds, shared by every histogram.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+REGISTRY = []
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _label_str(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name, self.help, self.labels = name, help_text, labels
+        self.values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_label_str(self.labels, label_values)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name, help_text, labels=()):
+        self.name, self.help, self.labels = name, help_text, labels
+        self.values = {} # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, seconds, *label_values):
+        index = bisect_left(BUCKETS, seconds)
+        with self._lock:
+            series = self.values.get(label_values)
+            if series is None:
+                series = self.values[label_values] = [0] * (len(BUCKETS) + 2)
+            series[index] += 1
+            series[-1] += seconds
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series_items = sorted((label_values, list(series)) for label_values, series in self.values.items())
+        for label_values, series in series_items:
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ("+Inf",), series):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_label_str(self.labels, label_values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_str(self.labels, label_values)} {series[-1]:.6f}")
+            lines.append(f"{self.name}_count{_label_str(self.labels, label_values)} {cumulative}")
+        return lines
+
+class Gauge:
+    """A value read when /metrics is scraped. collect() returns {label values tuple: number}."""
+    def __init__(self, name, help_text, labels=(), collect=None):
+        self.name, self.help, self.labels = name, help_text, labels
+        self.collect = collect or (lambda: {})
+        REGISTRY.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for label_values, value in sorted(self.collect().items()):
+            lines.append(f"{self.name}{_label_str(self.labels, label_values)} {value}")
+        return lines
+
+UPSTREAM_SECONDS = Histogram("iropapp_upstream_request_seconds", "Latency of requests to upstream APIs.", ("upstream",))
+UPSTREAM_ERRORS = Counter("iropapp_upstream_errors_total", "Failed upstream requests, by HTTP status or exception.", ("upstream", "reason"))
+TASK_CYCLE_SECONDS = Histogram("iropapp_task_cycle_seconds", "Duration of background task cycles.", ("task",))
+TASK_CYCLES = Counter("iropapp_task_cycles_total", "Background task cycles, by outcome.", ("task", "result"))
+HUB_SNAPSHOT_SECONDS = Histogram("iropapp_hub_snapshot_seconds", "Time to collect one hub's snapshot in the refresh job.", ("iata",))
+DB_COMMIT_SECONDS = Histogram("iropapp_db_commit_seconds", "Duration of database session commits, including the flush.")
+HTTP_REQUEST_SECONDS = Histogram("iropapp_http_request_seconds", "Latency of requests served, by route.", ("method", "endpoint", "status"))
+SOCKETIO_EMITS = Counter("iropapp_socketio_emits_total", "Socket.IO events sent.", ("namespace", "event"))
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+def observe_upstream(upstream, started, response=None, error=None):
+    UPSTREAM_SECONDS.observe(time.perf_counter() - started, upstream)
+    if error is not None:
+        UPSTREAM_ERRORS.inc(upstream, type(error).__name__)
+    elif response is not None and response.status_code >= 400:
+        UPSTREAM_ERRORS.inc(upstream, str(response.status_code))
+
+def _before_commit(session):
+    session.info["commit_started"] = time.perf_counter()
+
+def _after_commit(session):
+    started = session.info.pop("commit_started", None)
+    if started is not None:
+        DB_COMMIT_SECONDS.observe(time.perf_counter() - started)
+
+def _start_request_timer():
+    g.metrics_started = time.perf_counter()
+
+def _observe_request(response):
+    started = g.pop("metrics_started", None)
+    if started is not None:
+        # The route template, not the path, keeps the number of series bounded.
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, request.method, endpoint, str(response.status_code))
+    return response
+
+def init_metrics(app, socketio_instance):
+    """Times requests and commits and counts Socket.IO emits of the app."""
+    app.before_request(_start_request_timer)
+    app.after_request(_observe_request)
+    event.listen(Session, "before_commit", _before_commit)
+    event.listen(Session, "after_commit", _after_commit)
+
+    # flask_socketio.emit() in event handlers also goes through the server's emit.
+    emit = socketio_instance.emit
+    def counted_emit(event_name, *args, **kwargs):
+        SOCKETIO_EMITS.inc(kwargs.get("namespace") or "/", event_name)
+        return emit(event_name, *args, **kwargs)
+    socketio_instance.emit = counted_emit
+
+    def connected_clients():
+        server = getattr(socketio_instance, "server", None)
+        if server is None:
+            return {}
+        return {(namespace,): len(rooms.get(None, ())) for namespace, rooms in server.manager.rooms.items()}
+    Gauge("iropapp_socketio_clients", "Connected Socket.IO clients, by namespace.", ("namespace",), connected_clients)
+# --- END OF FILE metrics.py ---
@@ -0,0 +1,364 @@
+# --- START OF FILE risk.py ---
+
+"""
+Server-side port of the hour-by-hour risk scoring in static/utils.js and
+static/analysis.js (getHourRisk, getHourWindRisk, analyzeRunwaySafety,
+analyzeDayHours, getDailyAssessment). Results use the same keys and values
+as the browser, so any change to the scoring must be made in both places.
+"""
+
+import math
+import re
+from datetime import datetime
+
+import pytz
+
+WIND_DIRS = {
+    "N": 0, "NNE": 22.5, "NE": 45, "ENE": 67.5, "E": 90, "ESE": 112.5, "SE": 135, "SSE": 157.5,
+    "S": 180, "SSW": 202.5, "SW": 225, "WSW": 247.5, "W": 270, "WNW": 292.5, "NW": 315, "NNW": 337.5
+}
+MPH_TO_KTS = 0.868976
+KTS_TO_MPH = 1.15078
+MIN_RUNWAY_LEN = 5040 # Shorter runways are ignored
+FULL_RUNWAY_LEN = 5360 # Shorter runways are only usable by the CRJ700
+
+THUNDER_HIGH_RE = re.compile(r"thunderstorms likely|severe thunderstorm|severe t[- ]?storm|tstm likely|t\.storm likely|t[- ]?storm likely")
+THUNDER_RE = re.compile(r"thunderstorm|tstm|t-storm|t\.storm")
+SEVERE_RE = re.compile(r"severe|tornado|hail|damaging wind|squall|snow|blizzard|ice|sleet|wintry|freezing rain|freezing drizzle")
+OTHER_RE = re.compile(r"heavy rain|flood|downpour|fog|low visibility|low clouds")
+LEADING_NUMBER_RE = re.compile(r"\s*([+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)")
+
+# --- JavaScript semantics ---
+def _truthy(value):
+    """JavaScript truthiness: objects and arrays are truthy even when empty."""
+    if isinstance(value, (dict, list)):
+        return True
+    if isinstance(value, float) and math.isnan(value):
+        return False
+    return bool(value)
+
+def _parse_float(value):
+    """JavaScript parseFloat: the leading number of a string, NaN if there is none."""
+    if isinstance(value, bool):
+        return math.nan
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = LEADING_NUMBER_RE.match(value) if isinstance(value, str) else None
+    return float(match.group(1)) if match else math.nan
+
+def _to_number(value):
+    """JavaScript's implicit conversion in arithmetic and comparisons."""
+    if value is None:
+        return 0.0
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(value) if str(value).strip() else 0.0
+    except ValueError:
+        return math.nan
+
+def _round(value):
+    """JavaScript Math.round (halves round up); None for NaN, as JSON.stringify writes null."""
+    return None if math.isnan(value) else int(math.floor(value + 0.5))
+
+def _finite(value):
+    """NaN as None, as JSON.stringify writes it."""
+    return None if isinstance(value, float) and math.isnan(value) else value
+
+def _js_str(value):
+    """How JavaScript prints a value concatenated into a string."""
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, float):
+        if math.isnan(value):
+            return "NaN"
+        if value.is_integer():
+            return str(int(value))
+        return repr(value)
+    return str(value)
+
+# --- utils.js ---
+def wind_dir_to_deg(direction):
+    direction = (direction or "").upper()
+    if direction in WIND_DIRS:
+        return WIND_DIRS[direction]
+    if direction.isdigit() and direction.isascii():
+        return float(direction)
+    return None
+
+def wind_to_kts(value):
+    if not _truthy(value):
+        return 0
+    speed = _parse_float(value)
+    if isinstance(value, str) and "mph" in value:
+        speed *= MPH_TO_KTS
+    return speed
+
+def wind_to_mph(value):
+    if not _truthy(value):
+        return 0
+    speed = _parse_float(value)
+    if isinstance(value, str) and "mph" in value:
+        return speed
+    return speed * KTS_TO_MPH
+
+def crosswind_component(runway_heading, wind_dir, wind_kts):
+    wind_deg = wind_dir_to_deg(wind_dir)
+    if wind_deg is None:
+        return 0
+    angle = abs(_to_number(runway_heading) - wind_deg)
+    if angle > 180:
+        angle = 360 - angle
+    return abs(wind_kts * math.sin(angle * math.pi / 180))
+
+def get_hour_wind_risk(speed, cross):
+    if speed > 50:
+        return {"risk": "high", "txt": "Wind > 50 kts", "class": "hour-wind"}
+    if speed > 35:
+        return {"risk": "wind-high", "txt": f"High wind ({_js_str(speed)} kts)", "class": "hour-wind-high"}
+    if speed > 27:
+        return {"risk": "partial", "txt": f"Wind ({_js_str(speed)} kts)", "class": "hour-wind"}
+    if cross > 27:
+        return {"risk": "high", "txt": f"Crosswind {_js_str(cross)} kts", "class": "hour-wind"}
+    if cross > 20:
+        return {"risk": "wind-high", "txt": f"High crosswind ({_js_str(cross)} kts)", "class": "hour-wind-high"}
+    if cross > 15:
+        return {"risk": "wind-partial", "txt": f"Moderate crosswind ({_js_str(cross)} kts)", "class": "hour-wind-partial"}
+    return None
+
+def analyze_runway_safety(runways, wind_dir, wind_kts, gust_kts):
+    results = []
+    for runway in runways or []:
+        if not isinstance(runway, dict):
+            continue # e.g. "09/27" from a hand-edited runways_json; the JS reads an undefined length and skips it
+        length = _to_number(runway.get("len"))
+        if not length >= MIN_RUNWAY_LEN: # Also skips a missing or unparseable length, like the JS
+            continue
+        cross = crosswind_component(runway.get("heading"), wind_dir, wind_kts)
+        safe = wind_kts <= 50 and cross <= 27
+        if length >= FULL_RUNWAY_LEN:
+            status = "SAFE" if safe else ("UNSAFE WIND" if wind_kts > 50 else "UNSAFE CROSSWIND")
+            class_name = "runway-safe" if safe else "runway-unsafe"
+        else:
+            status = "SAFE (CRJ700)" if safe else ("UNSAFE WIND" if wind_kts > 50 else "UNSAFE CROSSWIND")
+            class_name = "runway-crj700only" if safe else "runway-unsafe"
+
+        if safe and _truthy(gust_kts):
+            if gust_kts > 50:
+                safe = False
+                status = f"UNSAFE (GUSTS {_js_str(_round(gust_kts))} KTS)"
+                class_name = "runway-unsafe"
+            else:
+                cross_gust = crosswind_component(runway.get("heading"), wind_dir, gust_kts)
+                if cross_gust > 27:
+                    safe = False
+                    status = f"UNSAFE (GUSTS {_js_str(_round(cross_gust))} KTS CROSS)"
+                    class_name = "runway-unsafe"
+
+        results.append({
+            "label": runway.get("label"),
+            "cross": _round(cross),
+            "safe": safe,
+            "warning": status,
+            "len": runway.get("len"),
+            "className": class_name
+        })
+    return results
+
+def get_hour_risk(forecast):
+    if not forecast:
+        return {"risk": "clear", "key": None, "hourClass": "hour-clear"}
+    forecast = forecast.lower()
+    if THUNDER_HIGH_RE.search(forecast):
+        return {"risk": "high", "key": "Thunder", "hourClass": "hour-thunder"}
+    if THUNDER_RE.search(forecast):
+        return {"risk": "partial", "key": "Thunder", "hourClass": "hour-other"}
+    if SEVERE_RE.search(forecast):
+        return {"risk": "high", "key": "Severe", "hourClass": "hour-severe"}
+    if OTHER_RE.search(forecast):
+        return {"risk": "partial", "key": None, "hourClass": "hour-other"}
+    return {"risk": "clear", "key": None, "hourClass": "hour-clear"}
+
+def get_daily_assessment(percent_high, percent_partial):
+    if percent_high >= 30 or percent_partial > 50:
+        return {"label": "⚠️ High IROPS Risk", "class": "risk-high", "summary": "High IROPS risk"}
+    if percent_high >= 25 or percent_partial > 40:
+        return {"label": "🟧 Moderate IROPS Risk", "class": "risk-moderate", "summary": "Moderate IROPS risk"}
+    if percent_high >= 10 or percent_partial >= 30:
+        return {"label": "⛅ Partial IROPS Risk", "class": "risk-partial", "summary": "Partial IROPS risk"}
+    if percent_partial >= 10:
+        return {"label": "⛅ Slight IROPS Risk", "class": "risk-partial", "summary": "Slight IROPS risk"}
+    return {"label": "✔️ No Weather Risk", "class": "risk-normal", "summary": "No Weather Risk"}
+
+# --- analysis.js ---
+def _index_periods(hourly_periods, date_ymd, tz):
+    """The day's periods by local hour; a repeated hour (DST) keeps the later period."""
+    hour_data = {}
+    for period in hourly_periods:
+        try:
+            start = datetime.fromisoformat(period["startTime"]).astimezone(tz)
+        except (KeyError, TypeError, ValueError):
+            continue
+        if start.strftime("%Y-%m-%d") == date_ymd:
+            hour_data[start.hour] = dict(period)
+    return hour_data
+
+def _score_hour(period, runways):
+    """Weather and wind risk of one forecast period, before FAA upgrades."""
+    risk_obj = get_hour_risk((period.get("shortForecast") or "") + " " + (period.get("detailedForecast") or ""))
+    block = {
+        "txt": period.get("shortForecast") or "", "shortF": period.get("shortForecast") or "",
+        "detailedF": period.get("detailedForecast") or "", "windRisk": None, "windTxt": "",
+        "windDir": "", "windKts": 0, "windMPH": 0, "temp": "", "runways": []
+    }
+    wind_speed = period.get("windSpeed")
+    if _truthy(wind_speed) and wind_speed != "--":
+        block["windKts"] = wind_to_kts(wind_speed)
+        block["windMPH"] = wind_to_mph(wind_speed)
+    if _truthy(period.get("windDirection")):
+        block["windDir"] = period["windDirection"]
+    if "temperature" in period and _truthy(period.get("temperatureUnit")):
+        block["temp"] = f"{_js_str(period['temperature'])}°{period['temperatureUnit']}"
+    gust_kts = wind_to_kts(period["windGust"]) if _truthy(period.get("windGust")) else 0
+    block["runways"] = analyze_runway_safety(runways, block["windDir"], block["windKts"], gust_kts)
+
+    crosses = [runway["cross"] for runway in block["runways"]]
+    cross_max = math.nan if None in crosses else max([0] + crosses)
+    wind_risk = get_hour_wind_risk(block["windKts"], cross_max)
+    if wind_risk:
+        block["windRisk"] = wind_risk["risk"]
+        block["windTxt"] = wind_risk["txt"]
+        if (wind_risk["risk"] == "high"
+                or (wind_risk["risk"] == "wind-high" and risk_obj["risk"] != "high")
+                or (wind_risk["risk"] == "wind-partial" and risk_obj["risk"] == "clear")):
+            risk_obj = {"risk": wind_risk["risk"], "key": "Wind", "hourClass": wind_risk["class"]}
+    return risk_obj, block
+
+def analyze_day_hours(hourly_periods, date_ymd, tz_name, highlight_hour, base_label, ymd_str, runways,
+                      faa_events_for_day, ground_stop_hours=None, ground_delay_data=None, snapshots=None):
+    """
+    Port of analyzeDayHours. Returns {"hourBlocks", "percentHigh", "percentPartial", "total"}
+    with the 24 blocks the dashboard renders for the day.
+    """
+    tz = pytz.timezone(tz_name)
+    hour_data = _index_periods(hourly_periods or [], date_ymd, tz)
+
+    faa_events_indexed = {}
+    for event in faa_events_for_day or []:
+        if event.get("local_hour") is not None:
+            faa_events_indexed.setdefault(_js_str(event["local_hour"]), []).append(event)
+    ground_stop_indexed = {}
+    ground_delay_indexed = {}
+    if snapshots is not None:
+        for snapshot in snapshots:
+            if _truthy(snapshot.get("ground_stop")):
+                ground_stop_indexed[_js_str(snapshot.get("hour"))] = snapshot["ground_stop"]
+            if _truthy(snapshot.get("ground_delay")):
+                ground_delay_indexed[_js_str(snapshot.get("hour"))] = snapshot["ground_delay"]
+
+    hour_blocks = []
+    raw_risks = []
+    risk_keys = []
+    for h in range(24):
+        period = hour_data.get(h)
+        faa_event = faa_events_indexed.get(str(h), [])
+        ground_stop_for_hour = ground_stop_indexed.get(str(h)) if snapshots is not None else None
+        ground_delay_for_hour = ground_delay_indexed.get(str(h)) if snapshots is not None else None
+        is_past = highlight_hour is not None and h < highlight_hour
+
+        if period is not None:
+            risk_obj, block = _score_hour(period, runways)
+        else:
+            risk_obj = {"risk": "nodata", "key": None, "hourClass": "hour-nodata"}
+            block = {
+                "txt": "No data", "shortF": "", "detailedF": "", "windRisk": None, "windTxt": "",
+                "windDir": "", "windKts": 0, "windMPH": 0, "temp": "", "runways": []
+            }
+
+        is_ground_stop_hour = False
+        if snapshots is not None:
+            is_ground_stop_hour = ground_stop_for_hour is not None
+        elif ground_stop_hours:
+            # For the live view, only current and future hours get the ground stop
+            is_ground_stop_hour = not is_past and ground_stop_hours["start"] <= h <= ground_stop_hours["end"]
+
+        has_ground_delay = False
+        if snapshots is not None:
+            has_ground_delay = ground_delay_for_hour is not None
+        elif _truthy(ground_delay_data) and not is_past:
+            has_ground_delay = True
+
+        if (is_ground_stop_hour or has_ground_delay or faa_event) and risk_obj["risk"] != "nodata":
+            risk_obj = {"risk": "high", "key": "FAA Event", "hourClass": "hour-severe"}
+
+        raw_risks.append(risk_obj["risk"])
+        risk_keys.append(risk_obj["key"])
+        hour_blocks.append({
+            "hour": h,
+            "txt": block["txt"],
+            "risk": risk_obj["risk"],
+            "hourClass": risk_obj["hourClass"] + (" hour-current" if highlight_hour == h else ""),
+            "isCurrent": highlight_hour == h,
+            "isPast": is_past,
+            "baseLabel": base_label or "",
+            "ymd": ymd_str,
+            "shortF": block["shortF"],
+            "detailedF": block["detailedF"],
+            "riskClass": risk_obj["risk"],
+            "windRisk": block["windRisk"],
+            "windTxt": block["windTxt"],
+            "windDir": block["windDir"],
+            "windKts": _finite(block["windKts"]),
+            "windMPH": _finite(block["windMPH"]),
+            "runways": block["runways"],
+            "isBrief": False,
+            "faaEvents": faa_event,
+            "temp": block["temp"],
+            "isGroundStop": is_ground_stop_hour,
+            "groundStop": ground_stop_for_hour,
+            "groundDelay": (ground_delay_for_hour if snapshots is not None else ground_delay_data) if has_ground_delay else None
+        })
+
+    # Only runs of two or more high/partial hours count towards the day's percentages.
+    high_mark = [False] * 24
+    partial_mark = [False] * 24
+    run_type, run_len, run_start = None, 0, 0
+    for i in range(25):
+        current = raw_risks[i] if i < 24 else None
+        if current == run_type:
+            run_len += 1
+            continue
+        if run_type in ("high", "partial") and run_len > 1:
+            for j in range(run_start, run_start + run_len):
+                if run_type == "high":
+                    high_mark[j] = True
+                else:
+                    partial_mark[j] = True
+        run_type, run_len, run_start = current, 1, i
+
+    count_high = count_partial = total = 0
+    for h in range(24):
+        if raw_risks[h] != "nodata":
+            total += 1
+        if h < 1 or h > 3:
+            if high_mark[h]:
+                count_high += 1
+            elif partial_mark[h]:
+                count_partial += 1
+
+    # An isolated high/partial hour is brief unless a neighbouring hour has thunder.
+    for h in range(24):
+        if raw_risks[h] in ("high", "partial") and not high_mark[h] and not partial_mark[h]:
+            if not ((h > 0 and risk_keys[h - 1] == "Thunder") or (h < 23 and risk_keys[h + 1] == "Thunder")):
+                hour_blocks[h]["hourClass"] += " hour-brief"
+                hour_blocks[h]["isBrief"] = True
+
+    return {
+        "hourBlocks": hour_blocks,
+        "percentHigh": _round(count_high / total * 100) if total else 0,
+        "percentPartial": _round(count_partial / total * 100) if total else 0,
+        "total": total
+    }
+# --- END OF FILE risk.py ---
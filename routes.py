@@ -4,31 +4,38 @@ import os
 import pytz
 import json
 import uuid
+import hmac
+import hashlib
 import threading
 import logging
 from datetime import datetime
 import requests
 from bs4 import BeautifulSoup
 
-from flask import jsonify, render_template, send_from_directory, request, flash, redirect, url_for
+from flask import jsonify, render_template, send_from_directory, request, flash, redirect, url_for, Response
 from flask_login import login_user, logout_user, login_required, current_user
-from sqlalchemy import desc, inspect
+from sqlalchemy import inspect
 from werkzeug.utils import secure_filename
 
 import config
 import services
-from database import db, HourlyWeather, HourlySnapshot, Hub, User, AviationForecastDiscussion
+import http_client
+import metrics
+from database import db, HourlyWeather, HourlySnapshot, SnapshotArchive, DayCoverage, DaySummary, Hub, User, AviationForecastDiscussion, NwsGridPoint, SnapshotBlob, update_day_coverage
 from utils import get_version_string
 
 EDITABLE_MODELS = {
     'default': {
         'hourly_weather': HourlyWeather,
         'hourly_snapshot': HourlySnapshot,
+        'snapshot_blob': SnapshotBlob,
+        'snapshot_archive': SnapshotArchive,
         'aviation_forecast_discussion': AviationForecastDiscussion,
     },
     'airports': {
         'user': User,
         'hub': Hub,
+        'nws_grid_point': NwsGridPoint,
     }
 }
 
@@ -74,12 +81,33 @@ def init_routes(app, bcrypt):
     @app.route("/admin/export-db")
     @login_required
     def export_db():
+        start_date = request.args.get('start') or None
+        end_date = request.args.get('end') or None
+        for value in (start_date, end_date):
+            if value:
+                try:
+                    datetime.strptime(value, "%Y-%m-%d")
+                except ValueError:
+                    flash(f"Invalid date '{value}', expected YYYY-MM-DD.", 'danger')
+                    return redirect(url_for('admin_panel'))
+        iatas = sorted({code.strip().upper() for code in request.args.get('iatas', '').split(',') if code.strip()})
+
         try:
-            return send_from_directory(config.DATA_DIR, 'weatherlog.db', as_attachment=True)
-        except FileNotFoundError:
-            flash('Database file not found.', 'danger')
+            export_path = services.prepare_weather_export(start_date, end_date, iatas)
+        except Exception as e:
+            logging.error(f"Error preparing database export: {e}")
+            flash('Could not export the database.', 'danger')
             return redirect(url_for('admin_panel'))
 
+        name_parts = ["weatherlog"] + iatas + [part for part in (start_date, end_date) if part]
+        # Compressed on the wire; browsers decompress and save a regular .db file.
+        compress = 'gzip' in request.accept_encodings
+        response = app.response_class(services.iter_export_file(export_path, compress), mimetype="application/vnd.sqlite3")
+        response.headers["Content-Disposition"] = f'attachment; filename="{"_".join(name_parts)}.db"'
+        if compress:
+            response.headers["Content-Encoding"] = "gzip"
+        return response
+
     @app.route("/")
     def dashboard():
         return render_template("index.html")
@@ -142,9 +170,8 @@ def init_routes(app, bcrypt):
             # Immediately fetch data for the new hub to create its first snapshot
             try:
                 logging.info(f"Performing initial data snapshot for new hub: {new_hub.iata}")
-                ground_stops = services.fetch_faa_ground_stops()
-                ground_delays = services.fetch_faa_ground_delays()
-                services.snapshot_hub_data(new_hub, ground_stops, ground_delays)
+                airport_status = services.fetch_faa_airport_status()
+                services.snapshot_hub_data(new_hub, airport_status["ground_stops"], airport_status["ground_delays"])
                 logging.info(f"Initial snapshot for {new_hub.iata} complete.")
             except Exception as e:
                 # Log this error but don't fail the whole request,
@@ -197,7 +224,7 @@ def init_routes(app, bcrypt):
         """
         try:
             url = f"https://aviationweather.gov/api/data/airport?ids={icao.upper()}&format=json"
-            resp = requests.get(url, timeout=15)
+            resp = http_client.get(url, timeout=15, upstream="aviationweather_airport")
             resp.raise_for_status()
             
             content_type = resp.headers.get('Content-Type', '')
@@ -223,6 +250,34 @@ def init_routes(app, bcrypt):
             logging.error(error_message)
             return jsonify({"error": error_message}), 502 # Bad Gateway
 
+    @app.route("/api/weather")
+    def weather_batch_api():
+        """Weather for several hubs in one response: {iata: <same as /api/weather/<iata>>}."""
+        req_date = request.args.get('date')
+        iatas_param = request.args.get('iatas')
+        query = Hub.query
+        if iatas_param:
+            iatas = {code.strip().upper() for code in iatas_param.split(',') if code.strip()}
+            query = query.filter(Hub.iata.in_(iatas))
+        requested = {}
+        for hub in query.all():
+            tz = pytz.timezone(hub.tz)
+            requested[hub.iata] = (tz.zone, req_date or datetime.now(tz).strftime("%Y-%m-%d"))
+        if iatas_param and not requested:
+            return jsonify({"error": "Unknown IATA code"}), 404
+
+        # Read before the data so a concurrent refresh can only make the versions look older than they are.
+        versions = json.dumps(services.get_hub_versions(requested), sort_keys=True, separators=(",", ":"))
+        # Each hub's body comes from the same cache as /api/weather/<iata>, so it is only spliced together here.
+        cached = services.get_weather_responses(requested)
+        iatas = sorted(cached)
+        body = b"{" + b",".join(json.dumps(iata).encode("utf-8") + b":" + cached[iata]["body"] for iata in iatas) + b"}"
+        response = app.response_class(body, mimetype="application/json")
+        response.headers["X-Hub-Versions"] = versions
+        response.set_etag(hashlib.sha256((versions + "".join(f"{iata}:{cached[iata]['etag']}" for iata in iatas)).encode("utf-8")).hexdigest()[:32])
+        response.headers["Cache-Control"] = "no-cache"
+        return response.make_conditional(request)
+
     @app.route("/api/weather/<iata>")
     def weather_api(iata):
         iata = iata.upper()
@@ -234,62 +289,29 @@ def init_routes(app, bcrypt):
 
         local_date_str = req_date or datetime.now(tz).strftime("%Y-%m-%d")
 
-        # Default structure for the output
-        data_out = {
-            "hourly": [], "daily": [], "timezone": tz.zone, "sirs": [],
-            "terminal_constraints": [], "faa_events": [], "alerts": [],
-            "aviation_forecast": None
-        }
-
-        # Get all historically logged hours for the requested date from HourlyWeather
-        db_hours = HourlyWeather.query.filter_by(iata=iata, date=local_date_str).order_by(HourlyWeather.start_time).all()
-        logged_by_time = {h.start_time: h.as_dict() for h in db_hours}
-
-        # For both today and archive views, we now primarily rely on snapshots.
-        # This prevents slow, on-demand external API calls from this route.
-        latest_snapshot = HourlySnapshot.query.filter_by(
-            iata=iata, date=local_date_str
-        ).order_by(desc(HourlySnapshot.hour)).first()
-
-        forecast_data = None
-        if latest_snapshot:
-            snapshot_content = json.loads(latest_snapshot.snapshot_json)
-            forecast_data = snapshot_content.get("weather")
-            data_out["sirs"] = snapshot_content.get("sirs", [])
-            data_out["terminal_constraints"] = snapshot_content.get("terminal_constraints", [])
-            data_out["faa_events"] = snapshot_content.get("faa_events", [])
-            if forecast_data:
-                data_out["daily"] = forecast_data.get("daily", [])
-                data_out["alerts"] = forecast_data.get("alerts", [])
-                data_out["aviation_forecast"] = forecast_data.get("aviation_forecast")
-
-        # --- MERGE LOGIC ---
-        # This logic combines past data (from HourlyWeather) with the most recent forecast
-        # (from the latest snapshot of the day), prioritizing the actual logged data.
-        result_hourly = []
-        seen = set()
-
-        # 1. Prioritize all logged historical data for the day.
-        for key, val in logged_by_time.items():
-            result_hourly.append(val)
-            seen.add(key)
-
-        # 2. Fill in the rest from the snapshot's forecast, avoiding duplicates.
-        if forecast_data and "hourly" in forecast_data:
-            for period in forecast_data.get("hourly", []):
-                key = period["startTime"]
-                if key not in seen:
-                    result_hourly.append(period)
-                    # No need to add to seen, as we won't loop over forecast_data again.
-
-        result_hourly.sort(key=lambda x: x["startTime"])
-        data_out["hourly"] = result_hourly
-
-        return jsonify(data_out)
+        # Rendered once per hub and date until the refresh job writes new data for it.
+        cached = services.get_weather_response(iata, tz.zone, local_date_str)
+        response = app.response_class(cached["body"], mimetype="application/json")
+        response.set_etag(cached["etag"])
+        response.headers["Cache-Control"] = "no-cache"
+        return response.make_conditional(request)
     
+    @app.route("/api/risk/<iata>/<date>")
+    def risk_api(iata, date):
+        hub = Hub.query.filter_by(iata=iata.upper()).first()
+        if not hub:
+            return jsonify({"error": "Unknown IATA code"}), 404
+        try:
+            datetime.strptime(date, "%Y-%m-%d")
+        except ValueError:
+            return jsonify({"error": "Date must be YYYY-MM-DD"}), 400
+        return jsonify(services.get_hub_risk(hub.as_dict(), date))
+
     @app.route("/api/weather-archive/<iata>")
     def weather_archive_api(iata):
-        dates = db.session.query(HourlyWeather.date).filter_by(iata=iata.upper()).distinct().order_by(HourlyWeather.date.desc()).all()
+        dates = db.session.query(DayCoverage.date).filter(
+            DayCoverage.iata == iata.upper(), DayCoverage.weather_hours > 0
+        ).order_by(DayCoverage.date.desc()).all()
         return jsonify([d[0] for d in dates])
 
     @app.route("/api/weather-history/<iata>/<date>")
@@ -337,20 +359,40 @@ def init_routes(app, bcrypt):
 
         if not all([upload_id, chunk]):
             return jsonify({"error": "Missing upload_id or file chunk"}), 400
+        try:
+            index = int(request.form['chunk_index'])
+            total_size = int(request.form['total_size'])
+            chunk_size = int(request.form['chunk_size'])
+        except (KeyError, ValueError):
+            return jsonify({"error": "Missing or invalid chunk_index, total_size or chunk_size"}), 400
 
         # Sanitize the upload_id to prevent path traversal
         safe_upload_id = secure_filename(upload_id)
-        temp_path = os.path.join(config.DATA_DIR, f"upload_{safe_upload_id}.part")
 
         try:
-            with open(temp_path, "ab") as f:
-                f.write(chunk.read())
+            services.write_upload_chunk(safe_upload_id, index, chunk.read(), total_size, chunk_size, request.form.get('checksum'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         except IOError as e:
             logging.error(f"Error writing chunk for {safe_upload_id}: {e}")
             return jsonify({"error": "Server error while writing file chunk."}), 500
 
         return jsonify({"success": True})
 
+    @app.route('/api/upload-status/<upload_id>')
+    @login_required
+    def upload_status(upload_id):
+        """Lists the chunks already received so an interrupted upload can resume."""
+        manifest = services.get_upload_status(secure_filename(upload_id))
+        if manifest is None:
+            return jsonify({"received": []})
+        return jsonify({
+            "received": sorted(int(index) for index in manifest["chunks"]),
+            "total_chunks": manifest["total_chunks"],
+            "chunk_size": manifest["chunk_size"],
+            "total_size": manifest["total_size"],
+        })
+
     @app.route('/api/assemble-file', methods=['POST'])
     @login_required
     def assemble_file():
@@ -362,10 +404,14 @@ def init_routes(app, bcrypt):
             return jsonify({"error": "Missing upload_id or filename"}), 400
 
         safe_upload_id = secure_filename(upload_id)
-        part_path = os.path.join(config.DATA_DIR, f"upload_{safe_upload_id}.part")
 
-        if not os.path.exists(part_path):
-            return jsonify({"error": "Uploaded file not found. It may have expired or failed."}), 404
+        try:
+            part_path, missing = services.verify_upload(safe_upload_id, data.get('file_hash'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        if missing:
+            # The client re-sends these chunks and asks again.
+            return jsonify({"error": f"{len(missing)} chunks are missing or corrupt.", "missing": missing}), 409
 
         # Create a new unique name for the final assembled file
         final_filename = f"temp_{uuid.uuid4().hex}_{secure_filename(filename)}"
@@ -424,7 +470,7 @@ def init_routes(app, bcrypt):
             logging.error(f"Could not get DB size: {e}")
         
         try:
-            days = db.session.query(HourlyWeather.date).distinct().count()
+            days = db.session.query(DayCoverage.date).filter(DayCoverage.weather_hours > 0).distinct().count()
         except Exception as e:
             logging.error(f"Could not get DB days count: {e}")
 
@@ -432,13 +478,27 @@ def init_routes(app, bcrypt):
 
     @app.route("/api/archive-dates")
     def archive_dates_api():
-        dates = db.session.query(HourlySnapshot.date).distinct().order_by(HourlySnapshot.date.desc()).all()
+        dates = db.session.query(DayCoverage.date).filter(DayCoverage.snapshot_hours > 0).distinct().order_by(DayCoverage.date.desc()).all()
         return jsonify([d[0] for d in dates])
 
+    @app.route("/api/calendar/<month>")
+    def calendar_api(month):
+        try:
+            valid = datetime.strptime(month, "%Y-%m").strftime("%Y-%m") == month
+        except ValueError:
+            valid = False
+        if not valid:
+            return jsonify({"error": "Month must be YYYY-MM"}), 400
+        # Only precomputed rows are served; days not scored yet are queued for the refresh job.
+        pending = services.request_day_summaries([hub.as_dict() for hub in Hub.query.all()], month)
+        days = {}
+        for summary in DaySummary.query.filter(DaySummary.date.like(f"{month}-%")).order_by(DaySummary.date, DaySummary.iata):
+            days.setdefault(summary.date, {})[summary.iata] = summary.as_dict()
+        return jsonify({"month": month, "days": days, "pending": pending})
+
     @app.route("/api/hourly-snapshots/<iata>/<date>")
     def api_hourly_snapshots(iata, date):
-        rows = HourlySnapshot.query.filter_by(iata=iata.upper(), date=date).order_by(HourlySnapshot.hour).all()
-        return jsonify([r.as_dict() for r in rows])
+        return jsonify(services.get_hourly_snapshots(iata.upper(), date))
 
     # --- Admin DB Edit API ---
     @app.route("/api/admin/db/binds")
@@ -510,6 +570,7 @@ def init_routes(app, bcrypt):
         if not data:
             return jsonify({"error": "Invalid request body"}), 400
 
+        days = {(entry.iata, entry.date)} if hasattr(Model, 'date') else set()
         mapper = inspect(Model)
         for key, value in data.items():
             if key in mapper.columns and key != 'id':
@@ -525,7 +586,11 @@ def init_routes(app, bcrypt):
                 except (ValueError, TypeError):
                     return jsonify({"error": f"Invalid value '{value}' for column '{key}' (expected {column_type.__name__})"}), 400
         
+        if days:
+            db.session.flush()
+            update_day_coverage(days | {(entry.iata, entry.date)})
         db.session.commit()
+        services.invalidate_weather_responses()
         return jsonify({"success": True})
 
     @app.route("/api/admin/db/table/<bind_key>/<table_name>/<int:entry_id>", methods=['DELETE'])
@@ -536,13 +601,37 @@ def init_routes(app, bcrypt):
         
         Model = EDITABLE_MODELS[bind_key][table_name]
         entry = Model.query.get_or_404(entry_id)
+        days = {(entry.iata, entry.date)} if hasattr(Model, 'date') else set()
         
         db.session.delete(entry)
+        if days:
+            db.session.flush()
+            update_day_coverage(days)
         db.session.commit()
+        services.invalidate_weather_responses()
         return jsonify({"success": True})
 
+    @app.route("/metrics")
+    def metrics_endpoint():
+        if config.METRICS_TOKEN and not hmac.compare_digest(
+            request.headers.get("Authorization", ""), f"Bearer {config.METRICS_TOKEN}"
+        ):
+            return Response("Unauthorized\n", status=401, mimetype="text/plain")
+        return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+    @app.route("/api/admin/db/vacuum", methods=['POST'])
+    @login_required
+    def vacuum_db():
+        if not services.vacuum_database(app):
+            return jsonify({"error": "The database is already being compacted."}), 409
+        return jsonify({"success": True}), 202
+
     @app.route("/api/admin/task-status")
     @login_required
     def get_task_status():
-        return jsonify(app.TASK_STATUS)
+        status = {name: dict(task) for name, task in app.TASK_STATUS.items()}
+        if 'ops_plan_refresh' in status:
+            age = services.get_ops_plan_age()
+            status['ops_plan_refresh']['data_age_seconds'] = round(age) if age is not None else None
+        return jsonify(status)
 # --- END OF FILE routes.py ---
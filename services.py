@@ -3,58 +3,180 @@
 import os
 import re
 import json
+import zlib
+import sqlite3
+import uuid
+import time
+import threading
+import hashlib
 import requests
 import pytz
 import logging
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from xml.etree import ElementTree
 from bs4 import BeautifulSoup
-from sqlalchemy import create_engine, inspect, text
+from eventlet import patcher, tpool
+from sqlalchemy import text, select, update, func
+from sqlalchemy.dialects.sqlite import insert
 from sqlalchemy.orm import sessionmaker
 
-from config import HUBS, INACTIVE_HUBS, LOG_FILE, FAA_OPS_PLAN_URL_CACHE, GROUND_STOPS_CACHE, GROUND_DELAYS_CACHE
-from database import db, HourlyWeather, HourlySnapshot, Hub, AviationForecastDiscussion
+import config
+from config import HUBS, INACTIVE_HUBS, LOG_FILE, FAA_OPS_PLAN_URL_CACHE, FAA_EVENTS_CACHE, GROUND_STOPS_CACHE, GROUND_DELAYS_CACHE, FAA_AIRPORT_STATUS_CACHE
+from database import db, HourlyWeather, HourlySnapshot, SnapshotArchive, DayCoverage, DaySummary, Hub, AviationForecastDiscussion, NwsGridPoint, SnapshotBlob, pack_snapshot, unpack_snapshots, snapshot_blob_hashes, archive_blob_hashes, update_day_coverage, BLOB_REF_KEY
+import http_client
+import risk
 
 NWS_GRID_CACHE = {}
+# Columns stored with database.CompressedText, recompressed by recompress_json_columns.
+COMPRESSED_COLUMNS = [
+    (HourlySnapshot, "snapshot_json"),
+    (SnapshotBlob, "content"),
+    (SnapshotArchive, "archive_json"),
+    (HourlyWeather, "data_json"),
+    (AviationForecastDiscussion, "discussion_text"),
+]
+DAILY_LOG_CACHE = {"data": None, "stat": None}
+# Rendered /api/weather bodies keyed by (iata, date), least recently used first.
+# WEATHER_RESPONSE_GENERATION[iata] is bumped whenever the hub's data is written.
+WEATHER_RESPONSE_CACHE = OrderedDict()
+WEATHER_RESPONSE_GENERATION = {}
+_weather_response_lock = threading.Lock()
+# Per-hub data versions sent with dashboard_update, so clients only refetch hubs that changed.
+# The epoch changes on restart and whenever every hub is invalidated (imports, admin edits).
+HUB_DATA_VERSIONS = {"epoch": int(time.time() * 1000), "versions": {}}
+SNAPSHOT_SECTIONS = {} # iata -> {section: serialized value} of the last saved snapshot
+# /api/risk results keyed by (iata, date), least recently used first, with the inputs they were computed from.
+RISK_CACHE = OrderedDict()
+RISK_CACHE_SIZE = 256
+RISK_LIVE_DAYS = 3 # Days the dashboard shows, precomputed by the refresh job
+_risk_lock = threading.Lock()
+_vacuum_lock = threading.Lock()
+# Held while snapshot blobs or rows referencing them are written, and by prune_snapshot_blobs,
+# so a blob can't be judged unreferenced just before a new snapshot starts using it.
+# Imports commit blobs ahead of their snapshots, so they're counted instead of holding it.
+_blob_lock = threading.Lock()
+_blob_imports = 0
+_vacuum_hint_logged = False
+
+# "YYYY-MM" months a client asked the calendar for while some of their days were unscored.
+# The refresh job scores these first; nothing else writes DaySummary rows.
+PENDING_SUMMARY_MONTHS = set()
+_summary_months_lock = threading.Lock()
+GROUND_STOP_END_RE = re.compile(r"(\d{1,2}):(\d{2})\s*(am|pm)?", re.IGNORECASE)
+_daily_log_lock = threading.Lock()
+_faa_events_cache_lock = threading.Lock()
+_ops_plan_lock = threading.Lock()
+_ops_plan_fetch_lock = threading.Lock()
+OPS_PLAN_URL = "https://nasstatus.faa.gov/api/operations-plan"
+OPS_PLAN_TTL_SECONDS = 600
+OPS_PLAN_RETRY_SECONDS = 60 # Minimum time between attempts after a failure
+OPS_PLAN_IATA_RE = re.compile(r'\b([A-Z]{3})\b')
+OPS_PLAN_TIME_RE = re.compile(r"(AFTER|UNTIL) (\d{4})")
+FAA_AIRPORT_STATUS_URL = "https://nasstatus.faa.gov/api/airport-status-information"
+
+def _daily_log_stat():
+    try:
+        st = os.stat(LOG_FILE)
+        return (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
 
 def load_daily_log():
+    """
+    Returns today's SIR/terminal constraint log.
+    The file is only re-read when its mtime or size changes, so every hub in a
+    refresh cycle shares the same in-memory copy. Callers must not mutate it.
+    """
     today_str = datetime.now().strftime("%Y-%m-%d")
-    if os.path.exists(LOG_FILE):
-        with open(LOG_FILE, "r") as f:
-            try:
-                data = json.load(f)
-                if data.get("date") == today_str:
-                    return data
-            except Exception:
-                pass
+    stat = _daily_log_stat()
+    with _daily_log_lock:
+        if stat != DAILY_LOG_CACHE["stat"]:
+            data = None
+            if stat is not None:
+                with open(LOG_FILE, "r") as f:
+                    try:
+                        data = json.load(f)
+                    except Exception:
+                        pass
+            DAILY_LOG_CACHE.update({"data": data, "stat": stat})
+        data = DAILY_LOG_CACHE["data"]
+    if data and data.get("date") == today_str:
+        return data
     return {"date": today_str, "hubs": {}}
 
 def save_daily_log(log_data):
-    with open(LOG_FILE, "w") as f:
+    # Write to a temporary file and swap it in so readers never see a partial log.
+    tmp_path = LOG_FILE + ".tmp"
+    with open(tmp_path, "w") as f:
         json.dump(log_data, f)
+    with _daily_log_lock:
+        os.replace(tmp_path, LOG_FILE)
+        DAILY_LOG_CACHE.update({"data": log_data, "stat": _daily_log_stat()})
 
-def get_nws_grid(iata):
-    if iata in NWS_GRID_CACHE:
-        return NWS_GRID_CACHE[iata]
-    
+def load_nws_grid(iata):
+    """
+    Returns (grid, is_new) for a hub without writing to the database.
+    The lookup is served from memory or the nws_grid_point table while the hub's
+    lat/lon match the stored ones; otherwise api.weather.gov is queried and
+    is_new is True, meaning the grid still needs to be stored with store_nws_grid.
+    """
     hub = Hub.query.filter_by(iata=iata).first()
-    if hub:
-        lat, lon = hub.lat, hub.lon
-        if lat and lon:
-            resp = requests.get(f"https://api.weather.gov/points/{lat},{lon}", timeout=15)
-            resp.raise_for_status()
-            grid = resp.json()
-            props = grid["properties"]
-            result = {
-                "forecast": props["forecast"],
-                "forecastHourly": props["forecastHourly"],
-                "timezone": props["timeZone"],
-                "forecastZone": props.get("forecastZone"),
-                "cwa": props.get("cwa")
-            }
-            NWS_GRID_CACHE[iata] = result
-            return result
-    return None
+    if not hub or not hub.lat or not hub.lon:
+        return None, False
+    lat, lon = hub.lat, hub.lon
+
+    cached = NWS_GRID_CACHE.get(iata)
+    if cached and cached["lat"] == lat and cached["lon"] == lon:
+        return cached["grid"], False
+
+    row = NwsGridPoint.query.filter_by(iata=iata).first()
+    if row and row.lat == lat and row.lon == lon:
+        result = row.as_dict()
+        NWS_GRID_CACHE[iata] = {"lat": lat, "lon": lon, "grid": result}
+        return result, False
+
+    resp = http_client.get(f"https://api.weather.gov/points/{lat},{lon}", timeout=15, upstream="nws_points")
+    resp.raise_for_status()
+    grid = resp.json()
+    props = grid["properties"]
+    result = {
+        "forecast": props["forecast"],
+        "forecastHourly": props["forecastHourly"],
+        "timezone": props["timeZone"],
+        "forecastZone": props.get("forecastZone"),
+        "cwa": props.get("cwa")
+    }
+    NWS_GRID_CACHE[iata] = {"lat": lat, "lon": lon, "grid": result}
+    return result, True
+
+def store_nws_grid(iata, grid):
+    """
+    Adds or updates the stored grid for a hub, using the coordinates it was looked up for.
+    Grids superseded in memory since they were loaded are skipped.
+    The caller is responsible for committing.
+    """
+    cached = NWS_GRID_CACHE.get(iata)
+    if not cached or cached["grid"] is not grid:
+        return
+    row = NwsGridPoint.query.filter_by(iata=iata).first()
+    if not row:
+        row = NwsGridPoint(iata=iata)
+        db.session.add(row)
+    row.lat = cached["lat"]
+    row.lon = cached["lon"]
+    row.forecast_url = grid["forecast"]
+    row.forecast_hourly_url = grid["forecastHourly"]
+    row.timezone = grid["timezone"]
+    row.forecast_zone = grid.get("forecastZone")
+    row.cwa = grid.get("cwa")
+
+def get_nws_grid(iata):
+    grid, is_new = load_nws_grid(iata)
+    if is_new:
+        store_nws_grid(iata, grid)
+        db.session.commit()
+    return grid
 
 def fetch_weather_alerts(zone_url):
     if not zone_url:
@@ -62,70 +184,135 @@ def fetch_weather_alerts(zone_url):
     try:
         zone_id = zone_url.split('/')[-1]
         alerts_url = f"https://api.weather.gov/alerts/active/zone/{zone_id}"
-        resp = requests.get(alerts_url, headers={"Accept": "application/geo+json"}, timeout=15)
+        resp = http_client.get(alerts_url, headers={"Accept": "application/geo+json"}, timeout=15, upstream="nws_alerts")
         resp.raise_for_status()
         return resp.json().get("features", [])
     except requests.RequestException as e:
         logging.error(f"Error fetching weather alerts for zone {zone_url}: {e}")
         return []
 
-def fetch_aviation_forecast_discussion(cwa):
-    if not cwa:
-        return None
-    
-    cwa = cwa.lower()
-    now = datetime.utcnow()
+def get_cached_aviation_forecast_discussion(cwa):
+    """
+    Returns (discussion_text, is_fresh) for the stored discussion of a CWA.
+    is_fresh is False when the stored copy is missing or older than the cache window.
+    """
+    cached_discussion = AviationForecastDiscussion.query.filter_by(cwa=cwa.lower()).first()
+    if not cached_discussion:
+        return None, False
     cache_duration_seconds = 20 * 60  # 20 minutes
+    age = (datetime.utcnow() - cached_discussion.last_updated).total_seconds()
+    return cached_discussion.discussion_text, age < cache_duration_seconds
 
+def download_aviation_forecast_discussion(cwa):
+    """Downloads the AFD for a CWA. Returns None if the response is empty. Raises requests.RequestException."""
+    url = f"https://aviationweather.gov/api/data/fcstdisc?cwa={cwa.lower()}&type=afd"
+    resp = http_client.get(url, timeout=15, upstream="aviationweather_afd")
+    resp.raise_for_status()
+    discussion_text = resp.text
+    if not discussion_text.strip():
+        logging.warning(f"Received empty forecast discussion for {cwa}.")
+        return None
+    return discussion_text
+
+def store_aviation_forecast_discussion(cwa, discussion_text):
+    """Adds or updates the stored discussion for a CWA. The caller is responsible for committing."""
+    cwa = cwa.lower()
     cached_discussion = AviationForecastDiscussion.query.filter_by(cwa=cwa).first()
-    
-    if cached_discussion and (now - cached_discussion.last_updated).total_seconds() < cache_duration_seconds:
-        return cached_discussion.discussion_text
+    if cached_discussion:
+        cached_discussion.discussion_text = discussion_text
+    else:
+        db.session.add(AviationForecastDiscussion(cwa=cwa, discussion_text=discussion_text))
 
-    try:
-        url = f"https://aviationweather.gov/api/data/fcstdisc?cwa={cwa}&type=afd"
-        resp = requests.get(url, timeout=15)
-        resp.raise_for_status()
-        discussion_text = resp.text
+def load_aviation_forecast_discussion(cwa):
+    """
+    Returns (discussion_text, new_text) for a CWA without writing to the database.
+    new_text is the freshly downloaded discussion that still needs to be stored,
+    or None if the stored copy was fresh or the download failed.
+    """
+    if not cwa:
+        return None, None
 
-        if not discussion_text.strip():
-             logging.warning(f"Received empty forecast discussion for {cwa}.")
-             return cached_discussion.discussion_text if cached_discussion else None
+    cached_text, is_fresh = get_cached_aviation_forecast_discussion(cwa)
+    if is_fresh:
+        return cached_text, None
 
-        if cached_discussion:
-            cached_discussion.discussion_text = discussion_text
-        else:
-            new_discussion = AviationForecastDiscussion(
-                cwa=cwa,
-                discussion_text=discussion_text
-            )
-            db.session.add(new_discussion)
-        
-        db.session.commit()
-        return discussion_text
+    try:
+        discussion_text = download_aviation_forecast_discussion(cwa)
+        if discussion_text is None:
+            return cached_text, None
+        return discussion_text, discussion_text
     except requests.RequestException as e:
         logging.error(f"Error fetching aviation forecast discussion for {cwa}: {e}")
-        if cached_discussion:
+        if cached_text:
             logging.warning(f"Returning stale discussion for {cwa} due to fetch error.")
-            return cached_discussion.discussion_text
+        return cached_text, None
+
+def fetch_aviation_forecast_discussion(cwa):
+    discussion_text, new_text = load_aviation_forecast_discussion(cwa)
+    if new_text is not None:
+        store_aviation_forecast_discussion(cwa, new_text)
+        db.session.commit()
+    return discussion_text
+
+def refresh_ops_plan():
+    """
+    Fetches the FAA operations plan into FAA_OPS_PLAN_URL_CACHE.
+    On failure the last good document is kept and the error recorded.
+    Returns True on success.
+    """
+    cache = FAA_OPS_PLAN_URL_CACHE
+    now = datetime.utcnow()
+    try:
+        resp = http_client.get(OPS_PLAN_URL, timeout=10, upstream="faa_ops_plan")
+        resp.raise_for_status()
+        data = resp.json()
+        cache.update({"json": data, "time": now, "last_error": None})
+        return True
+    except Exception as e:
+        logging.error(f"Error fetching FAA operations plan: {e}")
+        cache["last_error"] = str(e)
+        return False
+    finally:
+        cache["last_attempt"] = now
+
+def get_ops_plan_age():
+    """Seconds since the cached ops plan was fetched, or None if there is none."""
+    fetched_at = FAA_OPS_PLAN_URL_CACHE.get("time")
+    if FAA_OPS_PLAN_URL_CACHE.get("json") is None or not fetched_at:
         return None
+    return (datetime.utcnow() - fetched_at).total_seconds()
+
+def _ops_plan_retry_due():
+    last_attempt = FAA_OPS_PLAN_URL_CACHE.get("last_attempt")
+    return not last_attempt or (datetime.utcnow() - last_attempt).total_seconds() >= OPS_PLAN_RETRY_SECONDS
+
+def _background_ops_plan_refresh():
+    try:
+        refresh_ops_plan()
+    finally:
+        with _ops_plan_lock:
+            FAA_OPS_PLAN_URL_CACHE["refreshing"] = False
 
 def get_latest_ops_plan_json():
-    now = datetime.utcnow()
+    """
+    Returns the cached ops plan, serving the last good document while it is
+    refreshed by a single background thread once older than OPS_PLAN_TTL_SECONDS.
+    Only the very first call (with nothing cached) waits for the FAA.
+    """
     cache = FAA_OPS_PLAN_URL_CACHE
-    if cache.get("json") and cache.get("time") and (now - cache["time"]).total_seconds() < 600:
-        return cache["json"]
-    try:
-        api_url = "https://nasstatus.faa.gov/api/operations-plan"
-        resp = requests.get(api_url, timeout=10)
-        if resp.ok:
-            data = resp.json()
-            FAA_OPS_PLAN_URL_CACHE.update({"json": data, "time": now})
-            return data
-    except Exception:
-        pass
-    FAA_OPS_PLAN_URL_CACHE.update({"json": None, "time": now})
-    return None
+    if cache.get("json") is None:
+        with _ops_plan_fetch_lock:
+            if cache.get("json") is None and _ops_plan_retry_due():
+                refresh_ops_plan()
+        return cache.get("json")
+
+    if get_ops_plan_age() >= OPS_PLAN_TTL_SECONDS and _ops_plan_retry_due():
+        with _ops_plan_lock:
+            start_refresh = not cache["refreshing"]
+            cache["refreshing"] = True
+        if start_refresh:
+            threading.Thread(target=_background_ops_plan_refresh, daemon=True).start()
+    return cache["json"]
 
 def parse_faa_ops_plan_json(data, base_date=None):
     if not data or "terminalPlanned" not in data:
@@ -147,27 +334,25 @@ def parse_faa_ops_plan_json(data, base_date=None):
                 plan_date = datetime(year, month, day).date()
 
     events = []
+    dt_utc = datetime.utcnow()
+    ref_date = plan_date or base_date or dt_utc.date()
     for item in data["terminalPlanned"]:
         time_str = item.get("time", "")
         event_str = item.get("event", "")
-        iatas = re.findall(r'\b([A-Z]{3})\b', event_str)
-        for iata in iatas:
-            m = re.match(r"(AFTER|UNTIL) (\d{4})", time_str)
-            if not m:
-                continue
-            when_type, zulu_time = m.group(1), m.group(2)
-            dt_utc = datetime.utcnow()
-            event_hour = int(zulu_time[:2])
-            event_min = int(zulu_time[2:])
-            
-            ref_date = plan_date or base_date or dt_utc.date()
-            
-            event_dt_utc = datetime(ref_date.year, ref_date.month, ref_date.day, event_hour, event_min, tzinfo=pytz.utc)
-
-            # This logic is for rolling over to the next day. It should only apply if the plan is for today.
-            if when_type == "AFTER" and ref_date == dt_utc.date() and dt_utc.hour >= event_hour:
-                event_dt_utc += timedelta(days=1)
+        m = OPS_PLAN_TIME_RE.match(time_str)
+        if not m:
+            continue
+        when_type, zulu_time = m.group(1), m.group(2)
+        event_hour = int(zulu_time[:2])
+        event_min = int(zulu_time[2:])
+
+        event_dt_utc = datetime(ref_date.year, ref_date.month, ref_date.day, event_hour, event_min, tzinfo=pytz.utc)
+
+        # This logic is for rolling over to the next day. It should only apply if the plan is for today.
+        if when_type == "AFTER" and ref_date == dt_utc.date() and dt_utc.hour >= event_hour:
+            event_dt_utc += timedelta(days=1)
 
+        for iata in OPS_PLAN_IATA_RE.findall(event_str):
             events.append({
                 "iata": iata,
                 "when_type": when_type,
@@ -184,9 +369,30 @@ def get_faa_events_by_day(dt):
         return []
     return parse_faa_ops_plan_json(data, base_date=dt)
 
+def get_faa_events_index(dt):
+    """
+    Returns {iata: [events]} for the ops plan parsed against base date dt.
+    The ops plan is parsed once per fetched document (and UTC hour, since the
+    AFTER rollover depends on it) and shared by every hub in a refresh cycle.
+    """
+    data = get_latest_ops_plan_json()
+    if not data:
+        return {}
+    hour_key = datetime.utcnow().strftime("%Y-%m-%dT%H")
+    with _faa_events_cache_lock:
+        if FAA_EVENTS_CACHE["json"] is not data or FAA_EVENTS_CACHE["hour"] != hour_key:
+            FAA_EVENTS_CACHE.update({"json": data, "hour": hour_key, "by_day": {}})
+        by_iata = FAA_EVENTS_CACHE["by_day"].get(dt)
+        if by_iata is None:
+            by_iata = {}
+            for event in parse_faa_ops_plan_json(data, base_date=dt):
+                by_iata.setdefault(event["iata"], []).append(event)
+            FAA_EVENTS_CACHE["by_day"][dt] = by_iata
+    return by_iata
+
 def get_events_for_hub_day(hub_iata, local_dt, tz_str):
     utc_dt = local_dt.astimezone(pytz.utc)
-    events = get_faa_events_by_day(utc_dt.date())
+    events = get_faa_events_index(utc_dt.date()).get(hub_iata, [])
     result = []
     after_events = []
     until_events = []
@@ -195,9 +401,6 @@ def get_events_for_hub_day(hub_iata, local_dt, tz_str):
     viewing_date_local = local_dt.date()
 
     for e in events:
-        if e["iata"] != hub_iata:
-            continue
-        
         event_dt_utc = datetime.fromisoformat(e['event_dt_utc'])
         dt_local = event_dt_utc.astimezone(tz)
 
@@ -262,24 +465,28 @@ def get_events_for_hub_day(hub_iata, local_dt, tz_str):
             })
     return result
 
-def fetch_and_log_weather(iata):
-    grid = get_nws_grid(iata)
+def fetch_weather(iata):
+    """
+    Downloads forecasts, alerts and the aviation discussion for a hub.
+    Performs no database writes, so it is safe to call from refresh worker threads.
+    Returns a dict with the weather data plus anything that still needs to be logged
+    (see log_weather), or None on failure.
+    """
+    grid, is_new_grid = load_nws_grid(iata)
     if not grid:
         return None
     try:
-        resp_hourly = requests.get(grid["forecastHourly"], timeout=15)
-        resp_hourly.raise_for_status()
-        hourly = resp_hourly.json()
+        # NWS regenerates forecasts roughly hourly, so these are usually served
+        # from the response cache or revalidated with a 304.
+        hourly = http_client.get_cached_json(grid["forecastHourly"], timeout=15, upstream="nws_forecast_hourly")
         hourly_periods = hourly.get("properties", {}).get("periods", [])
 
-        resp_daily = requests.get(grid["forecast"], timeout=15)
-        resp_daily.raise_for_status()
-        daily = resp_daily.json()
+        daily = http_client.get_cached_json(grid["forecast"], timeout=15, upstream="nws_forecast")
         daily_periods = daily.get("properties", {}).get("periods", [])
 
         alerts = fetch_weather_alerts(grid.get("forecastZone"))
         
-        aviation_forecast = fetch_aviation_forecast_discussion(grid.get("cwa"))
+        aviation_forecast, new_discussion = load_aviation_forecast_discussion(grid.get("cwa"))
 
         now = datetime.now(pytz.timezone(grid["timezone"]))
         now_utc = datetime.now(pytz.utc)
@@ -294,259 +501,1340 @@ def fetch_and_log_weather(iata):
                 if start_time <= now_utc < end_time:
                     current_period = period
                     break
-        
-        if current_period:
-            key = current_period["startTime"]
-            # Only save if it's a new hour and we haven't saved it before.
-            exists = HourlyWeather.query.filter_by(iata=iata, start_time=key).first()
-            if not exists:
-                ymd = now.strftime("%Y-%m-%d")
-                db.session.add(HourlyWeather(
-                    iata=iata,
-                    start_time=key,
-                    data_json=json.dumps(current_period),
-                    date=ymd
-                ))
-                db.session.commit()
 
         return {
-            "hourly": hourly_periods,
-            "daily": daily_periods,
-            "timezone": grid["timezone"],
-            "alerts": alerts,
-            "aviation_forecast": aviation_forecast
+            "weather": {
+                "hourly": hourly_periods,
+                "daily": daily_periods,
+                "timezone": grid["timezone"],
+                "alerts": alerts,
+                "aviation_forecast": aviation_forecast
+            },
+            "current_period": current_period,
+            "date": now.strftime("%Y-%m-%d"),
+            "cwa": grid.get("cwa"),
+            "new_discussion": new_discussion,
+            "new_grid": grid if is_new_grid else None
         }
     except requests.RequestException as e:
         logging.error(f"Error fetching weather for {iata}: {e}")
         return None
 
-def fetch_faa_ground_stops():
-    url = "https://nasstatus.faa.gov/api/airport-status-information"
-    output = {}
-    try:
-        resp = requests.get(url, timeout=15)
-        resp.raise_for_status()
+def log_weather(iata, fetched):
+    """
+    Stages the database writes for a result of fetch_weather: the current hour's
+    forecast period and any newly looked up NWS grid or downloaded aviation discussion.
+    Returns True if a new hour was logged. The caller is responsible for committing.
+    """
+    if fetched.get("new_grid") is not None:
+        store_nws_grid(iata, fetched["new_grid"])
+
+    if fetched.get("new_discussion") is not None:
+        store_aviation_forecast_discussion(fetched["cwa"], fetched["new_discussion"])
+
+    current_period = fetched.get("current_period")
+    if current_period:
+        # Only the first forecast logged for an hour is kept.
+        logged = db.session.execute(
+            insert(HourlyWeather.__table__).values(
+                iata=iata,
+                start_time=current_period["startTime"],
+                data_json=json.dumps(current_period),
+                date=fetched["date"]
+            ).on_conflict_do_nothing(index_elements=["iata", "start_time"])
+        ).rowcount > 0
+        if logged:
+            update_day_coverage([(iata, fetched["date"])])
+        return logged
+    return False
+
+def fetch_and_log_weather(iata):
+    fetched = fetch_weather(iata)
+    if not fetched:
+        return None
+    log_weather(iata, fetched)
+    db.session.commit()
+    return fetched["weather"]
+
+def _merge_weather_data(tz_name, db_hours, snapshot_content):
+    data_out = {
+        "hourly": [], "daily": [], "timezone": tz_name, "sirs": [],
+        "terminal_constraints": [], "faa_events": [], "alerts": [],
+        "aviation_forecast": None
+    }
+    logged_by_time = {h.start_time: h.as_dict() for h in db_hours}
 
-        # Handle JSON response first
-        if resp.headers.get("Content-Type", "").startswith("application/json"):
-            data = resp.json()
-            for ap in data.get("AirportStatusList", []):
-                iata = ap.get("IATA")
-                for gs in ap.get("GroundStops", []):
-                    if gs.get("EndTime"):
-                        reason = gs.get("Reason", "Ground stop in effect")
-                        end_time = gs.get("EndTime", "")
-                        if iata:
-                            output[iata] = {"reason": reason, "end_time": end_time}
-            return output
-
-        # Fallback to XML response (potentially wrapped in HTML)
-        xml_string = resp.text
-        if resp.text.strip().lower().startswith(("<html", "<!doctype html")):
-            soup = BeautifulSoup(resp.text, 'html.parser')
-            xml_div = soup.find('div', id='webkit-xml-viewer-source-xml')
-            if xml_div and xml_div.contents:
-                xml_string = str(xml_div.contents[0])
+    forecast_data = None
+    if snapshot_content:
+        forecast_data = snapshot_content.get("weather")
+        data_out["sirs"] = snapshot_content.get("sirs", [])
+        data_out["terminal_constraints"] = snapshot_content.get("terminal_constraints", [])
+        data_out["faa_events"] = snapshot_content.get("faa_events", [])
+        if forecast_data:
+            data_out["daily"] = forecast_data.get("daily", [])
+            data_out["alerts"] = forecast_data.get("alerts", [])
+            data_out["aviation_forecast"] = forecast_data.get("aviation_forecast")
+
+    # --- MERGE LOGIC ---
+    # This logic combines past data (from HourlyWeather) with the most recent forecast
+    # (from the latest snapshot of the day), prioritizing the actual logged data.
+    result_hourly = []
+    seen = set()
+
+    # 1. Prioritize all logged historical data for the day.
+    for key, val in logged_by_time.items():
+        result_hourly.append(val)
+        seen.add(key)
+
+    # 2. Fill in the rest from the snapshot's forecast, avoiding duplicates.
+    if forecast_data and "hourly" in forecast_data:
+        for period in forecast_data.get("hourly", []):
+            key = period["startTime"]
+            if key not in seen:
+                result_hourly.append(period)
+                # No need to add to seen, as we won't loop over forecast_data again.
+
+    result_hourly.sort(key=lambda x: x["startTime"])
+    data_out["hourly"] = result_hourly
+    return data_out
+
+def build_weather_data(requested):
+    """
+    Builds /api/weather payloads from the database: every hour logged in
+    HourlyWeather, filled in with the forecast, alerts and FAA data of the
+    day's latest snapshot, or of its SnapshotArchive once rolled up.
+    requested maps iata -> (tz_name, local_date_str).
+    Hubs are loaded with one query per table for each distinct date, so the
+    cost doesn't grow with the number of requests.
+    Returns {iata: payload}.
+    """
+    iatas_by_date = {}
+    for iata, (tz_name, local_date_str) in requested.items():
+        iatas_by_date.setdefault(local_date_str, []).append(iata)
+
+    hours_by_iata = {}
+    latest_snapshots = []
+    for local_date_str, iatas in iatas_by_date.items():
+        # Get all historically logged hours for the requested date from HourlyWeather
+        db_hours = HourlyWeather.query.filter(
+            HourlyWeather.date == local_date_str, HourlyWeather.iata.in_(iatas)
+        ).order_by(HourlyWeather.start_time).all()
+        for row in db_hours:
+            hours_by_iata.setdefault(row.iata, []).append(row)
+
+        # For both today and archive views, we now primarily rely on snapshots.
+        # This prevents slow, on-demand external API calls from this route.
+        latest_hour = (
+            select(HourlySnapshot.iata, func.max(HourlySnapshot.hour).label("hour"))
+            .where(HourlySnapshot.date == local_date_str, HourlySnapshot.iata.in_(iatas))
+            .group_by(HourlySnapshot.iata)
+            .subquery()
+        )
+        date_snapshots = HourlySnapshot.query.join(
+            latest_hour, (HourlySnapshot.iata == latest_hour.c.iata) & (HourlySnapshot.hour == latest_hour.c.hour)
+        ).filter(HourlySnapshot.date == local_date_str).all()
+        latest_snapshots += [(snapshot.iata, json.loads(snapshot.snapshot_json)) for snapshot in date_snapshots]
+
+        # Days past the retention period only have the final snapshot of their archive.
+        archived_iatas = set(iatas) - {snapshot.iata for snapshot in date_snapshots}
+        if archived_iatas:
+            archives = SnapshotArchive.query.filter(
+                SnapshotArchive.date == local_date_str, SnapshotArchive.iata.in_(archived_iatas)
+            ).all()
+            latest_snapshots += [(archive.iata, json.loads(archive.archive_json)["final"]) for archive in archives]
+
+    contents = unpack_snapshots([snapshot for iata, snapshot in latest_snapshots])
+    content_by_iata = {iata: content for (iata, snapshot), content in zip(latest_snapshots, contents)}
+
+    return {
+        iata: _merge_weather_data(tz_name, hours_by_iata.get(iata, []), content_by_iata.get(iata))
+        for iata, (tz_name, local_date_str) in requested.items()
+    }
+
+def _weather_response_generation(iata):
+    return (WEATHER_RESPONSE_GENERATION.get(None, 0), WEATHER_RESPONSE_GENERATION.get(iata, 0))
+
+def get_weather_responses(requested):
+    """
+    Returns {iata: {"body": bytes, "etag": str}} for /api/weather, where
+    requested maps iata -> (tz_name, local_date_str). Only hubs that aren't
+    cached are rendered, together, with build_weather_data. The response only
+    depends on the database, so entries stay valid until
+    invalidate_weather_responses is called for the hub; past dates are never
+    written by the refresh job and stay cached until evicted.
+    """
+    responses = {}
+    missing = {}
+    generations = {}
+    with _weather_response_lock:
+        for iata, (tz_name, local_date_str) in requested.items():
+            key = (iata, local_date_str)
+            entry = WEATHER_RESPONSE_CACHE.get(key)
+            if entry is not None:
+                WEATHER_RESPONSE_CACHE.move_to_end(key)
+                responses[iata] = entry
             else:
-                xml_string = resp.text
-
-        if "AIRPORT_STATUS_INFORMATION" in xml_string:
-            root = ElementTree.fromstring(xml_string)
-            for program in root.findall(".//Ground_Stop_List/Program"):
-                iata = program.findtext("ARPT")
-                reason = program.findtext("Reason") or "Ground stop in effect"
-                end_time = program.findtext("End_Time") or ""
-                if iata:
-                    output[iata] = {"reason": reason, "end_time": end_time}
-            return output
+                missing[iata] = (tz_name, local_date_str)
+                generations[iata] = _weather_response_generation(iata)
+    if not missing:
+        return responses
 
-    except Exception as e:
-        logging.error(f"Error in fetch_faa_ground_stops: {e}")
-        pass
+    for iata, data in build_weather_data(missing).items():
+        body = json.dumps(data, sort_keys=True, separators=(",", ":")).encode("utf-8")
+        responses[iata] = {"body": body, "etag": hashlib.sha256(body).hexdigest()[:32]}
+
+    with _weather_response_lock:
+        for iata, (tz_name, local_date_str) in missing.items():
+            # Don't cache a body read while the refresh job was replacing it.
+            if generations[iata] == _weather_response_generation(iata):
+                WEATHER_RESPONSE_CACHE[(iata, local_date_str)] = responses[iata]
+        while len(WEATHER_RESPONSE_CACHE) > config.WEATHER_RESPONSE_CACHE_SIZE:
+            WEATHER_RESPONSE_CACHE.popitem(last=False)
+    return responses
+
+def get_weather_response(iata, tz_name, local_date_str):
+    """Returns the cached /api/weather response of a single hub, see get_weather_responses."""
+    return get_weather_responses({iata: (tz_name, local_date_str)})[iata]
+
+def invalidate_weather_responses(iata=None, dates=None):
+    """
+    Drops cached /api/weather responses after their data was written.
+    With no iata every entry is dropped (imports, admin edits); otherwise only
+    the hub's entries for the given dates, or all of its dates if dates is None.
+    """
+    with _weather_response_lock:
+        WEATHER_RESPONSE_GENERATION[iata] = WEATHER_RESPONSE_GENERATION.get(iata, 0) + 1
+        for key in list(WEATHER_RESPONSE_CACHE):
+            if iata is None or (key[0] == iata and (dates is None or key[1] in dates)):
+                del WEATHER_RESPONSE_CACHE[key]
+        if iata is None:
+            HUB_DATA_VERSIONS["epoch"] = max(HUB_DATA_VERSIONS["epoch"] + 1, int(time.time() * 1000))
+            HUB_DATA_VERSIONS["versions"] = {}
+
+def get_hub_versions(iatas=None):
+    """Returns {"epoch": int, "versions": {iata: int}} for the given hubs, or every hub that has changed."""
+    with _weather_response_lock:
+        versions = HUB_DATA_VERSIONS["versions"]
+        if iatas is not None:
+            versions = {iata: versions.get(iata, 0) for iata in iatas}
+        return {"epoch": HUB_DATA_VERSIONS["epoch"], "versions": dict(versions)}
+
+def _bump_hub_version(iata):
+    with _weather_response_lock:
+        versions = HUB_DATA_VERSIONS["versions"]
+        versions[iata] = versions.get(iata, 0) + 1
+
+def _snapshot_sections(snapshot_str):
+    """Splits a packed snapshot into its top level and weather sections, serialized for comparison."""
+    snapshot = json.loads(snapshot_str)
+    weather = snapshot.pop("weather", None)
+    sections = {key: json.dumps(value, sort_keys=True) for key, value in snapshot.items()}
+    if isinstance(weather, dict):
+        # Large sections are blob references at this point, so this stays cheap.
+        sections.update({key: json.dumps(value, sort_keys=True) for key, value in weather.items()})
+    return sections
+
+def get_hourly_snapshots(iata, local_date_str):
+    """A day's snapshots as /api/hourly-snapshots returns them, with archived hours expanded."""
+    rows = HourlySnapshot.query.filter_by(iata=iata, date=local_date_str).order_by(HourlySnapshot.hour).all()
+    snapshots = [row.as_dict() for row in rows]
+    # Days past the retention period are served from their archive.
+    archive = SnapshotArchive.query.filter_by(iata=iata, date=local_date_str).first()
+    if archive:
+        live_hours = {row.hour for row in rows}
+        snapshots += [snapshot for snapshot in archive.as_snapshots() if snapshot["hour"] not in live_hours]
+        snapshots.sort(key=lambda snapshot: snapshot["hour"])
+    return snapshots
+
+def _faa_events_for_day(events, local_date_str, tz, today_str):
+    """The hub's FAA events if they are for the given day, as the dashboard decides it."""
+    dated = next((event for event in events if event.get("local_time_iso")), None)
+    if dated:
+        try:
+            event_date = datetime.fromisoformat(dated["local_time_iso"]).astimezone(tz).strftime("%Y-%m-%d")
+        except ValueError:
+            event_date = None
+    else:
+        # Without a date, the list is assumed to be for the hub's today.
+        event_date = local_date_str if local_date_str == today_str else None
+    return events if event_date == local_date_str else []
+
+def _ground_stop_hours(ground_stop, day_offset, highlight_hour):
+    """
+    Returns (ground stop still in effect on the day, {"start", "end"} hours it covers or None),
+    following the dashboard: an active stop covers the rest of today up to its end time,
+    or spills into tomorrow if that end time has already passed today.
+    """
+    end_hour = -1
+    crosses_midnight = False
+    if ground_stop and ground_stop.get("end_time"):
+        match = GROUND_STOP_END_RE.search(ground_stop["end_time"])
+        if match:
+            end_hour = int(match.group(1))
+            ampm = (match.group(3) or "").lower()
+            if ampm == "pm" and end_hour < 12:
+                end_hour += 12
+            if ampm == "am" and end_hour == 12:
+                end_hour = 0
+            if highlight_hour is not None and end_hour < highlight_hour:
+                crosses_midnight = True
+
+    effective = ground_stop
+    if ground_stop and end_hour != -1 and (day_offset > 1 or (day_offset == 1 and not crosses_midnight)):
+        effective = None
+
+    hours = None
+    if effective and end_hour != -1:
+        if day_offset == 0 and highlight_hour is not None:
+            hours = {"start": highlight_hour, "end": 23 if crosses_midnight else end_hour}
+        elif day_offset == 1 and crosses_midnight:
+            hours = {"start": 0, "end": end_hour}
+    return effective, hours
+
+def _score_snapshots(hub_info, local_date_str, snapshots, today_str):
+    """risk.analyze_day_hours over a day's snapshots, as the archive view scores them."""
+    tz = pytz.timezone(hub_info["tz"])
+    periods = {}
+    faa_events = []
+    for snapshot in snapshots:
+        hourly = (snapshot.get("weather") or {}).get("hourly") or []
+        for period in hourly:
+            try:
+                if datetime.fromisoformat(period["startTime"]).astimezone(tz).hour == snapshot["hour"]:
+                    periods[snapshot["hour"]] = period
+                    break
+            except (KeyError, TypeError, ValueError):
+                continue
+        if snapshot.get("faa_events") is not None:
+            faa_events = snapshot["faa_events"]
+    return risk.analyze_day_hours(
+        [periods[hour] for hour in sorted(periods)], local_date_str, hub_info["tz"], None, hub_info["name"],
+        local_date_str, hub_info["runways"], _faa_events_for_day(faa_events, local_date_str, tz, today_str),
+        snapshots=snapshots
+    )
+
+def compute_hub_risk(hub_info, local_date_str, now=None):
+    """
+    Scores a hub's day hour by hour with the dashboard's rules (see risk.py).
+    Days before the hub's today are scored from their snapshots like the archive
+    view; today and later from today's /api/weather data and the live FAA ground
+    stops and delay programs.
+    """
+    iata = hub_info["iata"]
+    tz = pytz.timezone(hub_info["tz"])
+    now = now or datetime.now(tz)
+    today_str = now.strftime("%Y-%m-%d")
+
+    if local_date_str < today_str:
+        analysis = _score_snapshots(hub_info, local_date_str, get_hourly_snapshots(iata, local_date_str), today_str)
+        assessment = risk.get_daily_assessment(analysis["percentHigh"], analysis["percentPartial"])
+        return {"iata": iata, "date": local_date_str, "archive": True, **analysis, "assessment": assessment}
+
+    weather = build_weather_data({iata: (hub_info["tz"], today_str)})[iata]
+    day_offset = (datetime.strptime(local_date_str, "%Y-%m-%d") - datetime.strptime(today_str, "%Y-%m-%d")).days
+    highlight_hour = now.hour if day_offset == 0 else None
+    ground_stop = (GROUND_STOPS_CACHE.get("json") or {}).get(iata)
+    ground_delay = (GROUND_DELAYS_CACHE.get("json") or {}).get(iata)
+    effective_ground_stop, ground_stop_hours = _ground_stop_hours(ground_stop, day_offset, highlight_hour)
+    analysis = risk.analyze_day_hours(
+        weather["hourly"], local_date_str, hub_info["tz"], highlight_hour, hub_info["name"], local_date_str,
+        hub_info["runways"], _faa_events_for_day(weather["faa_events"], local_date_str, tz, today_str),
+        ground_stop_hours, ground_delay if day_offset == 0 else None
+    )
+    assessment = risk.get_daily_assessment(analysis["percentHigh"], analysis["percentPartial"])
+    if effective_ground_stop:
+        assessment = {"label": "🛑 ACTIVE IROP", "class": "risk-high", "summary": "Active IROP"}
+    elif ground_delay and day_offset == 0:
+        assessment = {"label": "DELAY PROGRAM", "class": "risk-moderate", "summary": "Active Delay"}
+    return {"iata": iata, "date": local_date_str, "archive": False, **analysis, "assessment": assessment}
+
+def get_hub_risk(hub_info, local_date_str):
+    """
+    compute_hub_risk, cached until the hub or its data changes, the hub's
+    local hour changes or the ground stops / delay programs are updated.
+    """
+    iata = hub_info["iata"]
+    key = (iata, local_date_str)
+    stamp = (
+        _weather_response_generation(iata),
+        datetime.now(pytz.timezone(hub_info["tz"])).strftime("%Y-%m-%d %H"),
+        GROUND_STOPS_CACHE.get("time"),
+        GROUND_DELAYS_CACHE.get("time"),
+        json.dumps(hub_info, sort_keys=True) # Hub edits (runways, time zone) apply right away
+    )
+    with _risk_lock:
+        entry = RISK_CACHE.get(key)
+        if entry and entry["stamp"] == stamp:
+            RISK_CACHE.move_to_end(key)
+            return entry["result"]
+    result = compute_hub_risk(hub_info, local_date_str)
+    with _risk_lock:
+        RISK_CACHE[key] = {"stamp": stamp, "result": result}
+        RISK_CACHE.move_to_end(key)
+        while len(RISK_CACHE) > RISK_CACHE_SIZE:
+            RISK_CACHE.popitem(last=False)
+    return result
+
+def refresh_hub_risks(hubs):
+    """Computes the risk of the days the dashboard shows for every hub, so requests are served from the cache."""
+    for hub_info in hubs:
+        try:
+            today = datetime.now(pytz.timezone(hub_info["tz"]))
+            for day_offset in range(RISK_LIVE_DAYS):
+                get_hub_risk(hub_info, (today + timedelta(days=day_offset)).strftime("%Y-%m-%d"))
+        except Exception as e:
+            logging.error(f"Error computing risk for {hub_info.get('iata')}: {e}")
+
+def _hub_hash(hub_info):
+    return hashlib.sha1(json.dumps(hub_info, sort_keys=True).encode()).hexdigest()[:16]
+
+def summarize_day(hub_info, local_date_str):
+    """A DaySummary row for a hub's day, scored from its snapshots like the archive view."""
+    snapshots = get_hourly_snapshots(hub_info["iata"], local_date_str)
+    today_str = datetime.now(pytz.timezone(hub_info["tz"])).strftime("%Y-%m-%d")
+    analysis = _score_snapshots(hub_info, local_date_str, snapshots, today_str)
+    assessment = risk.get_daily_assessment(analysis["percentHigh"], analysis["percentPartial"])
+    blocks = analysis["hourBlocks"]
+    return {
+        "iata": hub_info["iata"],
+        "date": local_date_str,
+        "risk_class": assessment["class"],
+        "risk_summary": assessment["summary"],
+        "percent_high": analysis["percentHigh"],
+        "percent_partial": analysis["percentPartial"],
+        "high_hours": sum(1 for block in blocks if block["risk"] == "high"),
+        "ground_stop_hours": sum(1 for block in blocks if block["isGroundStop"]),
+        "ground_delay_hours": sum(1 for block in blocks if block["groundDelay"] is not None),
+        "snapshot_hours": len(snapshots),
+        "hub_hash": _hub_hash(hub_info)
+    }
+
+def _unscored_days(hubs, month=None):
+    """
+    (iata, date) of the days with snapshots whose DaySummary is missing (new or
+    changed days) or was scored with different hub settings, newest first.
+    """
+    hashes = {iata: _hub_hash(hub_info) for iata, hub_info in hubs.items()}
+    query = db.session.query(DayCoverage.iata, DayCoverage.date, DaySummary.hub_hash).outerjoin(
+        DaySummary, (DaySummary.iata == DayCoverage.iata) & (DaySummary.date == DayCoverage.date)
+    ).filter(DayCoverage.snapshot_hours > 0, DayCoverage.iata.in_(hubs))
+    if month:
+        query = query.filter(DayCoverage.date.like(f"{month}-%"))
+    return [(iata, date) for iata, date, hub_hash in query.order_by(DayCoverage.date.desc(), DayCoverage.iata) if hub_hash != hashes[iata]]
+
+def request_day_summaries(hubs, month):
+    """
+    Returns how many days of a month still need scoring, queueing the month for
+    the refresh job if any do. Only reads, so it is safe on request threads.
+    """
+    unscored = len(_unscored_days({hub_info["iata"]: hub_info for hub_info in hubs}, month))
+    if unscored:
+        with _summary_months_lock:
+            PENDING_SUMMARY_MONTHS.add(month)
+    return unscored
+
+def refresh_day_summaries(hubs, max_days=None):
+    """
+    Writes up to max_days missing or outdated DaySummary rows, days of months
+    queued by request_day_summaries first, then the rest newest first.
+    Runs on the refresh thread. Returns how many were written.
+    """
+    hubs = {hub_info["iata"]: hub_info for hub_info in hubs}
+    with _summary_months_lock:
+        months = sorted(PENDING_SUMMARY_MONTHS, reverse=True)
+    pending = []
+    for month in months:
+        days = _unscored_days(hubs, month)
+        if max_days is None or len(pending) + len(days) <= max_days:
+            with _summary_months_lock:
+                PENDING_SUMMARY_MONTHS.discard(month) # Done after this batch
+        pending += days
+    if max_days is None or len(pending) < max_days:
+        queued = set(pending)
+        pending += [key for key in _unscored_days(hubs) if key not in queued]
+    if max_days is not None:
+        pending = pending[:max_days]
+    if not pending:
+        return 0
+
+    rows = [summarize_day(hubs[iata], date) for iata, date in pending]
+    stmt = insert(DaySummary.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["iata", "date"],
+        set_={key: stmt.excluded[key] for key in rows[0] if key not in ("iata", "date")}
+    )
+    db.session.execute(stmt, rows)
+    db.session.commit()
+    return len(rows)
+
+def _empty_faa_airport_status():
+    return {"ground_stops": {}, "ground_delays": {}, "arrival_departure_delays": {}, "closures": {}}
+
+def parse_faa_airport_status(body, content_type=""):
+    """
+    Parses the FAA airport status document (JSON, or XML possibly wrapped in HTML)
+    into a dict of programs keyed by IATA code.
+    """
+    output = _empty_faa_airport_status()
+
+    # Handle JSON response first
+    if content_type.startswith("application/json"):
+        data = json.loads(body)
+        for ap in data.get("AirportStatusList", []):
+            iata = ap.get("IATA")
+            if not iata:
+                continue
+            for gs in ap.get("GroundStops", []):
+                if gs.get("EndTime"):
+                    reason = gs.get("Reason", "Ground stop in effect")
+                    end_time = gs.get("EndTime", "")
+                    output["ground_stops"][iata] = {"reason": reason, "end_time": end_time}
+            for gd in ap.get("GroundDelays", []):
+                reason = gd.get("Reason", "Ground delay in effect")
+                avg_delay = gd.get("AvgDelay", "N/A")
+                output["ground_delays"][iata] = {"reason": reason, "avg_delay": avg_delay}
+            for ad in ap.get("ArrivalDepartureDelays", []):
+                output["arrival_departure_delays"][iata] = {
+                    "reason": ad.get("Reason", "Delays in effect"),
+                    "type": ad.get("Type", ""),
+                    "min": ad.get("Min", ""),
+                    "max": ad.get("Max", ""),
+                    "trend": ad.get("Trend", "")
+                }
+            for cl in ap.get("Closures", []):
+                output["closures"][iata] = {
+                    "reason": cl.get("Reason", "Airport closed"),
+                    "start": cl.get("Start", ""),
+                    "reopen": cl.get("Reopen", "")
+                }
+        return output
+
+    # Fallback to XML response (potentially wrapped in HTML)
+    xml_string = body
+    if body.strip().lower().startswith(("<html", "<!doctype html")):
+        soup = BeautifulSoup(body, 'html.parser')
+        xml_div = soup.find('div', id='webkit-xml-viewer-source-xml')
+        if xml_div and xml_div.contents:
+            xml_string = str(xml_div.contents[0])
+
+    if "AIRPORT_STATUS_INFORMATION" in xml_string:
+        root = ElementTree.fromstring(xml_string)
+        for program in root.findall(".//Ground_Stop_List/Program"):
+            iata = program.findtext("ARPT")
+            reason = program.findtext("Reason") or "Ground stop in effect"
+            end_time = program.findtext("End_Time") or ""
+            if iata:
+                output["ground_stops"][iata] = {"reason": reason, "end_time": end_time}
+        for gd in root.findall(".//Ground_Delay"):
+            iata = gd.findtext("ARPT")
+            reason = gd.findtext("Reason") or "Ground delay in effect"
+            avg_delay = gd.findtext("Avg") or "N/A"
+            if iata:
+                output["ground_delays"][iata] = {"reason": reason, "avg_delay": avg_delay}
+        for delay in root.findall(".//Arrival_Departure_Delay_List/Delay"):
+            iata = delay.findtext("ARPT")
+            arr_dep = delay.find("Arrival_Departure")
+            if iata:
+                output["arrival_departure_delays"][iata] = {
+                    "reason": delay.findtext("Reason") or "Delays in effect",
+                    "type": arr_dep.get("Type", "") if arr_dep is not None else "",
+                    "min": delay.findtext("Arrival_Departure/Min") or "",
+                    "max": delay.findtext("Arrival_Departure/Max") or "",
+                    "trend": delay.findtext("Arrival_Departure/Trend") or ""
+                }
+        for closure in root.findall(".//Airport_Closure_List/Airport"):
+            iata = closure.findtext("ARPT")
+            if iata:
+                output["closures"][iata] = {
+                    "reason": closure.findtext("Reason") or "Airport closed",
+                    "start": closure.findtext("Start") or "",
+                    "reopen": closure.findtext("Reopen") or ""
+                }
     return output
 
-def fetch_faa_ground_delays():
-    url = "https://nasstatus.faa.gov/api/airport-status-information"
-    output = {}
+def fetch_faa_airport_status():
+    """
+    Fetches and parses the FAA airport status feed once for all programs
+    (ground stops, ground delays, arrival/departure delays and closures).
+    Uses a conditional GET so an unchanged feed costs a 304 and no parsing.
+    """
+    cache = FAA_AIRPORT_STATUS_CACHE
+    headers = {}
+    if cache.get("json") is not None:
+        if cache.get("etag"):
+            headers["If-None-Match"] = cache["etag"]
+        if cache.get("last_modified"):
+            headers["If-Modified-Since"] = cache["last_modified"]
     try:
-        resp = requests.get(url, timeout=15)
+        resp = http_client.get(FAA_AIRPORT_STATUS_URL, headers=headers, timeout=15, upstream="faa_airport_status")
+        if resp.status_code == 304 and cache.get("json") is not None:
+            cache["time"] = datetime.utcnow()
+            return cache["json"]
         resp.raise_for_status()
 
-        # Handle JSON response first
-        if resp.headers.get("Content-Type", "").startswith("application/json"):
-            data = resp.json()
-            for ap in data.get("AirportStatusList", []):
-                iata = ap.get("IATA")
-                for gd in ap.get("GroundDelays", []):
-                    reason = gd.get("Reason", "Ground delay in effect")
-                    avg_delay = gd.get("AvgDelay", "N/A")
-                    if iata:
-                        output[iata] = {"reason": reason, "avg_delay": avg_delay}
-            return output
-
-        # Fallback to XML response (potentially wrapped in HTML)
-        xml_string = resp.text
-        if resp.text.strip().lower().startswith(("<html", "<!doctype html")):
-            soup = BeautifulSoup(resp.text, 'html.parser')
-            xml_div = soup.find('div', id='webkit-xml-viewer-source-xml')
-            if xml_div and xml_div.contents:
-                xml_string = str(xml_div.contents[0])
-            else:
-                xml_string = resp.text
-
-        if "AIRPORT_STATUS_INFORMATION" in xml_string:
-            root = ElementTree.fromstring(xml_string)
-            for gd in root.findall(".//Ground_Delay"):
-                iata = gd.findtext("ARPT")
-                reason = gd.findtext("Reason") or "Ground delay in effect"
-                avg_delay = gd.findtext("Avg") or "N/A"
-                if iata:
-                    output[iata] = {"reason": reason, "avg_delay": avg_delay}
-            return output
-
+        output = parse_faa_airport_status(resp.text, resp.headers.get("Content-Type", ""))
+        cache.update({
+            "json": output,
+            "time": datetime.utcnow(),
+            "etag": resp.headers.get("ETag"),
+            "last_modified": resp.headers.get("Last-Modified")
+        })
+        return output
     except Exception as e:
-        logging.error(f"Error in fetch_faa_ground_delays: {e}")
-        pass
-    return output
+        logging.error(f"Error in fetch_faa_airport_status: {e}")
+    return _empty_faa_airport_status()
 
-def snapshot_hub_data(hub, ground_stops, ground_delays):
+def fetch_faa_ground_stops():
+    return fetch_faa_airport_status()["ground_stops"]
+
+def fetch_faa_ground_delays():
+    return fetch_faa_airport_status()["ground_delays"]
+
+def collect_hub_snapshot(hub_info, ground_stops, ground_delays):
     """
-    Creates and saves a data snapshot for a single hub.
-    This function assumes it's called within a Flask app context.
-    Returns True if data was changed/added, False otherwise.
+    Fetches everything needed for a hub's snapshot without writing to the database.
+    hub_info is a Hub.as_dict() so no ORM instance is shared between threads.
+    The result is persisted with save_hub_snapshot.
     """
     now = datetime.now()
-    iata = hub.iata
+    iata = hub_info["iata"]
     # Fetch fresh weather data
-    weather_data = fetch_and_log_weather(iata)
+    fetched = fetch_weather(iata)
     
     # Load other data for snapshot
     merged_log = load_daily_log()
     sirs = merged_log.get("hubs", {}).get(iata, {}).get("sirs", [])
     terminal_constraints = merged_log.get("hubs", {}).get(iata, {}).get("terminal_constraints", [])
-    faa_events = get_events_for_hub_day(iata, now, hub.tz)
+    faa_events = get_events_for_hub_day(iata, now, hub_info["tz"])
     
     snapshot = {
-        "weather": weather_data,
+        "weather": fetched["weather"] if fetched else None,
         "sirs": sirs,
         "terminal_constraints": terminal_constraints,
         "faa_events": faa_events,
         "ground_stop": ground_stops.get(iata),
         "ground_delay": ground_delays.get(iata)
     }
-    
-    cur_date = now.strftime('%Y-%m-%d')
-    cur_hour = now.hour
-    exists = HourlySnapshot.query.filter_by(iata=iata, date=cur_date, hour=cur_hour).first()
-    snapshot_str = json.dumps(snapshot)
-
-    data_changed = False
-    if not exists:
-        db.session.add(HourlySnapshot(
+
+    return {
+        "iata": iata,
+        "date": now.strftime('%Y-%m-%d'),
+        "hour": now.hour,
+        "snapshot": snapshot,
+        "fetched": fetched
+    }
+
+def store_snapshot_blobs(blobs):
+    """
+    Inserts the blobs from pack_snapshot that aren't stored yet.
+    Returns the number of bytes newly written. The caller is responsible for committing.
+    """
+    stored_bytes = 0
+    for blob_hash, content in blobs.items():
+        result = db.session.execute(
+            insert(SnapshotBlob.__table__).values(hash=blob_hash, content=content)
+            .on_conflict_do_nothing(index_elements=["hash"])
+        )
+        if result.rowcount > 0:
+            stored_bytes += len(content)
+    return stored_bytes
+
+def migrate_snapshot_blobs(after_id=0, batch_size=500):
+    """
+    Converts one batch of snapshots written before section deduplication.
+    Returns a dict with the id to resume after, the number of rows converted and
+    the bytes taken by those rows before and after (including new blobs).
+    Once a batch comes back short the cursor jumps to the newest row, so later
+    calls only look at rows added since (e.g. by an import).
+    """
+    table = HourlySnapshot.__table__
+    with _blob_lock:
+        # Compressed rows are always already packed, so only plain text rows need checking.
+        rows = db.session.execute(
+            select(table.c.id, table.c.snapshot_json, table.c.iata, table.c.date)
+            .where(
+                table.c.id > after_id,
+                func.typeof(table.c.snapshot_json) == 'text',
+                table.c.snapshot_json.notlike(f'%"{BLOB_REF_KEY}"%')
+            )
+            .order_by(table.c.id)
+            .limit(batch_size)
+        ).fetchall()
+
+        report = {"last_id": after_id, "rows": len(rows), "bytes_before": 0, "bytes_after": 0}
+        for row_id, snapshot_json, iata, date in rows:
+            report["last_id"] = row_id
+            report["bytes_before"] += len(snapshot_json)
+            try:
+                packed_json, blobs = pack_snapshot(json.loads(snapshot_json))
+            except (json.JSONDecodeError, AttributeError):
+                report["bytes_after"] += len(snapshot_json)
+                continue
+            report["bytes_after"] += len(packed_json) + store_snapshot_blobs(blobs)
+            if packed_json != snapshot_json:
+                db.session.execute(update(table).where(table.c.id == row_id).values(snapshot_json=packed_json))
+        if len(rows) < batch_size:
+            max_id = db.session.execute(text("SELECT MAX(id) FROM hourly_snapshot")).scalar()
+            report["last_id"] = max(report["last_id"], max_id or 0)
+        update_day_coverage((iata, date) for row_id, snapshot_json, iata, date in rows)
+        db.session.commit()
+    return report
+
+def recompress_json_columns(cursors, time_budget=2.0, batch_size=500):
+    """
+    Rewrites plain text rows of the CompressedText columns so they are stored
+    compressed, in batches until time_budget seconds have been spent.
+    cursors maps table name -> last id processed and is updated in place.
+    Returns the number of rows rewritten.
+    """
+    start_time = time.time()
+    rewritten = 0
+    for model, column in COMPRESSED_COLUMNS:
+        table = model.__table__
+        col = table.c[column]
+        has_days = "date" in table.c # Their DayCoverage sizes change too
+        while time.time() - start_time < time_budget:
+            rows = db.session.execute(
+                select(table.c.id, col, *((table.c.iata, table.c.date) if has_days else ()))
+                .where(table.c.id > cursors.get(table.name, 0), func.typeof(col) == 'text')
+                .order_by(table.c.id)
+                .limit(batch_size)
+            ).fetchall()
+            for row in rows:
+                # Reading decoded the value; writing it back through the column type compresses it.
+                db.session.execute(update(table).where(table.c.id == row[0]).values({column: row[1]}))
+                cursors[table.name] = row[0]
+            if has_days:
+                update_day_coverage((row[2], row[3]) for row in rows)
+            db.session.commit()
+            rewritten += len(rows)
+            if len(rows) < batch_size:
+                break
+    return rewritten
+
+def save_hub_snapshot(collected):
+    """
+    Writes the result of collect_hub_snapshot in a single commit.
+    Must be called from the thread that owns the database writes.
+    Returns the names of the sections clients see changing (e.g. "alerts",
+    "hourly", "ground_stop"), or an empty list if nothing visible changed.
+    """
+    iata = collected["iata"]
+    snapshot_str, blobs = pack_snapshot(collected["snapshot"])
+    # Taken before the first write, so prune_snapshot_blobs never waits on our transaction.
+    with _blob_lock:
+        weather_logged = False
+        if collected["fetched"]:
+            weather_logged = log_weather(iata, collected["fetched"])
+
+        store_snapshot_blobs(blobs)
+        stmt = insert(HourlySnapshot.__table__).values(
             iata=iata,
-            date=cur_date,
-            hour=cur_hour,
+            date=collected["date"],
+            hour=collected["hour"],
             snapshot_json=snapshot_str
-        ))
-        data_changed = True
-    else:
-        # Compare new snapshot with old one to see if an update is needed
-        if exists.snapshot_json != snapshot_str:
-            exists.snapshot_json = snapshot_str
-            data_changed = True
-    
+        )
+        # Only rewrite the hour's snapshot if it actually changed, so the row count
+        # tells us whether anything was inserted or updated.
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["iata", "date", "hour"],
+            set_={"snapshot_json": stmt.excluded.snapshot_json},
+            where=HourlySnapshot.__table__.c.snapshot_json != stmt.excluded.snapshot_json
+        )
+        data_changed = db.session.execute(stmt).rowcount > 0
+        if data_changed:
+            update_day_coverage([(iata, collected["date"])])
+        db.session.commit()
+
+    # Compare with the last snapshot saved for the hub, which may be from the previous hour.
+    previous_sections = SNAPSHOT_SECTIONS.get(iata)
+    current_sections = _snapshot_sections(snapshot_str)
+    SNAPSHOT_SECTIONS[iata] = current_sections
+    changed_sections = []
     if data_changed:
+        changed_sections = sorted(
+            key for key in set(previous_sections or {}) | set(current_sections)
+            if previous_sections is None or previous_sections.get(key) != current_sections.get(key)
+        )
+    if weather_logged and "hourly" not in changed_sections:
+        changed_sections.append("hourly")
+
+    if data_changed or weather_logged:
+        dates = {collected["date"]}
+        if collected["fetched"]:
+            dates.add(collected["fetched"]["date"])
+        invalidate_weather_responses(iata, dates)
+    if changed_sections:
+        _bump_hub_version(iata)
+
+    return changed_sections
+
+def snapshot_hub_data(hub, ground_stops, ground_delays):
+    """
+    Creates and saves a data snapshot for a single hub.
+    This function assumes it's called within a Flask app context.
+    Returns the changed sections, see save_hub_snapshot.
+    """
+    return save_hub_snapshot(collect_hub_snapshot(hub.as_dict(), ground_stops, ground_delays))
+
+def _archive_hour(hour, snapshot):
+    """The part of an hour's snapshot kept once its day is rolled up: the forecast period for that hour and the FAA data."""
+    weather = snapshot.get("weather") or {}
+    period = None
+    if weather.get("timezone") and weather.get("hourly"):
+        tz = pytz.timezone(weather["timezone"])
+        for candidate in weather["hourly"]:
+            try:
+                if datetime.fromisoformat(candidate["startTime"]).astimezone(tz).hour == hour:
+                    period = candidate
+                    break
+            except (KeyError, TypeError, ValueError):
+                continue
+    return {
+        "hour": hour,
+        "period": period,
+        "ground_stop": snapshot.get("ground_stop"),
+        "ground_delay": snapshot.get("ground_delay"),
+        "faa_events": snapshot.get("faa_events", [])
+    }
+
+def roll_up_snapshots(cutoff_date, max_days=None):
+    """
+    Replaces the snapshots of up to max_days hub-days dated before cutoff_date
+    (YYYY-MM-DD) with one SnapshotArchive row each, oldest first, committing
+    per hub-day. Snapshots imported for an already archived day are merged in.
+    Blobs only the removed snapshots used are left for prune_snapshot_blobs.
+    Returns the number of hub-days and snapshots rolled up.
+    """
+    max_days = max_days or config.SNAPSHOT_ROLLUP_BATCH_DAYS
+    pending = db.session.query(HourlySnapshot.iata, HourlySnapshot.date).filter(
+        HourlySnapshot.date < cutoff_date
+    ).distinct().order_by(HourlySnapshot.date, HourlySnapshot.iata).limit(max_days).all()
+
+    report = {"days": 0, "snapshots": 0}
+    for iata, date in pending:
+        with _blob_lock:
+            rows = HourlySnapshot.query.filter_by(iata=iata, date=date).order_by(HourlySnapshot.hour).all()
+            hours, packed = [], []
+            for row in rows:
+                try:
+                    packed.append(json.loads(row.snapshot_json))
+                    hours.append(row.hour)
+                except json.JSONDecodeError:
+                    logging.warning(f"Dropping unreadable snapshot {iata} {date} hour {row.hour} during roll-up.")
+            contents = unpack_snapshots(packed)
+            archived_hours = {hour: _archive_hour(hour, content) for hour, content in zip(hours, contents)}
+
+            archive = SnapshotArchive.query.filter_by(iata=iata, date=date).first()
+            final_hour, final = None, None
+            if contents:
+                # Repacked so snapshots written before deduplication don't keep their sections inline.
+                final_json, blobs = pack_snapshot(contents[-1])
+                store_snapshot_blobs(blobs)
+                final_hour, final = hours[-1], json.loads(final_json)
+            if archive is None:
+                archive = SnapshotArchive(iata=iata, date=date)
+                db.session.add(archive)
+            else:
+                previous = json.loads(archive.archive_json)
+                archived_hours = {**{entry["hour"]: entry for entry in previous["hours"]}, **archived_hours}
+                if final_hour is None or previous["final_hour"] > final_hour:
+                    final_hour, final = previous["final_hour"], previous["final"]
+
+            if final is not None:
+                archive.archive_json = json.dumps({
+                    "hours": [archived_hours[hour] for hour in sorted(archived_hours)],
+                    "final_hour": final_hour,
+                    "final": final
+                })
+            else:
+                db.session.expunge(archive) # Nothing readable to archive
+            HourlySnapshot.query.filter_by(iata=iata, date=date).delete()
+            update_day_coverage([(iata, date)])
+            db.session.commit()
+        invalidate_weather_responses(iata, {date})
+        report["days"] += 1
+        report["snapshots"] += len(rows)
+    return report
+
+def prune_snapshot_blobs(batch_size=500):
+    """
+    Deletes the SnapshotBlob rows no snapshot or archive references any more.
+    Returns the number of blobs deleted, or None without touching anything while
+    an import is copying blobs ahead of their snapshots.
+    """
+    with _blob_lock:
+        if _blob_imports:
+            return None
+        # A fresh transaction, so the reads see every snapshot committed before the lock was taken.
+        db.session.commit()
+        referenced = set()
+        for (snapshot_json,) in db.session.execute(select(HourlySnapshot.__table__.c.snapshot_json)).yield_per(batch_size):
+            referenced |= snapshot_blob_hashes(snapshot_json)
+        for (archive_json,) in db.session.execute(select(SnapshotArchive.__table__.c.archive_json)).yield_per(batch_size):
+            referenced |= archive_blob_hashes(archive_json)
+        table = SnapshotBlob.__table__
+        unreferenced = [row_id for row_id, blob_hash in db.session.execute(select(table.c.id, table.c.hash)) if blob_hash not in referenced]
+        for i in range(0, len(unreferenced), batch_size):
+            db.session.execute(table.delete().where(table.c.id.in_(unreferenced[i:i + batch_size])))
         db.session.commit()
+        return len(unreferenced)
 
-    return data_changed
+def run_blocking(func, *args):
+    """
+    Runs a long call that never yields, such as a sqlite3 backup or VACUUM, in an
+    OS thread and waits for it cooperatively. Under the eventlet worker threading
+    is monkey-patched and every thread is a green thread of one OS thread, so the
+    call would otherwise freeze all requests and Socket.IO clients until it returns.
+    Without monkey-patching the caller is already an OS thread and runs it directly.
+    """
+    if patcher.is_monkey_patched("thread"):
+        return tpool.execute(func, *args)
+    return func(*args)
+
+def reclaim_free_pages(max_pages=None):
+    """
+    Returns up to max_pages free pages of the weather database to the filesystem
+    with PRAGMA incremental_vacuum. Databases created before auto_vacuum was set
+    to INCREMENTAL need a one-time vacuum_database() (an admin action) first;
+    until then nothing is reclaimed. Returns the number of pages reclaimed.
+    """
+    global _vacuum_hint_logged
+    max_pages = max_pages or config.SNAPSHOT_VACUUM_PAGES
+    with db.engine.connect() as connection:
+        free_pages = connection.exec_driver_sql("PRAGMA freelist_count").scalar()
+        if not free_pages:
+            return 0
+        if connection.exec_driver_sql("PRAGMA auto_vacuum").scalar() != 2:
+            if not _vacuum_hint_logged:
+                logging.info(f"The weather database has {free_pages} free pages; run Compact Database in the admin panel to reclaim them.")
+                _vacuum_hint_logged = True
+            return 0
+        # Each step of the pragma frees one page, but sqlite3's execute() only steps it
+        # once; executescript() runs it to completion.
+        connection.connection.driver_connection.executescript(f"PRAGMA incremental_vacuum({int(max_pages)});")
+        return free_pages - connection.exec_driver_sql("PRAGMA freelist_count").scalar()
+
+def vacuum_database(app):
+    """
+    Rebuilds the weather database with VACUUM, which also switches a database
+    created before auto_vacuum=INCREMENTAL to it. Runs in its own thread, started
+    from the admin panel, with the VACUUM itself in an OS thread (see run_blocking);
+    progress is reported as TASK_STATUS['db_vacuum'].
+    Returns False if a VACUUM is already running.
+    """
+    database_path = db.engine.url.database
+    if not _vacuum_lock.acquire(blocking=False):
+        return False
+    task = app.TASK_STATUS.setdefault('db_vacuum', {'last_success': None})
+    task.update({'status': 'running', 'last_error': None, 'last_runtime': None})
+
+    def vacuum():
+        # Runs in an OS thread with a connection of its own, and doesn't log (see _write_export).
+        connection = sqlite3.connect(database_path, timeout=config.SQLITE_BUSY_TIMEOUT_MS / 1000)
+        try:
+            pages_before = connection.execute("PRAGMA page_count").fetchone()[0]
+            connection.execute("PRAGMA auto_vacuum = INCREMENTAL") # Applied by the VACUUM
+            connection.execute("VACUUM")
+            return pages_before, connection.execute("PRAGMA page_count").fetchone()[0]
+        finally:
+            connection.close()
+
+    def run():
+        start_time = time.time()
+        try:
+            logging.info("Vacuuming the weather database.")
+            pages_before, pages_after = run_blocking(vacuum)
+            logging.info(f"Vacuumed the weather database: {pages_before} -> {pages_after} pages.")
+            task.update({'status': 'completed', 'last_success': datetime.utcnow().isoformat() + 'Z', 'pages_reclaimed': pages_before - pages_after})
+        except Exception as e:
+            logging.error(f"Error vacuuming the weather database: {e}")
+            task.update({'status': 'error', 'last_error': str(e)})
+        finally:
+            task['last_runtime'] = f"{time.time() - start_time:.2f}s"
+            _vacuum_lock.release()
+
+    threading.Thread(target=run, daemon=True).start()
+    return True
+
+# Tables copied by process_imported_db, in order (blobs before the snapshots that
+# reference them), with the columns copied. Rows whose natural key already exists
+# are skipped by the unique indexes.
+IMPORT_TABLES = [
+    ("hourly_weather", ("iata", "start_time", "data_json", "date"), "weather data"),
+    ("snapshot_blob", ("hash", "content"), "snapshot sections"),
+    ("hourly_snapshot", ("iata", "date", "hour", "snapshot_json"), "snapshots"),
+    ("snapshot_archive", ("iata", "date", "archive_json"), "archived days"),
+]
+IMPORT_BATCH_ROWS = 20000
+MAX_SQLITE_ROWID = 2**63 - 1
 
 def process_imported_db(app, task_id, filepath):
     """
-    Wrapper function to run the DB import in a background thread with app context.
+    Imports an uploaded weatherlog database in a background thread.
+    The file is ATTACHed to a connection of its own and copied with
+    INSERT OR IGNORE ... SELECT in rowid ranges of IMPORT_BATCH_ROWS, committing
+    after each so the refresh job can write in between.
+    Compressed and plain rows are copied as stored; CompressedText reads both.
     Deletes the file upon completion or failure.
     """
+    global _blob_imports
     tasks_dict = app.IMPORT_TASKS
+    start_time = time.time()
+    imported_days = set()
+    # Waits out a running prune_snapshot_blobs and keeps new ones off until the copy is done.
+    with _blob_lock:
+        _blob_imports += 1
     try:
         with app.app_context():
             tasks_dict[task_id]['status'] = 'processing'
             tasks_dict[task_id]['message'] = 'Starting import...'
-            
-            source_engine = create_engine(f'sqlite:///{filepath}')
-            inspector = inspect(source_engine)
-            
-            total_rows_to_import = 0
-            
-            # Count rows for progress calculation
-            with source_engine.connect() as connection:
-                if inspector.has_table('hourly_weather'):
-                    count = connection.execute(text("SELECT COUNT(*) FROM hourly_weather")).scalar_one_or_none()
-                    total_rows_to_import += count if count is not None else 0
-                if inspector.has_table('hourly_snapshot'):
-                    count = connection.execute(text("SELECT COUNT(*) FROM hourly_snapshot")).scalar_one_or_none()
-                    total_rows_to_import += count if count is not None else 0
-
-            tasks_dict[task_id]['total_rows'] = total_rows_to_import
-            
-            if total_rows_to_import == 0:
-                tasks_dict[task_id]['status'] = 'complete'
-                tasks_dict[task_id]['stats'] = {"hourly_weather": 0, "hourly_snapshot": 0}
-                tasks_dict[task_id]['message'] = 'No new data to import from file.'
-                return
-
-            processed_rows = 0
-            imported_counts = {"hourly_weather": 0, "hourly_snapshot": 0}
-
-            # Import HourlyWeather
-            if inspector.has_table('hourly_weather'):
-                with source_engine.connect() as connection:
-                    result = connection.execute(text("SELECT iata, start_time, data_json, date FROM hourly_weather"))
-                    while True:
-                        chunk = result.fetchmany(1000)
-                        if not chunk:
-                            break
-                        for row in chunk:
-                            exists = db.session.query(HourlyWeather.id).filter_by(iata=row[0], start_time=row[1]).first()
-                            if not exists:
-                                new_weather = HourlyWeather(iata=row[0], start_time=row[1], data_json=row[2], date=row[3])
-                                db.session.add(new_weather)
-                                imported_counts["hourly_weather"] += 1
-                        
-                        processed_rows += len(chunk)
-                        tasks_dict[task_id]['progress'] = (processed_rows / total_rows_to_import) * 100
-                        tasks_dict[task_id]['message'] = f'Processing weather data... ({processed_rows}/{total_rows_to_import})'
-                        db.session.commit()
-
-            # Import HourlySnapshot
-            if inspector.has_table('hourly_snapshot'):
-                with source_engine.connect() as connection:
-                    result = connection.execute(text("SELECT iata, date, hour, snapshot_json FROM hourly_snapshot"))
-                    while True:
-                        chunk = result.fetchmany(1000)
-                        if not chunk:
-                            break
-                        for row in chunk:
-                            exists = db.session.query(HourlySnapshot.id).filter_by(iata=row[0], date=row[1], hour=row[2]).first()
-                            if not exists:
-                                new_snapshot = HourlySnapshot(iata=row[0], date=row[1], hour=row[2], snapshot_json=row[3])
-                                db.session.add(new_snapshot)
-                                imported_counts["hourly_snapshot"] += 1
-                        
-                        processed_rows += len(chunk)
-                        tasks_dict[task_id]['progress'] = (processed_rows / total_rows_to_import) * 100
-                        tasks_dict[task_id]['message'] = f'Processing snapshots... ({processed_rows}/{total_rows_to_import})'
-                        db.session.commit()
 
+            with db.engine.connect() as connection:
+                # ATTACH isn't allowed inside a transaction, so it runs before anything else.
+                connection.exec_driver_sql("ATTACH DATABASE ? AS import_src", (filepath,))
+                try:
+                    source_tables = {row[0] for row in connection.exec_driver_sql(
+                        "SELECT name FROM import_src.sqlite_master WHERE type = 'table'"
+                    )}
+
+                    total_rows_to_import = 0
+                    tables = []
+                    for table_name, columns, label in IMPORT_TABLES:
+                        if table_name not in source_tables:
+                            continue
+                        source_columns = {row[1] for row in connection.exec_driver_sql(f"PRAGMA import_src.table_info({table_name})")}
+                        missing = set(columns) - source_columns
+                        if missing:
+                            raise ValueError(f"Table '{table_name}' in the uploaded file is missing columns: {', '.join(sorted(missing))}")
+                        count = connection.exec_driver_sql(f"SELECT COUNT(*) FROM import_src.{table_name}").scalar()
+                        total_rows_to_import += count or 0
+                        tables.append((table_name, columns, label))
+                        if "date" in columns:
+                            imported_days.update(connection.exec_driver_sql(f"SELECT DISTINCT iata, date FROM import_src.{table_name}").fetchall())
+                    connection.commit()
+
+                    tasks_dict[task_id]['total_rows'] = total_rows_to_import
+
+                    if total_rows_to_import == 0:
+                        tasks_dict[task_id]['status'] = 'complete'
+                        tasks_dict[task_id]['stats'] = {"hourly_weather": 0, "hourly_snapshot": 0, "rows_per_second": 0}
+                        tasks_dict[task_id]['message'] = 'No new data to import from file.'
+                        return
+
+                    processed_rows = 0
+                    imported_counts = {"hourly_weather": 0, "hourly_snapshot": 0, "snapshot_blob": 0, "snapshot_archive": 0}
+
+                    for table_name, columns, label in tables:
+                        column_list = ", ".join(columns)
+                        insert_sql = (
+                            f"INSERT OR IGNORE INTO main.{table_name} ({column_list}) "
+                            f"SELECT {column_list} FROM import_src.{table_name} WHERE rowid > ? AND rowid <= ?"
+                        )
+                        # rowids can be zero or negative when set explicitly; None means the table is empty.
+                        last_rowid = connection.exec_driver_sql(f"SELECT MIN(rowid) - 1 FROM import_src.{table_name}").scalar()
+                        while last_rowid is not None:
+                            # The rowid closing this batch; None when fewer than a full batch are left.
+                            upper_rowid = connection.exec_driver_sql(
+                                f"SELECT rowid FROM import_src.{table_name} WHERE rowid > ? ORDER BY rowid LIMIT 1 OFFSET ?",
+                                (last_rowid, IMPORT_BATCH_ROWS - 1)
+                            ).scalar()
+                            if upper_rowid is not None:
+                                batch_upper, batch_rows = upper_rowid, IMPORT_BATCH_ROWS
+                            else:
+                                batch_upper = MAX_SQLITE_ROWID
+                                batch_rows = connection.exec_driver_sql(
+                                    f"SELECT COUNT(*) FROM import_src.{table_name} WHERE rowid > ?", (last_rowid,)
+                                ).scalar()
+                            imported_counts[table_name] += connection.exec_driver_sql(insert_sql, (last_rowid, batch_upper)).rowcount
+                            connection.commit()
+
+                            processed_rows += batch_rows
+                            rows_per_second = processed_rows / max(time.time() - start_time, 1e-6)
+                            tasks_dict[task_id]['progress'] = (processed_rows / total_rows_to_import) * 100
+                            tasks_dict[task_id]['rows_per_second'] = round(rows_per_second)
+                            tasks_dict[task_id]['message'] = f'Processing {label}... ({processed_rows}/{total_rows_to_import}, {rows_per_second:,.0f} rows/s)'
+                            last_rowid = upper_rowid
+                finally:
+                    connection.rollback()
+                    connection.exec_driver_sql("DETACH DATABASE import_src")
+
+            elapsed = time.time() - start_time
+            imported_counts["seconds"] = round(elapsed, 2)
+            imported_counts["rows_per_second"] = round(processed_rows / max(elapsed, 1e-6))
+            logging.info(f"Imported {processed_rows} rows from {filepath} in {elapsed:.2f}s ({imported_counts['rows_per_second']} rows/s): {imported_counts}")
             tasks_dict[task_id]['status'] = 'complete'
             tasks_dict[task_id]['stats'] = imported_counts
             tasks_dict[task_id]['message'] = 'Import finished successfully.'
 
     except Exception as e:
         logging.error(f"Error during background import (task {task_id}): {e}")
-        db.session.rollback()
         tasks_dict[task_id]['status'] = 'error'
         tasks_dict[task_id]['error'] = str(e)
     finally:
+        with _blob_lock:
+            _blob_imports -= 1
+        # Even a failed import may have committed some batches.
+        if imported_days:
+            try:
+                with app.app_context():
+                    update_day_coverage(imported_days)
+                    db.session.commit()
+            except Exception as e:
+                logging.error(f"Error updating day coverage after import (task {task_id}): {e}")
+        invalidate_weather_responses()
         if os.path.exists(filepath):
             os.remove(filepath)
             logging.info(f"Removed temporary import file: {filepath}")
+
+EXPORT_BACKUP_PAGES = 1024 # Pages copied per backup step; the live database is unlocked in between
+EXPORT_BACKUP_MAX_RESTARTS = 3
+EXPORT_CHUNK_BYTES = 1024 * 1024
+EXPORT_MAX_AGE_SECONDS = 3600
+
+def cleanup_stale_exports():
+    """Removes export files left behind by downloads that never finished."""
+    cutoff = time.time() - EXPORT_MAX_AGE_SECONDS
+    for name in os.listdir(config.DATA_DIR):
+        path = os.path.join(config.DATA_DIR, name)
+        if name.startswith("export_") and os.path.getmtime(path) < cutoff:
+            try:
+                os.remove(path)
+            except OSError as e:
+                logging.error(f"Could not remove stale export {path}: {e}")
+
+class _BackupRestarted(Exception):
+    pass
+
+def _backup_database(source, dest):
+    """
+    Copies source into dest with the online backup API, EXPORT_BACKUP_PAGES at a
+    time so writers can commit between steps. The whole copy is one sqlite3 call
+    that sleeps between steps without yielding, so under the eventlet worker it
+    must run in an OS thread (see run_blocking) for those writers to get a turn. A commit from another connection
+    restarts the backup, so after EXPORT_BACKUP_MAX_RESTARTS restarts the rest is
+    copied in a single step, during which writers wait on their busy timeout.
+    Returns the number of restarts.
+    """
+    restarts = [0]
+    last_remaining = [None]
+
+    def progress(status, remaining, total):
+        if last_remaining[0] is not None and remaining > last_remaining[0]:
+            restarts[0] += 1
+            if restarts[0] > EXPORT_BACKUP_MAX_RESTARTS:
+                raise _BackupRestarted()
+        last_remaining[0] = remaining
+
+    try:
+        source.backup(dest, pages=EXPORT_BACKUP_PAGES, progress=progress, sleep=0.05)
+    except _BackupRestarted:
+        source.backup(dest)
+    return restarts[0]
+
+def _write_export(source_path, export_path, start_date, end_date, iatas):
+    """
+    Copies the database at source_path to export_path and applies the filters of
+    prepare_weather_export. Runs in an OS thread, so it doesn't log (the logging
+    locks are green under eventlet). Returns the number of backup restarts.
+    """
+    source = sqlite3.connect(source_path)
+    dest = sqlite3.connect(export_path)
+    try:
+        restarts = _backup_database(source, dest)
+        conditions, params = [], []
+        if start_date:
+            conditions.append("date >= ?")
+            params.append(start_date)
+        if end_date:
+            conditions.append("date <= ?")
+            params.append(end_date)
+        if iatas:
+            conditions.append(f"iata IN ({', '.join('?' * len(iatas))})")
+            params.extend(iatas)
+        if conditions:
+            where = " AND ".join(conditions)
+            for table_name in ("hourly_weather", "hourly_snapshot", "snapshot_archive", "day_coverage", "day_summary"):
+                dest.execute(f"DELETE FROM {table_name} WHERE NOT ({where})", params)
+            keep = set()
+            for (snapshot_json,) in dest.execute("SELECT snapshot_json FROM hourly_snapshot"):
+                keep |= snapshot_blob_hashes(snapshot_json)
+            for (archive_json,) in dest.execute("SELECT archive_json FROM snapshot_archive"):
+                keep |= archive_blob_hashes(archive_json)
+            dest.execute("CREATE TEMP TABLE export_blob (hash TEXT PRIMARY KEY)")
+            dest.executemany("INSERT INTO export_blob (hash) VALUES (?)", ((blob_hash,) for blob_hash in keep))
+            dest.execute("DELETE FROM snapshot_blob WHERE hash NOT IN (SELECT hash FROM export_blob)")
+            dest.commit()
+            dest.execute("VACUUM")
+    finally:
+        source.close()
+        dest.close()
+    return restarts
+
+def prepare_weather_export(start_date=None, end_date=None, iatas=None):
+    """
+    Writes a consistent copy of the weather database to a new file in DATA_DIR
+    and returns its path. The copy is taken with SQLite's online backup API
+    (see _backup_database), so the refresh job keeps writing while it runs.
+    Dates (YYYY-MM-DD, inclusive) and hubs filter the copy afterwards, which
+    also drops the snapshot sections no remaining snapshot references.
+    The copy and the filtering run in an OS thread (see run_blocking).
+    """
+    cleanup_stale_exports()
+    export_path = os.path.join(config.DATA_DIR, f"export_{uuid.uuid4().hex}.db")
+    try:
+        restarts = run_blocking(_write_export, db.engine.url.database, export_path, start_date, end_date, iatas)
+    except Exception:
+        if os.path.exists(export_path):
+            os.remove(export_path)
+        raise
+    if restarts > EXPORT_BACKUP_MAX_RESTARTS:
+        logging.info(f"Database backup restarted {restarts} times by concurrent writes, copied the rest in one step")
+    return export_path
+
+def iter_export_file(export_path, compress=False):
+    """Yields an export file in chunks, gzip-compressed if requested, and deletes it afterwards."""
+    try:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if compress else None # gzip container
+        with open(export_path, "rb") as f:
+            while True:
+                chunk = f.read(EXPORT_CHUNK_BYTES)
+                if not chunk:
+                    break
+                chunk = compressor.compress(chunk) if compressor else chunk
+                if chunk:
+                    yield chunk
+        if compressor:
+            yield compressor.flush()
+    finally:
+        if os.path.exists(export_path):
+            os.remove(export_path)
+
+UPLOAD_MAX_AGE_SECONDS = 24 * 3600 # Unfinished uploads are kept this long for resuming
+_upload_lock = threading.Lock()
+
+def _upload_paths(upload_id):
+    """upload_id must already be sanitized with secure_filename."""
+    base = os.path.join(config.DATA_DIR, f"upload_{upload_id}")
+    return base + ".part", base + ".json"
+
+def _read_upload_manifest(manifest_path):
+    try:
+        with open(manifest_path) as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+def _write_upload_manifest(manifest_path, manifest):
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path)
+
+def cleanup_stale_uploads():
+    """Removes .part files and manifests of uploads nobody has touched for UPLOAD_MAX_AGE_SECONDS."""
+    cutoff = time.time() - UPLOAD_MAX_AGE_SECONDS
+    for name in os.listdir(config.DATA_DIR):
+        if not name.startswith("upload_"):
+            continue
+        path = os.path.join(config.DATA_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                logging.info(f"Removed abandoned upload file: {path}")
+        except OSError as e:
+            logging.error(f"Could not remove abandoned upload file {path}: {e}")
+
+def get_upload_status(upload_id):
+    """Returns the manifest of an unfinished upload ({total_size, chunk_size, total_chunks, chunks}) or None."""
+    return _read_upload_manifest(_upload_paths(upload_id)[1])
+
+def write_upload_chunk(upload_id, index, data, total_size, chunk_size, checksum=None):
+    """
+    Writes one chunk of an upload at its offset, so chunks can arrive in any
+    order and in parallel, and records its SHA-256 in the upload's manifest.
+    Raises ValueError if the chunk doesn't fit the upload or fails its checksum.
+    """
+    if total_size <= 0 or chunk_size <= 0:
+        raise ValueError("Invalid upload size.")
+    total_chunks = (total_size + chunk_size - 1) // chunk_size
+    if not 0 <= index < total_chunks:
+        raise ValueError(f"Chunk index {index} is out of range.")
+    offset = index * chunk_size
+    if len(data) != min(chunk_size, total_size - offset):
+        raise ValueError(f"Chunk {index} has the wrong size.")
+    digest = hashlib.sha256(data).hexdigest()
+    if checksum and checksum.lower() != digest:
+        raise ValueError(f"Checksum mismatch for chunk {index}.")
+
+    part_path, manifest_path = _upload_paths(upload_id)
+    with _upload_lock:
+        manifest = _read_upload_manifest(manifest_path)
+        if manifest is None:
+            cleanup_stale_uploads()
+            manifest = {"total_size": total_size, "chunk_size": chunk_size, "total_chunks": total_chunks, "chunks": {}}
+            _write_upload_manifest(manifest_path, manifest)
+        elif manifest["total_size"] != total_size or manifest["chunk_size"] != chunk_size:
+            raise ValueError("Chunk does not match the upload it belongs to.")
+
+    fd = os.open(part_path, os.O_WRONLY | os.O_CREAT, 0o600)
+    try:
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(fd, view, offset)
+            view = view[written:]
+            offset += written
+    finally:
+        os.close(fd)
+
+    with _upload_lock:
+        # Re-read, other chunks may have been recorded while this one was written.
+        manifest = _read_upload_manifest(manifest_path) or manifest
+        manifest["chunks"][str(index)] = digest
+        _write_upload_manifest(manifest_path, manifest)
+
+def verify_upload(upload_id, file_hash=None):
+    """
+    Checks a finished upload against its manifest by re-reading it from disk.
+    file_hash is the SHA-256 of the concatenated hex chunk checksums, which the
+    browser can compute without hashing the whole file at once.
+    Returns (part_path, missing) where missing lists chunks that were never
+    received or whose data doesn't match their checksum; those are dropped from
+    the manifest so they can be sent again. Raises ValueError if the upload is
+    unknown or the file hash doesn't match.
+    """
+    part_path, manifest_path = _upload_paths(upload_id)
+    with _upload_lock:
+        manifest = _read_upload_manifest(manifest_path)
+    if manifest is None or not os.path.exists(part_path):
+        raise ValueError("Uploaded file not found. It may have expired or failed.")
+
+    chunk_size = manifest["chunk_size"]
+    missing = []
+    combined = hashlib.sha256()
+    with open(part_path, "rb") as f:
+        for index in range(manifest["total_chunks"]):
+            expected = manifest["chunks"].get(str(index))
+            f.seek(index * chunk_size)
+            block = f.read(min(chunk_size, manifest["total_size"] - index * chunk_size))
+            if expected is None or hashlib.sha256(block).hexdigest() != expected:
+                missing.append(index)
+                continue
+            combined.update(expected.encode("ascii"))
+
+    if missing:
+        with _upload_lock:
+            manifest = _read_upload_manifest(manifest_path) or manifest
+            for index in missing:
+                manifest["chunks"].pop(str(index), None)
+            _write_upload_manifest(manifest_path, manifest)
+        return part_path, missing
+
+    if file_hash and file_hash.lower() != combined.hexdigest():
+        raise ValueError("File checksum mismatch.")
+    if os.path.getsize(part_path) > manifest["total_size"]:
+        os.truncate(part_path, manifest["total_size"])
+    os.remove(manifest_path)
+    return part_path, []
+
 # --- END OF FILE services.py ---
@@ -85,6 +85,7 @@ document.addEventListener('DOMContentLoaded', () => {
                                 <strong>Import Complete!</strong><br>
                                 New Hourly Weather records: ${stats.hourly_weather}<br>
                                 New Hourly Snapshots: ${stats.hourly_snapshot}<br>
+                                ${stats.rows_per_second ? `Imported at ${stats.rows_per_second.toLocaleString()} rows/s<br>` : ''}
                                 The page will now reload to reflect the new data.
                             </div>`;
                     }
@@ -116,6 +117,18 @@ document.addEventListener('DOMContentLoaded', () => {
         }, 2000); // Poll every 2 seconds
     }
 
+    function toHex(buffer) {
+        return Array.from(new Uint8Array(buffer)).map(b => b.toString(16).padStart(2, '0')).join('');
+    }
+
+    async function uploadIdForFile(file) {
+        const key = `${file.name}:${file.size}:${file.lastModified}`;
+        if (window.crypto && crypto.subtle) {
+            return toHex(await crypto.subtle.digest('SHA-256', new TextEncoder().encode(key))).slice(0, 32);
+        }
+        return key.replace(/[^A-Za-z0-9]/g, '_').slice(-100);
+    }
+
     if (importForm) {
         importForm.addEventListener('submit', async (e) => {
             e.preventDefault();
@@ -127,8 +140,11 @@ document.addEventListener('DOMContentLoaded', () => {
 
             const file = dbFileInput.files[0];
             const CHUNK_SIZE = 5 * 1024 * 1024; // 5MB
-            const totalChunks = Math.ceil(file.size / CHUNK_SIZE);
-            const uploadId = crypto.randomUUID();
+            const PARALLEL_UPLOADS = 4;
+            const MAX_ATTEMPTS = 3;
+            const totalChunks = Math.max(1, Math.ceil(file.size / CHUNK_SIZE));
+            // Checksums need SubtleCrypto, which browsers only offer on HTTPS or localhost.
+            const canHash = !!(window.crypto && crypto.subtle);
 
             // Reset UI for new upload
             resetImportModal();
@@ -139,48 +155,95 @@ document.addEventListener('DOMContentLoaded', () => {
             importStatusEl.innerHTML = `<div class="alert alert-info">Starting upload...</div>`;
 
             try {
-                // The previous implementation pre-sliced all chunks, which could lead to high memory usage for large files.
-                // This version slices each chunk just-in-time. This is more memory efficient, but can be susceptible
-                // to `net::ERR_UPLOAD_FILE_CHANGED` if the source file is modified during the upload. Given the error persists,
-                // we are trying this more memory-friendly approach.
-                for (let i = 0; i < totalChunks; i++) {
-                    const start = i * CHUNK_SIZE;
-                    const end = Math.min(start + CHUNK_SIZE, file.size);
-                    const chunk = file.slice(start, end);
-
-                    const formData = new FormData();
-                    formData.append('file', chunk, file.name);
-                    formData.append('upload_id', uploadId);
-                    
-                    const percentComplete = Math.round(((i + 1) / totalChunks) * 100);
-                    importStatusEl.innerHTML = `<div class="alert alert-info">Uploading chunk ${i + 1} of ${totalChunks}...</div>`;
-
-                    const response = await fetch('/api/upload-chunk', {
-                        method: 'POST',
-                        body: formData,
-                    });
+                // The same file always gets the same upload ID, so selecting it again resumes an interrupted upload.
+                const uploadId = await uploadIdForFile(file);
+                const statusResponse = await fetch(`/api/upload-status/${uploadId}`);
+                const uploadStatus = statusResponse.ok ? await statusResponse.json() : { received: [] };
+                const received = new Set(uploadStatus.chunk_size === CHUNK_SIZE ? uploadStatus.received : []);
+                const checksums = new Array(totalChunks).fill(null);
 
-                    if (!response.ok) {
-                        const errorData = await response.json().catch(() => ({ error: 'Unknown upload error.' }));
-                        throw new Error(`Chunk upload failed: ${errorData.error}`);
-                    }
-                    
+                const setUploadProgress = () => {
+                    const percentComplete = Math.round((received.size / totalChunks) * 100);
+                    importStatusEl.innerHTML = `<div class="alert alert-info">Uploaded ${received.size} of ${totalChunks} chunks...</div>`;
                     importProgressBar.style.width = percentComplete + '%';
                     importProgressBar.textContent = percentComplete + '%';
                     importProgressBar.setAttribute('aria-valuenow', percentComplete);
-                }
+                };
+
+                const chunkChecksum = async (index) => {
+                    if (!canHash) return null;
+                    if (!checksums[index]) {
+                        const start = index * CHUNK_SIZE;
+                        const buffer = await file.slice(start, Math.min(start + CHUNK_SIZE, file.size)).arrayBuffer();
+                        checksums[index] = toHex(await crypto.subtle.digest('SHA-256', buffer));
+                    }
+                    return checksums[index];
+                };
+
+                const uploadChunk = async (index) => {
+                    const start = index * CHUNK_SIZE;
+                    const chunk = file.slice(start, Math.min(start + CHUNK_SIZE, file.size));
+                    const checksum = await chunkChecksum(index);
+                    for (let attempt = 1; ; attempt++) {
+                        const formData = new FormData();
+                        formData.append('file', chunk, file.name);
+                        formData.append('upload_id', uploadId);
+                        formData.append('chunk_index', index);
+                        formData.append('chunk_size', CHUNK_SIZE);
+                        formData.append('total_size', file.size);
+                        if (checksum) formData.append('checksum', checksum);
+                        try {
+                            const response = await fetch('/api/upload-chunk', { method: 'POST', body: formData });
+                            if (response.ok) break;
+                            const errorData = await response.json().catch(() => ({ error: 'Unknown upload error.' }));
+                            if (attempt >= MAX_ATTEMPTS) throw new Error(`Chunk upload failed: ${errorData.error}`);
+                        } catch (error) {
+                            if (attempt >= MAX_ATTEMPTS) throw error;
+                        }
+                        await new Promise(resolve => setTimeout(resolve, 1000 * attempt));
+                    }
+                    received.add(index);
+                    setUploadProgress();
+                };
 
-                // All chunks uploaded, now assemble the file on the server
-                importStatusEl.innerHTML = `<div class="alert alert-info">File upload complete. Assembling file on server...</div>`;
+                // A few chunks are in flight at once; the server writes each one at its own offset.
+                const uploadChunks = async (indexes) => {
+                    const queue = [...indexes];
+                    const worker = async () => {
+                        while (queue.length > 0) {
+                            await uploadChunk(queue.shift());
+                        }
+                    };
+                    await Promise.all(Array.from({ length: Math.min(PARALLEL_UPLOADS, queue.length) }, worker));
+                };
 
-                const assembleResponse = await fetch('/api/assemble-file', {
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({
-                        upload_id: uploadId,
-                        filename: file.name,
-                    }),
-                });
+                setUploadProgress();
+                await uploadChunks([...Array(totalChunks).keys()].filter(index => !received.has(index)));
+
+                // All chunks uploaded, now have the server verify and assemble the file.
+                // Chunks it reports as missing or corrupt are sent again once.
+                let assembleResponse;
+                for (let attempt = 1; ; attempt++) {
+                    importStatusEl.innerHTML = `<div class="alert alert-info">File upload complete. Verifying file on server...</div>`;
+                    let fileHash = null;
+                    if (canHash) {
+                        for (let index = 0; index < totalChunks; index++) await chunkChecksum(index);
+                        fileHash = toHex(await crypto.subtle.digest('SHA-256', new TextEncoder().encode(checksums.join(''))));
+                    }
+                    assembleResponse = await fetch('/api/assemble-file', {
+                        method: 'POST',
+                        headers: { 'Content-Type': 'application/json' },
+                        body: JSON.stringify({
+                            upload_id: uploadId,
+                            filename: file.name,
+                            file_hash: fileHash,
+                        }),
+                    });
+                    if (assembleResponse.status !== 409 || attempt > 1) break;
+                    const { missing } = await assembleResponse.json();
+                    missing.forEach(index => received.delete(index));
+                    await uploadChunks(missing);
+                }
 
                 if (!assembleResponse.ok) {
                     const errorData = await assembleResponse.json().catch(() => ({ error: 'Unknown assembly error.' }));
@@ -197,7 +260,7 @@ document.addEventListener('DOMContentLoaded', () => {
             } catch (error) {
                 let errorMessage = error.message;
                 if (error instanceof TypeError && error.message.includes('Failed to fetch')) {
-                    errorMessage = "A network error occurred during upload. This can be caused by the source file being changed or moved during the upload process. Please try again.";
+                    errorMessage = "A network error occurred during upload. This can be caused by the source file being changed or moved during the upload process. Select the same file again to resume the upload.";
                 }
                 importStatusEl.innerHTML = `<div class="alert alert-danger"><strong>Upload Error:</strong> ${errorMessage}</div>`;
                 importProgressBar.classList.add('bg-danger');
@@ -213,6 +276,25 @@ document.addEventListener('DOMContentLoaded', () => {
         });
     }
 
+    // --- Database Compaction ---
+    const vacuumBtn = document.getElementById('vacuum-db-btn');
+    if (vacuumBtn) {
+        vacuumBtn.addEventListener('click', async () => {
+            if (!confirm('Compact the weather database now? The refresh job and imports wait until it finishes, which can take several minutes on a large database, and the dashboards and live updates stall while the refresh job waits.')) return;
+            vacuumBtn.disabled = true;
+            try {
+                const response = await fetch('/api/admin/db/vacuum', { method: 'POST' });
+                const result = await response.json();
+                if (!response.ok) throw new Error(result.error || `HTTP error! status: ${response.status}`);
+                fetchTaskStatus();
+            } catch (error) {
+                alert(`Could not start compaction: ${error.message}`);
+            } finally {
+                vacuumBtn.disabled = false;
+            }
+        });
+    }
+
     // --- System Status Polling ---
     const systemStatusContainer = document.getElementById('system-status-container');
 
@@ -240,7 +322,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
         let html = '<dl class="row">';
         for (const [taskName, task] of Object.entries(tasks)) {
-            const statusClass = task.status === 'running' ? 'text-success' : 'text-danger';
+            const statusClass = task.status === 'error' ? 'text-danger' : 'text-success';
             const lastSuccess = task.last_success ? new Date(task.last_success).toLocaleString() : 'Never';
             
             html += `
@@ -251,6 +333,45 @@ document.addEventListener('DOMContentLoaded', () => {
                     <p class="mb-1"><strong>Last Runtime:</strong> ${task.last_runtime || 'N/A'}</p>
             `;
 
+            if ('data_age_seconds' in task) {
+                const age = task.data_age_seconds === null ? 'No data' : `${Math.round(task.data_age_seconds / 60)} min`;
+                html += `<p class="mb-1"><strong>Data Age:</strong> ${age}</p>`;
+            }
+
+            if (task.hub_latency && Object.keys(task.hub_latency).length > 0) {
+                const slowest = Object.entries(task.hub_latency)
+                    .sort((a, b) => b[1] - a[1])
+                    .slice(0, 5)
+                    .map(([iata, seconds]) => `${iata} ${seconds.toFixed(2)}s`)
+                    .join(', ');
+                html += `<p class="mb-1"><strong>Slowest Hubs:</strong> ${slowest} (${task.max_workers} workers)</p>`;
+            }
+
+            if (task.http_connections && Object.keys(task.http_connections).length > 0) {
+                const hosts = Object.entries(task.http_connections)
+                    .map(([host, s]) => `${host}: ${s.requests} requests, ${s.connections} connections (${s.reused} reused)`)
+                    .join('<br>');
+                html += `<p class="mb-1"><strong>HTTP Connections:</strong><br><small>${hosts}</small></p>`;
+            }
+
+            if (task.snapshot_dedup && task.snapshot_dedup.rows_scanned > 0) {
+                const d = task.snapshot_dedup;
+                html += `<p class="mb-1"><strong>Snapshot Deduplication:</strong> ${d.rows_scanned} rows checked, ${(d.saved_bytes / (1024 * 1024)).toFixed(1)} MB saved</p>`;
+            }
+
+            if (task.retention && task.retention.days_rolled_up > 0) {
+                const r = task.retention;
+                html += `<p class="mb-1"><strong>Snapshot Retention:</strong> ${r.days_rolled_up} hub-days older than ${r.days} days archived (${r.snapshots_removed} snapshots, ${r.blobs_removed} blobs removed, ${r.pages_reclaimed} pages reclaimed)</p>`;
+            }
+
+            if (task.pages_reclaimed !== undefined) {
+                html += `<p class="mb-1"><strong>Pages Reclaimed:</strong> ${task.pages_reclaimed}</p>`;
+            }
+
+            if (task.http_cache) {
+                html += `<p class="mb-1"><strong>Forecast Cache:</strong> ${task.http_cache.fresh} fresh, ${task.http_cache.revalidated} revalidated (304), ${task.http_cache.downloaded} downloaded</p>`;
+            }
+
             if (task.last_error) {
                 html += `
                     <p class="mb-1"><strong>Last Error:</strong></p>
@@ -263,9 +384,20 @@ document.addEventListener('DOMContentLoaded', () => {
         systemStatusContainer.innerHTML = html;
     }
 
-    // Initial fetch and then poll every 5 seconds
+    // Initial fetch, then refetch whenever the server reports a finished task run (admin room).
+    // Polling remains as a fallback, less often when the socket is connected.
     if (systemStatusContainer) {
         fetchTaskStatus();
-        setInterval(fetchTaskStatus, 5000);
+        let socket = null;
+        if (typeof io !== 'undefined') {
+            socket = io();
+            socket.on('task_status_changed', fetchTaskStatus);
+        }
+        setInterval(() => {
+            if (!socket || !socket.connected) fetchTaskStatus();
+        }, 5000);
+        setInterval(() => {
+            if (socket && socket.connected) fetchTaskStatus();
+        }, 60000);
     }
 });
@@ -24,6 +24,21 @@ async function fetchWeather(iata) {
   return await res.json();
 }
 
+async function fetchWeatherBatch(iatas) {
+  let url = '/api/weather?iatas=' + encodeURIComponent(iatas.join(','));
+  let dateMatch = window.location.search.match(/[?&]date=([0-9]{4}-[0-9]{2}-[0-9]{2})/);
+  if (dateMatch) {
+    url += '&date=' + dateMatch[1];
+  }
+  let res = await fetch(url);
+  if (!res.ok) {
+    throw new Error(`Weather request failed with status ${res.status}`);
+  }
+  // {epoch, versions: {iata: n}} of the returned data, compared against dashboard_update messages.
+  const versionsHeader = res.headers.get('X-Hub-Versions');
+  return { weather: await res.json(), versions: versionsHeader ? JSON.parse(versionsHeader) : null };
+}
+
 async function fetchSnapshots(iata, date) {
     let url = `/api/hourly-snapshots/${iata}/${date}`;
     let res = await fetch(url);
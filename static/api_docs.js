@@ -55,6 +55,15 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     });
 
+    document.getElementById('fetch-risk')?.addEventListener('click', () => {
+        const today = new Date().toISOString().slice(0, 10);
+        fetchData(`/api/risk/CLT/${today}`, 'risk-preview');
+    });
+
+    document.getElementById('fetch-calendar')?.addEventListener('click', () => {
+        fetchData(`/api/calendar/${new Date().toISOString().slice(0, 7)}`, 'calendar-preview');
+    });
+
     document.getElementById('fetch-groundstops')?.addEventListener('click', () => {
         fetchData('/api/groundstops', 'groundstops-preview');
     });
@@ -5,27 +5,59 @@ document.addEventListener('DOMContentLoaded', () => {
     const nextMonthBtn = document.getElementById('next-month');
 
     let currentDate = new Date();
-    let archiveDates = [];
+    const monthCache = {}; // "YYYY-MM" -> {days: {date: {iata: summary}}, pending: 0}
+    const PENDING_RETRY_MS = 15000;
+    let retryTimer = null;
 
-    async function fetchArchiveDates() {
-        try {
-            const response = await fetch('/api/archive-dates');
-            if (!response.ok) throw new Error('Failed to fetch archive dates');
-            archiveDates = await response.json();
-        } catch (error) {
-            console.error(error);
-            calendarDaysEl.innerHTML = '<div class="text-center text-danger p-4">Could not load archive data.</div>';
-        }
+    async function fetchMonth(monthStr) {
+        if (monthCache[monthStr]) return monthCache[monthStr];
+        const response = await fetch(`/api/calendar/${monthStr}`);
+        if (!response.ok) throw new Error('Failed to fetch calendar data');
+        const data = await response.json();
+        // Months with days the server hasn't scored yet are fetched again until complete
+        if (!data.pending) monthCache[monthStr] = data;
+        return data;
     }
 
-    function renderCalendar() {
-        calendarDaysEl.innerHTML = '<div class="text-center p-5"><div class="spinner-border text-primary" role="status"><span class="visually-hidden">Loading...</span></div></div>';
+    function hubBadge(iata, summary) {
+        const badge = document.createElement('div');
+        badge.classList.add('calendar-hub', summary.risk_class);
+        let text = iata;
+        if (summary.ground_stop_hours) text += ` GS ${summary.ground_stop_hours}h`;
+        if (summary.ground_delay_hours) text += ` GD ${summary.ground_delay_hours}h`;
+        badge.textContent = text;
+        badge.title = `${iata}: ${summary.risk_summary} (${summary.percent_high}% high, ${summary.percent_partial}% partial)`
+            + `, ground stop ${summary.ground_stop_hours}h, ground delay ${summary.ground_delay_hours}h`;
+        return badge;
+    }
+
+    async function renderCalendar(quiet = false) {
+        clearTimeout(retryTimer);
+        if (!quiet) {
+            calendarDaysEl.innerHTML = '<div class="text-center p-5"><div class="spinner-border text-primary" role="status"><span class="visually-hidden">Loading...</span></div></div>';
+        }
         
         const year = currentDate.getFullYear();
         const month = currentDate.getMonth();
 
         monthYearEl.textContent = `${currentDate.toLocaleString('default', { month: 'long' })} ${year}`;
 
+        let days, pending;
+        try {
+            ({ days, pending } = await fetchMonth(`${year}-${String(month + 1).padStart(2, '0')}`));
+        } catch (error) {
+            console.error(error);
+            calendarDaysEl.innerHTML = '<div class="text-center text-danger p-4">Could not load archive data.</div>';
+            return;
+        }
+        // A newer render started while this month was loading
+        if (year !== currentDate.getFullYear() || month !== currentDate.getMonth()) return;
+
+        if (pending) {
+            monthYearEl.textContent += ` (summarizing ${pending} more hub-days…)`;
+            retryTimer = setTimeout(() => renderCalendar(true), PENDING_RETRY_MS);
+        }
+
         const firstDayOfMonth = new Date(year, month, 1).getDay();
         const daysInMonth = new Date(year, month + 1, 0).getDate();
 
@@ -50,12 +82,15 @@ document.addEventListener('DOMContentLoaded', () => {
             dayCell.appendChild(dayNumber);
 
             const dateStr = `${year}-${String(month + 1).padStart(2, '0')}-${String(i).padStart(2, '0')}`;
-            if (archiveDates.includes(dateStr)) {
+            if (days[dateStr]) {
                 dayCell.classList.add('has-data');
                 dayCell.title = `View archived data for ${dateStr}`;
                 dayCell.addEventListener('click', () => {
                     window.location.href = `/?date=${dateStr}`;
                 });
+                for (const [iata, summary] of Object.entries(days[dateStr])) {
+                    dayCell.appendChild(hubBadge(iata, summary));
+                }
             }
             
             calendarDaysEl.appendChild(dayCell);
@@ -72,10 +107,5 @@ document.addEventListener('DOMContentLoaded', () => {
         renderCalendar();
     });
 
-    async function init() {
-        await fetchArchiveDates();
-        renderCalendar();
-    }
-
-    init();
+    renderCalendar();
 });
@@ -130,6 +130,9 @@ let dayLabels = [];
 let dailyBrief = [{}, {}, {}];
 let fullDailyBrief = [{}, {}, {}];
 let sortable = null; // To hold the Sortable instance
+let latestWeather = {}; // Live weather per hub, kept so updates only refetch the hubs that changed
+let weatherEpoch = null;
+let weatherVersions = {};
 
 function renderFinalDashboard(localDayLabels, localDailyBrief, isUpdate) {
     dayLabels = localDayLabels;
@@ -171,7 +174,52 @@ function renderFinalDashboard(localDayLabels, localDailyBrief, isUpdate) {
     }
 }
 
-async function loadDashboard(isUpdate = false) {
+// Updates arrive as one message per hub; they are coalesced into a single refetch.
+let pendingUpdate = null;
+
+function queueDashboardUpdate(data) {
+  if (!pendingUpdate) {
+    pendingUpdate = { full: false, advisories: false, iatas: new Set() };
+    setTimeout(applyDashboardUpdate, 250);
+  }
+  if (data.advisories) {
+    pendingUpdate.advisories = true;
+  }
+  // Refetch only hubs whose version differs from ours. This also catches up on missed
+  // messages; a new epoch (server restart or import) means everything is refetched.
+  if (data.epoch !== weatherEpoch) {
+    pendingUpdate.full = true;
+  } else {
+    for (const [iata, version] of Object.entries(data.versions || {})) {
+      if (allHubsMap.has(iata) && version !== (weatherVersions[iata] || 0)) {
+        pendingUpdate.iatas.add(iata);
+      }
+    }
+  }
+}
+
+async function applyDashboardUpdate() {
+  const update = pendingUpdate;
+  pendingUpdate = null;
+  if (!update.full && !update.advisories && update.iatas.size === 0) return;
+  if (update.advisories) {
+    await updateAdvisories();
+  }
+  await loadDashboard(true, update.full ? null : Array.from(update.iatas));
+  await fetchDbStatus();
+}
+
+let dashboardSocket = null;
+
+function subscribeToHubUpdates() {
+  // Only the displayed hubs' updates are sent to this client.
+  if (!dashboardSocket || !dashboardSocket.connected) return;
+  dashboardSocket.emit('subscribe_hubs', { iatas: HUBS.map(h => h.iata) }, (versions) => {
+    if (versions) queueDashboardUpdate(versions);
+  });
+}
+
+async function loadDashboard(isUpdate = false, iatasToRefresh = null) {
   const dashboard = document.getElementById('dashboard');
   if (!isUpdate) {
     dashboard.innerHTML = `<div class="text-center p-5 fs-4"><div class="spinner-border text-primary mb-3" role="status"></div><div>Loading weather data for all bases...</div></div>`;
@@ -188,6 +236,27 @@ async function loadDashboard(isUpdate = false) {
 
   const hubsToFetch = Array.from(allHubsMap.values());
 
+  // Live weather for every hub (or only the ones that changed) comes back in a single request.
+  const iatasToFetch = iatasToRefresh || hubsToFetch.map(hub => hub.iata);
+  if (!isArchive && iatasToFetch.length > 0) {
+    try {
+      const { weather, versions } = await fetchWeatherBatch(iatasToFetch);
+      if (!iatasToRefresh) {
+        latestWeather = {};
+      }
+      Object.assign(latestWeather, weather);
+      if (versions) {
+        if (versions.epoch !== weatherEpoch) {
+          weatherEpoch = versions.epoch;
+          weatherVersions = {};
+        }
+        Object.assign(weatherVersions, versions.versions);
+      }
+    } catch (err) {
+      console.error('Failed to load weather data:', err);
+    }
+  }
+
   for (const hub of hubsToFetch) {
     try {
       let wx;
@@ -221,7 +290,10 @@ async function loadDashboard(isUpdate = false) {
         }
         wx = { hourly: periods.filter(x => x), daily: [], timezone, sirs, terminal_constraints, faa_events, alerts };
       } else {
-        wx = await fetchWeather(hub.iata);
+        wx = latestWeather[hub.iata];
+        if (!wx) {
+          throw new Error('No weather data returned');
+        }
       }
       
       window.LATEST_SIRS = wx.sirs || [];
@@ -538,11 +610,12 @@ document.addEventListener('DOMContentLoaded', async () => {
 
     if (typeof io !== "undefined") {
       const socket = io();
-      socket.on('dashboard_update', async function(data) {
-        console.log('Dashboard update received via websocket.');
-        await updateAdvisories();
-        await loadDashboard(true);
-        await fetchDbStatus();
+      dashboardSocket = socket;
+      // (Re)joining the hub rooms on every connect also resyncs after a disconnect.
+      socket.on('connect', subscribeToHubUpdates);
+      socket.on('dashboard_update', function(data) {
+        console.log('Dashboard update received via websocket.', data.changed || {});
+        queueDashboardUpdate(data);
       });
 
       socket.on('hub_order_update', async function(data) {
@@ -555,6 +628,7 @@ document.addEventListener('DOMContentLoaded', async () => {
           }
           // Re-initialize hubs based on the new order
           await initializeHubs();
+          subscribeToHubUpdates();
           
           // Re-render the dashboard. This will use the new HUBS list to filter
           // the full data and briefing.
@@ -5,12 +5,23 @@ import time
 import json
 import traceback
 import logging
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
 
 import services
 import config
+import http_client
+import metrics
 from database import db, HourlySnapshot, Hub
 
+# Socket.IO rooms. Dashboards join DASHBOARD_ROOM and one room per hub they display
+# (see handle_subscribe_hubs in app.py); logged in users also join ADMIN_ROOM.
+DASHBOARD_ROOM = 'dashboard'
+ADMIN_ROOM = 'admin'
+
+def hub_room(iata):
+    return f'hub:{iata}'
+
 def periodic_ops_plan_refresh(app):
     task_name = 'ops_plan_refresh'
     with app.app_context():
@@ -20,25 +31,88 @@ def periodic_ops_plan_refresh(app):
         start_time = time.time()
         try:
             with app.app_context():
-                services.get_latest_ops_plan_json()
-                app.TASK_STATUS[task_name]['last_success'] = datetime.utcnow().isoformat() + 'Z'
-                app.TASK_STATUS[task_name]['status'] = 'running'
-                app.TASK_STATUS[task_name]['last_error'] = None
+                if services.refresh_ops_plan():
+                    app.TASK_STATUS[task_name]['last_success'] = datetime.utcnow().isoformat() + 'Z'
+                    app.TASK_STATUS[task_name]['status'] = 'running'
+                    app.TASK_STATUS[task_name]['last_error'] = None
+                    metrics.TASK_CYCLES.inc(task_name, 'success')
+                else:
+                    metrics.TASK_CYCLES.inc(task_name, 'error')
+                    # The last good ops plan keeps being served; report how old it is.
+                    app.TASK_STATUS[task_name]['status'] = 'error'
+                    app.TASK_STATUS[task_name]['last_error'] = config.FAA_OPS_PLAN_URL_CACHE.get("last_error")
         except Exception as e:
             error_str = traceback.format_exc()
             logging.error(f"Error in periodic_ops_plan_refresh: {e}\n{error_str}")
+            metrics.TASK_CYCLES.inc(task_name, 'error')
             with app.app_context():
                 app.TASK_STATUS[task_name]['status'] = 'error'
                 app.TASK_STATUS[task_name]['last_error'] = error_str
         finally:
+            elapsed = time.time() - start_time
+            metrics.TASK_CYCLE_SECONDS.observe(elapsed, task_name)
             with app.app_context():
-                app.TASK_STATUS[task_name]['last_runtime'] = f"{time.time() - start_time:.2f}s"
+                app.TASK_STATUS[task_name]['last_runtime'] = f"{elapsed:.2f}s"
             time.sleep(600)
 
+def _collect_hub(app, hub_info, ground_stops, ground_delays, hub_latency):
+    """Runs in a refresh worker thread. Only performs network calls and database reads."""
+    start_time = time.time()
+    try:
+        with app.app_context():
+            return services.collect_hub_snapshot(hub_info, ground_stops, ground_delays)
+    finally:
+        elapsed = time.time() - start_time
+        hub_latency[hub_info['iata']] = round(elapsed, 2)
+        metrics.HUB_SNAPSHOT_SECONDS.observe(elapsed, hub_info['iata'])
+
+def _load_grid(app, iata):
+    with app.app_context():
+        return services.load_nws_grid(iata)
+
+def warm_nws_grids(app, executor):
+    """
+    Loads every hub's NWS grid into memory before the first refresh cycle.
+    Lookups missing from (or outdated in) the airports database are fetched in
+    parallel and then stored from this thread.
+    """
+    start_time = time.time()
+    with app.app_context():
+        iatas = [hub.iata for hub in Hub.query.all()]
+        futures = {executor.submit(_load_grid, app, iata): iata for iata in iatas}
+        fetched = 0
+        for future in as_completed(futures):
+            iata = futures[future]
+            try:
+                grid, is_new = future.result()
+                if is_new:
+                    services.store_nws_grid(iata, grid)
+                    fetched += 1
+            except Exception as e:
+                logging.error(f"Error warming NWS grid for {iata}: {e}")
+        db.session.commit()
+    logging.info(f"NWS grid cache warmed for {len(iatas)} hubs ({fetched} fetched) in {time.time() - start_time:.2f}s")
+
 def data_refresh_job(app, socketio):
     task_name = 'data_refresh'
+    max_workers = max(1, config.REFRESH_MAX_WORKERS)
     with app.app_context():
-        app.TASK_STATUS[task_name] = {'status': 'running', 'last_success': None, 'last_error': None, 'last_runtime': None}
+        app.TASK_STATUS[task_name] = {
+            'status': 'running', 'last_success': None, 'last_error': None, 'last_runtime': None,
+            'last_cycle_seconds': None, 'hub_latency': {}, 'max_workers': max_workers,
+            'snapshot_dedup': {'rows_scanned': 0, 'bytes_before': 0, 'bytes_after': 0, 'saved_bytes': 0},
+            'compression': {'enabled': config.COMPRESS_JSON_COLUMNS, 'rows_recompressed': 0},
+            'retention': {'days': config.SNAPSHOT_RETENTION_DAYS, 'days_rolled_up': 0, 'snapshots_removed': 0, 'blobs_removed': 0, 'pages_reclaimed': 0}
+        }
+    blob_migration_cursor = 0
+    compression_cursors = {}
+    blob_sweep_pending = True # Also sweeps blobs orphaned before a restart
+
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='hub_refresh')
+    try:
+        warm_nws_grids(app, executor)
+    except Exception as e:
+        logging.error(f"Error warming NWS grid cache: {e}")
 
     while True:
         start_time = time.time()
@@ -47,17 +121,27 @@ def data_refresh_job(app, socketio):
                 now = datetime.now()
                 
                 # --- Fetch all external data ---
-                new_ground_stops = services.fetch_faa_ground_stops()
-                new_ground_delays = services.fetch_faa_ground_delays()
+                airport_status = services.fetch_faa_airport_status()
+                new_ground_stops = airport_status["ground_stops"]
+                new_ground_delays = airport_status["ground_delays"]
 
-                data_changed_snapshot = False
-                all_hubs = Hub.query.all()
-                for hub in all_hubs:
+                # Hubs are fetched in parallel by the worker pool, but every database
+                # write happens here, on this thread, so SQLite only sees one writer.
+                changed_hubs = {}
+                hub_latency = {}
+                all_hubs = [hub.as_dict() for hub in Hub.query.all()]
+                futures = {
+                    executor.submit(_collect_hub, app, hub_info, new_ground_stops, new_ground_delays, hub_latency): hub_info['iata']
+                    for hub_info in all_hubs
+                }
+                for future in as_completed(futures):
+                    iata = futures[future]
                     try:
-                        if services.snapshot_hub_data(hub, new_ground_stops, new_ground_delays):
-                            data_changed_snapshot = True
+                        changed_sections = services.save_hub_snapshot(future.result())
+                        if changed_sections:
+                            changed_hubs[iata] = changed_sections
                     except Exception as e:
-                        logging.error(f"Error snapshotting data for {hub.iata}: {e}")
+                        logging.error(f"Error snapshotting data for {iata}: {e}")
                         db.session.rollback()
 
                 # --- Check for changes in advisories and update caches ---
@@ -72,23 +156,118 @@ def data_refresh_job(app, socketio):
                     config.GROUND_DELAYS_CACHE["time"] = now
                     data_changed_advisory = True
 
-                if data_changed_snapshot or data_changed_advisory:
-                    logging.info("Data changed, emitting dashboard_update")
-                    socketio.emit('dashboard_update', {'msg': 'updated'})
-                
+                if changed_hubs or data_changed_advisory:
+                    # Each hub's update only goes to the clients displaying it. Clients refetch
+                    # the hubs whose version differs from the one they have.
+                    logging.info(f"Data changed for {sorted(changed_hubs) or 'advisories'}, emitting dashboard_update")
+                    for iata, changed_sections in changed_hubs.items():
+                        socketio.emit('dashboard_update', {
+                            'msg': 'updated',
+                            'changed': {iata: changed_sections},
+                            'advisories': False,
+                            **services.get_hub_versions([iata])
+                        }, to=hub_room(iata))
+                    if data_changed_advisory:
+                        socketio.emit('dashboard_update', {
+                            'msg': 'updated',
+                            'changed': {},
+                            'advisories': True,
+                            **services.get_hub_versions([])
+                        }, to=DASHBOARD_ROOM)
+
+                # --- Background maintenance ---
+                # Runs after clients have been notified. Each pass logs its own errors, so a
+                # failing one neither marks the cycle as failed nor stops the passes after it.
+
+                # Convert a batch of snapshots written before section deduplication.
+                blob_report = None
+                try:
+                    blob_report = services.migrate_snapshot_blobs(blob_migration_cursor)
+                    blob_migration_cursor = blob_report['last_id']
+                    if blob_report['rows']:
+                        dedup = app.TASK_STATUS[task_name]['snapshot_dedup']
+                        dedup['rows_scanned'] += blob_report['rows']
+                        dedup['bytes_before'] += blob_report['bytes_before']
+                        dedup['bytes_after'] += blob_report['bytes_after']
+                        dedup['saved_bytes'] = dedup['bytes_before'] - dedup['bytes_after']
+                        logging.info(f"Deduplicated {blob_report['rows']} snapshots: {blob_report['bytes_before']} -> {blob_report['bytes_after']} bytes")
+                except Exception as e:
+                    logging.error(f"Error deduplicating snapshots: {e}\n{traceback.format_exc()}")
+                    db.session.rollback()
+
+                if blob_report is not None and not blob_report['rows'] and config.COMPRESS_JSON_COLUMNS:
+                    # Once deduplication has caught up, compress rows written before compression was enabled.
+                    try:
+                        recompressed = services.recompress_json_columns(compression_cursors)
+                        if recompressed:
+                            app.TASK_STATUS[task_name]['compression']['rows_recompressed'] += recompressed
+                            logging.info(f"Recompressed {recompressed} rows")
+                    except Exception as e:
+                        logging.error(f"Error recompressing JSON columns: {e}\n{traceback.format_exc()}")
+                        db.session.rollback()
+
+                # Roll up snapshots past the retention period a batch of hub-days at a time. Once
+                # caught up, blobs only the removed snapshots used are deleted and the freed
+                # pages handed back to the filesystem.
+                if config.SNAPSHOT_RETENTION_DAYS > 0:
+                    try:
+                        retention = app.TASK_STATUS[task_name]['retention']
+                        cutoff_date = (now - timedelta(days=config.SNAPSHOT_RETENTION_DAYS)).strftime('%Y-%m-%d')
+                        rollup_report = services.roll_up_snapshots(cutoff_date)
+                        if rollup_report['days']:
+                            blob_sweep_pending = True
+                            retention['days_rolled_up'] += rollup_report['days']
+                            retention['snapshots_removed'] += rollup_report['snapshots']
+                            logging.info(f"Rolled up {rollup_report['snapshots']} snapshots of {rollup_report['days']} hub-days before {cutoff_date}")
+                        if blob_sweep_pending and rollup_report['days'] < config.SNAPSHOT_ROLLUP_BATCH_DAYS:
+                            # None while an import is running; the sweep is retried next cycle.
+                            blobs_removed = services.prune_snapshot_blobs()
+                            blob_sweep_pending = blobs_removed is None
+                            if blobs_removed:
+                                retention['blobs_removed'] += blobs_removed
+                                logging.info(f"Deleted {blobs_removed} unreferenced snapshot blobs")
+                        retention['pages_reclaimed'] += services.reclaim_free_pages()
+                    except Exception as e:
+                        logging.error(f"Error applying snapshot retention: {e}\n{traceback.format_exc()}")
+                        db.session.rollback()
+
+                # Score the days the dashboard shows once per cycle; unchanged hubs hit the cache.
+                try:
+                    services.refresh_hub_risks(all_hubs)
+                except Exception as e:
+                    logging.error(f"Error computing hub risks: {e}\n{traceback.format_exc()}")
+                    db.session.rollback()
+
+                # Keep the calendar's day summaries current a batch of hub-days at a time.
+                try:
+                    services.refresh_day_summaries(all_hubs, max_days=config.DAY_SUMMARY_BATCH_DAYS)
+                except Exception as e:
+                    logging.error(f"Error summarizing days for the calendar: {e}\n{traceback.format_exc()}")
+                    db.session.rollback()
+
+                app.TASK_STATUS[task_name]['hub_latency'] = dict(sorted(hub_latency.items(), key=lambda item: item[1], reverse=True))
+                app.TASK_STATUS[task_name]['http_connections'] = http_client.get_stats()
+                app.TASK_STATUS[task_name]['http_cache'] = dict(http_client.RESPONSE_CACHE_STATS)
                 app.TASK_STATUS[task_name]['last_success'] = datetime.utcnow().isoformat() + 'Z'
                 app.TASK_STATUS[task_name]['status'] = 'running'
                 app.TASK_STATUS[task_name]['last_error'] = None
+                metrics.TASK_CYCLES.inc(task_name, 'success')
 
         except Exception as e:
             error_str = traceback.format_exc()
             logging.error(f"Error in data_refresh_job: {e}\n{error_str}")
+            metrics.TASK_CYCLES.inc(task_name, 'error')
             with app.app_context():
                 app.TASK_STATUS[task_name]['status'] = 'error'
                 app.TASK_STATUS[task_name]['last_error'] = error_str
         finally:
             with app.app_context():
-                app.TASK_STATUS[task_name]['last_runtime'] = f"{time.time() - start_time:.2f}s"
+                elapsed = time.time() - start_time
+                metrics.TASK_CYCLE_SECONDS.observe(elapsed, task_name)
+                app.TASK_STATUS[task_name]['last_cycle_seconds'] = round(elapsed, 2)
+                app.TASK_STATUS[task_name]['last_runtime'] = f"{elapsed:.2f}s"
+            # Open admin panels refetch /api/admin/task-status when told to.
+            socketio.emit('task_status_changed', {'task': task_name}, to=ADMIN_ROOM)
             time.sleep(30)
 
 def init_tasks(app, socketio):
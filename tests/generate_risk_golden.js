@@ -0,0 +1,28 @@
+// Runs tests/fixtures/risk_cases.json through static/utils.js and static/analysis.js and
+// prints the results as JSON. test_risk_parity.py compares risk.py against the output.
+//
+// Regenerate the golden file after changing the dashboard's scoring:
+//   node tests/generate_risk_golden.js > tests/fixtures/risk_golden.json
+const fs = require('fs');
+const path = require('path');
+const vm = require('vm');
+
+const root = path.join(__dirname, '..');
+const context = vm.createContext({ window: {}, console });
+for (const file of ['utils.js', 'analysis.js']) {
+    vm.runInContext(fs.readFileSync(path.join(root, 'static', file), 'utf8'), context, { filename: file });
+}
+context.cases = JSON.parse(fs.readFileSync(path.join(__dirname, 'fixtures', 'risk_cases.json'), 'utf8'));
+
+// Inputs the browser code throws on are recorded as errors; risk.py must handle them without raising.
+const results = vm.runInContext(`cases.map(c => {
+    try {
+        const result = analyzeDayHours(c.hourly, c.date, c.tz, c.highlight, c.label, c.date, c.runways, c.faa, c.gsHours, c.gd, c.snapshots);
+        result.assessment = getDailyAssessment(result.percentHigh, result.percentPartial);
+        return { name: c.name, result };
+    } catch (e) {
+        return { name: c.name, error: String(e) };
+    }
+})`, context);
+
+process.stdout.write(JSON.stringify(results) + '\n');
@@ -0,0 +1,66 @@
+"""
+risk.py must score hub-days exactly like static/analysis.js and static/utils.js.
+Each case in fixtures/risk_cases.json is checked against the browser code's output
+in fixtures/risk_golden.json (see generate_risk_golden.js); when node is installed
+the JS is also run directly, so editing it without regenerating the golden file fails.
+"""
+import json
+import math
+import os
+import shutil
+import subprocess
+
+import pytest
+
+import risk
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+CASES = json.load(open(os.path.join(TESTS_DIR, "fixtures", "risk_cases.json")))
+GOLDEN = {entry["name"]: entry for entry in json.load(open(os.path.join(TESTS_DIR, "fixtures", "risk_golden.json")))}
+
+def _normalize(value):
+    """JSON round trip of a result, as the browser would see it; NaN becomes null like JSON.stringify."""
+    def clean(v):
+        if isinstance(v, float):
+            return None if math.isnan(v) else round(v, 9)
+        if isinstance(v, dict):
+            return {key: clean(item) for key, item in v.items()}
+        if isinstance(v, list):
+            return [clean(item) for item in v]
+        return v
+    return clean(json.loads(json.dumps(clean(value))))
+
+def _score(case):
+    result = risk.analyze_day_hours(
+        case["hourly"], case["date"], case["tz"], case["highlight"], case["label"], case["date"],
+        case["runways"], case["faa"], case["gsHours"], case["gd"], case["snapshots"]
+    )
+    result["assessment"] = risk.get_daily_assessment(result["percentHigh"], result["percentPartial"])
+    return _normalize(result)
+
+def test_golden_covers_every_case():
+    assert sorted(GOLDEN) == sorted(case["name"] for case in CASES)
+
+@pytest.mark.parametrize("case", CASES, ids=[case["name"] for case in CASES])
+def test_matches_analysis_js(case):
+    expected = GOLDEN[case["name"]]
+    result = _score(case)
+    if "error" in expected:
+        # The browser code throws on these (e.g. an unparseable startTime); the server skips the bad periods instead.
+        assert len(result["hourBlocks"]) == 24
+        return
+    assert result == _normalize(expected["result"])
+
+def test_malformed_runways_are_skipped():
+    runways = ["09/27", 5, [90, 9000], {"label": "18/36", "heading": 180, "len": 9000}]
+    assert [runway["label"] for runway in risk.analyze_runway_safety(runways, "W", 20, 0)] == ["18/36"]
+    assert risk.analyze_runway_safety(None, "W", 20, 0) == []
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="node is not installed")
+def test_golden_is_current():
+    output = subprocess.run(
+        ["node", os.path.join(TESTS_DIR, "generate_risk_golden.js")],
+        check=True, capture_output=True, text=True
+    ).stdout
+    current = {entry["name"]: entry for entry in json.loads(output)}
+    assert _normalize(current) == _normalize(GOLDEN), "analysis.js changed: regenerate fixtures/risk_golden.json and update risk.py"